@@ -1,23 +1,25 @@
-import Adafruit_GPIO.I2C as I2C
-
-import time
-import os
-import smbus
-bus = smbus.SMBus(1)
+import asyncio
+import signal
 
 import Adafruit_SSD1306
 
-from PIL import Image
-from PIL import ImageDraw
 from PIL import ImageFont
 
-import subprocess
+from hat_bus import FAN_SPEED_REG, RGB_EFFECT_REG, HatBus, RegisterShadow
+from oled_display import DirtyDisplay
+from sys_metrics import MetricsCollector
+from thermal_sampler import ThermalSampler
+
+bus_number = 1
+fan_on_temp = 55
+fan_off_temp = 48
+
+# Task periods, in seconds
+FAN_PERIOD = 1.0
+RGB_PERIOD = 16.0
+OLED_PERIOD = 2.0
 
-hat_addr = 0x0d
-rgb_effect_reg = 0x04
-fan_reg = 0x08
-fan_state = 2
-count = 0
+RGB_EFFECTS = (0x03, 0x04, 0x02, 0x01)
 
 # Raspberry Pi pin configuration:
 RST = None     # on the PiOLED this pin isnt used
@@ -25,30 +27,11 @@ RST = None     # on the PiOLED this pin isnt used
 # 128x32 display with hardware I2C:
 disp = Adafruit_SSD1306.SSD1306_128_32(rst=RST)
 
-# Initialize library.
-disp.begin()
-
-# Clear display.
-disp.clear()
-disp.display()
-
-# Create blank image for drawing.
-# Make sure to create image with mode '1' for 1-bit color.
-width = disp.width
-height = disp.height
-image = Image.new('1', (width, height))
-
-# Get drawing object to draw on image.
-draw = ImageDraw.Draw(image)
-
-# Draw a black filled box to clear the image.
-draw.rectangle((0,0,width,height), outline=0, fill=0)
-
 # Draw some shapes.
 # First define some constants to allow easy resizing of shapes.
 padding = -2
 top = padding
-bottom = height-padding
+bottom = disp.height-padding
 # Move left to right keeping track of the current x position for drawing shapes.
 x = 0
 
@@ -59,102 +42,126 @@ font = ImageFont.load_default()
 # Some other nice fonts to try: http://www.dafont.com/bitmap.php
 # font = ImageFont.truetype('Minecraftia.ttf', 8)
 
-def setFanSpeed(speed):
-    bus.write_byte_data(hat_addr, fan_reg, speed&0xff)
-
-def setRGBEffect(effect):
-    bus.write_byte_data(hat_addr, rgb_effect_reg, effect&0xff)
 
-def getCPULoadRate():
-    f1 = os.popen("cat /proc/stat", 'r')
-    stat1 = f1.readline()
-    count = 10
-    data_1 = []
-    for i  in range (count):
-        data_1.append(int(stat1.split(' ')[i+2]))
-    total_1 = data_1[0]+data_1[1]+data_1[2]+data_1[3]+data_1[4]+data_1[5]+data_1[6]+data_1[7]+data_1[8]+data_1[9]
-    idle_1 = data_1[3]
+class I2CArbiter:
+    """Serializes access to the shared i2c bus between tasks.
 
-    time.sleep(1)
+    Blocking transfers run in the default executor while the lock is held,
+    so the event loop keeps scheduling the other tasks meanwhile. A
+    cancelled task keeps the lock until its transfer ends, as the executor
+    thread cannot be interrupted: the next transfer, e.g. the final fan off
+    write, never overlaps it.
+    """
 
-    f2 = os.popen("cat /proc/stat", 'r')
-    stat2 = f2.readline()
-    data_2 = []
-    for i  in range (count):
-        data_2.append(int(stat2.split(' ')[i+2]))
-    total_2 = data_2[0]+data_2[1]+data_2[2]+data_2[3]+data_2[4]+data_2[5]+data_2[6]+data_2[7]+data_2[8]+data_2[9]
-    idle_2 = data_2[3]
+    def __init__(self):
+        self.lock = asyncio.Lock()
 
-    total = int(total_2-total_1)
-    idle = int(idle_2-idle_1)
-    usage = int(total-idle)
-    print("idle:"+str(idle)+"  total:"+str(total))
-    usageRate =int(float(usage * 100/ total))
-    print("usageRate:%d"%usageRate)
-    return "CPU:"+str(usageRate)+"%"
+    async def run(self, func, *args):
+        async with self.lock:
+            future = asyncio.get_running_loop().run_in_executor(None, func, *args)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                await asyncio.wait([future])
+                raise
 
 
-def run(cmd: str) -> str:
-    return subprocess.check_output(cmd, shell=True, text=True)
-
-
-def setOLEDshow():
-    # Draw a black filled box to clear the image.
-    draw.rectangle((0,0,width,height), outline=0, fill=0)
-
-    #cmd = "top -bn1 | grep load | awk '{printf \"CPU:%.0f%%\", $(NF-2)*100}'"
-    #CPU = run(cmd)
-    CPU = getCPULoadRate()
-
-    cmd = os.popen('vcgencmd measure_temp').readline()
-    CPU_TEMP = cmd.replace("temp=","Temp:").replace("'C\n","C")
-    global g_temp
-    g_temp = float(cmd.replace("temp=","").replace("'C\n",""))
-
-    cmd = "free -m | awk 'NR==2{printf \"RAM:%s/%s MB\", $2-$3,$2}'"
-    MemUsage = run(cmd)
-
-    cmd = "df -h | awk '$NF==\"/\"{printf \"Disk:%d/%dMB\", ($2-$3)*1024,$2*1024}'"
-    Disk = run(cmd)
-
-    cmd = "hostname -I | cut -d\' \' -f1"
-    IP = run(cmd)
+def renderOLED(display: DirtyDisplay, metrics: MetricsCollector):
+    # Slow part of the display refresh: collect stats and draw, without the bus.
+    # Only fields whose text changed are redrawn, from cached rasters.
+    CPU = "CPU:%d%%" % metrics.get('cpu')
+    CPU_TEMP = "Temp:%.1fC" % metrics.get('temp')
+    MemUsage = "RAM:%d/%d MB" % metrics.get('mem')
+    Disk = "Disk:%d/%dMB" % metrics.get('disk')
+    IP = metrics.get('ip')
 
     # Write two lines of text.
 
-    draw.text((x, top), str(CPU), font=font, fill=255)
-    draw.text((x+56, top), str(CPU_TEMP), font=font, fill=255)
-    draw.text((x, top+8), str(MemUsage),  font=font, fill=255)
-    draw.text((x, top+16), str(Disk),  font=font, fill=255)
-    draw.text((x, top+24), "wlan0:" + str(IP),  font=font, fill=255)
-
-    # Display image.
-    disp.image(image)
-    disp.display()
-    time.sleep(.1)
-
-setFanSpeed(0x00)
-setRGBEffect(0x03)
-
-while True:
-    setOLEDshow()
-    if g_temp >= 55:
-        if fan_state != 1:
-            setFanSpeed(0x01)
+    display.set_text('cpu', (x, top), CPU)
+    display.set_text('temp', (x+56, top), CPU_TEMP)
+    display.set_text('mem', (x, top+8), MemUsage)
+    display.set_text('disk', (x, top+16), Disk)
+    display.set_text('ip', (x, top+24), "wlan0:" + IP)
+    return display.spans()
+
+
+async def fanTask(arbiter: I2CArbiter, registers: RegisterShadow, sampler: ThermalSampler):
+    # Own temperature source and period, so display refresh never delays it
+    fan_state = 0
+    loop = asyncio.get_running_loop()
+    deadline = loop.time()
+    while True:
+        temp = sampler.read()
+        if temp >= fan_on_temp:
             fan_state = 1
-    elif g_temp <= 48:
-        if fan_state != 0:
-            setFanSpeed(0x00)
+        elif temp <= fan_off_temp:
             fan_state = 0
-
-    if count == 10:
-        setRGBEffect(0x04)
-    elif count == 20:
-        setRGBEffect(0x02)
-    elif count == 30:
-        setRGBEffect(0x01)
-    elif count == 40:
-        setRGBEffect(0x03)
-        count = 0
-    count += 1
-    time.sleep(.5)
+        # Shadow skips the write while the state is unchanged
+        await arbiter.run(registers.write, FAN_SPEED_REG, 0x01 if fan_state else 0x00)
+        deadline += FAN_PERIOD
+        await asyncio.sleep(max(0.0, deadline - loop.time()))
+
+
+async def rgbTask(arbiter: I2CArbiter, registers: RegisterShadow):
+    count = 0
+    while True:
+        await arbiter.run(registers.write, RGB_EFFECT_REG, RGB_EFFECTS[count])
+        count = (count + 1) % len(RGB_EFFECTS)
+        await asyncio.sleep(RGB_PERIOD)
+
+
+async def oledTask(arbiter: I2CArbiter):
+    loop = asyncio.get_running_loop()
+    await arbiter.run(disp.begin)
+    await arbiter.run(disp.clear)
+    await arbiter.run(disp.display)
+    display = DirtyDisplay(disp, font)
+    metrics = MetricsCollector()
+    while True:
+        start = loop.time()
+        spans = await loop.run_in_executor(None, renderOLED, display, metrics)
+        # One changed page range per bus turn, so the fan never waits for a whole frame
+        for span in spans:
+            await arbiter.run(display.push_span, span)
+        await asyncio.sleep(max(0.0, OLED_PERIOD - (loop.time() - start)))
+
+
+async def main():
+    arbiter = I2CArbiter()
+    hat = HatBus(bus_number, pec=False)
+    registers = RegisterShadow(hat)
+    sampler = ThermalSampler()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    await arbiter.run(registers.write, FAN_SPEED_REG, 0x00)
+    tasks = [
+        asyncio.create_task(fanTask(arbiter, registers, sampler)),
+        asyncio.create_task(rgbTask(arbiter, registers)),
+        asyncio.create_task(oledTask(arbiter)),
+    ]
+    waiter = asyncio.create_task(stop.wait())
+    try:
+        # Stop on signal, or as soon as any task fails
+        await asyncio.wait(tasks + [waiter], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks + [waiter]:
+            task.cancel()
+        results = await asyncio.gather(*tasks, waiter, return_exceptions=True)
+        try:
+            await arbiter.run(registers.write, FAN_SPEED_REG, 0x00, True)
+            await arbiter.run(disp.clear)
+            await arbiter.run(disp.display)
+        finally:
+            hat.close()
+            sampler.close()
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Memory and CPU cost of each extra hat driven by the daemon, and isolation of a slow bus.
+#
+# Creates 1 to `--devices` extra hats spread over `--buses` simulated i2c
+# buses, each with its own temperature file, and runs their bus workers
+# for `--seconds` with a fixed check interval. For each count it reports
+# the Python memory allocated per hat, the resident memory growth, the CPU
+# time per check and the CPU share of one hat at the default 2 s polling.
+# With `--slow-bus-ms`, every transfer on bus 0 stalls that long, and every
+# check writes the fan register; the checks done on the other buses show
+# whether they were delayed.
+#
+# Usage: python3 benchmarks/bench_devices.py [--devices 16] [--buses 2] [--seconds 3] [--slow-bus-ms 200]
+
+import argparse
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fan_devices import create_workers, stop_workers  # noqa: E402
+from fan_settings import Settings  # noqa: E402
+from fan_simulator import FakeSMBus, SimulatedHat  # noqa: E402
+
+BASE_ADDRESS = 0x0d
+"""i2c address of the first hat of each bus, the next ones count up."""
+
+
+class Backplane:
+    """Simulated hats on several buses, usable as `HatBus` factory."""
+
+    def __init__(self, slow_bus_seconds: float = 0.0):
+        """Create an empty backplane.
+
+        Args:
+            slow_bus_seconds (float): stall of every transfer on bus 0, in seconds
+        """
+        self.hats: Dict[Tuple[int, int], SimulatedHat] = {}
+        """Hats, by bus number and address."""
+        self.slow_bus_seconds = slow_bus_seconds
+        """Stall of every transfer on bus 0, in seconds."""
+
+    def add(self, bus_number: int, address: int) -> SimulatedHat:
+        hat = SimulatedHat(address=address)
+        self.hats[(bus_number, address)] = hat
+        return hat
+
+    def open(self, bus_number: int) -> FakeSMBus:
+        return FakeSMBus(_BusRouter(self, bus_number))
+
+
+class _BusRouter:
+    """One bus of a `Backplane`, routing transfers by address like a real adapter."""
+
+    def __init__(self, backplane: Backplane, bus_number: int):
+        self.backplane = backplane
+        self.bus_number = bus_number
+
+    def transfer(self, device_addr: int, register: int, values):
+        if self.bus_number == 0 and self.backplane.slow_bus_seconds:
+            time.sleep(self.backplane.slow_bus_seconds)
+        hat = self.backplane.hats.get((self.bus_number, device_addr))
+        if hat is None:
+            raise OSError(f"No device at address {hex(device_addr)}")
+        hat.transfer(device_addr, register, values)
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def run(count: int, buses: int, seconds: float, interval: float, slow_bus_seconds: float,
+        directory: str) -> Dict[str, float]:
+    """Run `count` extra hats for a while.
+
+    Returns:
+        Dict[str, float]: measurements
+    """
+    logger = logging.getLogger("bench-devices")
+    backplane = Backplane(slow_bus_seconds)
+    # Curve mode decides a level on every check; a slow bus is only seen when checks write to it
+    base = Settings(min_sleep_seconds=interval, sleep_seconds=interval, max_sleep_seconds=interval,
+                    control_mode='curve', refresh_seconds=interval / 2 if slow_bus_seconds else 60.0)
+    devices = {}
+    for index in range(count):
+        bus_number, address = index % buses, BASE_ADDRESS + index // buses
+        temp_file = os.path.join(directory, f"temp{index}")
+        with open(temp_file, 'w') as f:
+            f.write(f"{50000 + index * 500}\n")
+        backplane.add(bus_number, address)
+        devices[f"hat{index}"] = base.replace(bus_number=bus_number, device_address=address, sensors=temp_file)
+
+    # Memory of the hats and their first checks, traced apart as tracing slows every call
+    rss_start = rss_bytes()
+    tracemalloc.start()
+    workers = create_workers(devices, logger, bus_factory=backplane.open)
+    all_devices: List = [device for worker in workers for device in worker.devices]
+    for worker in workers:
+        worker.start()
+    time.sleep(interval * 3)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_growth = rss_bytes() - rss_start
+
+    start_ticks = [device.ticks for device in all_devices]
+    start_tick_cpu = sum(device.cpu_seconds for device in all_devices)
+    cpu_start = time.process_time()
+    time.sleep(seconds)
+    cpu_seconds = time.process_time() - cpu_start
+    ticks = [device.ticks - start for device, start in zip(all_devices, start_ticks)]
+    tick_cpu = sum(device.cpu_seconds for device in all_devices) - start_tick_cpu
+    stop_workers(workers)
+
+    fast = [count for device, count in zip(all_devices, ticks) if device.settings.bus_number != 0]
+    return {
+        'alloc_per_hat': allocated / count,
+        'rss_per_hat': rss_growth / count,
+        'us_per_tick': tick_cpu / sum(ticks) * 1e6 if sum(ticks) else 0.0,
+        'cpu_share': cpu_seconds / seconds / count,
+        'expected_ticks': seconds / interval,
+        'other_bus_ticks': sum(fast) / len(fast) if fast else float('nan'),
+        'slow_bus_ticks': min(count for device, count in zip(all_devices, ticks) if device.settings.bus_number == 0),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure memory and CPU per extra hat, and bus isolation.")
+    parser.add_argument("--devices", type=int, default=16, help="largest number of extra hats")
+    parser.add_argument("--buses", type=int, default=2, help="number of i2c buses")
+    parser.add_argument("--seconds", type=float, default=3.0, help="run time per count")
+    parser.add_argument("--interval", type=float, default=0.05, help="check interval of every hat, in seconds")
+    parser.add_argument("--slow-bus-ms", type=float, default=0.0, help="stall of every transfer on bus 0, in ms")
+    args = parser.parse_args()
+
+    logging.getLogger("bench-devices").addHandler(logging.NullHandler())
+    logging.getLogger("bench-devices").propagate = False
+    counts = [count for count in (1, 2, 4, 8, 16, 32, 64) if count <= args.devices]
+    print(f"{'hats':>5} {'alloc/hat':>10} {'rss/hat':>9} {'us/check':>9} {'cpu/hat':>8} {'at 2s':>8} "
+          f"{'checks':>7} {'other bus':>9} {'bus 0':>6}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in counts:
+            result = run(count, args.buses, args.seconds, args.interval, args.slow_bus_ms / 1000.0, directory)
+            print(f"{count:5d} {result['alloc_per_hat'] / 1024:8.1f}KB {result['rss_per_hat'] / 1024:7.1f}KB "
+                  f"{result['us_per_tick']:9.1f} {result['cpu_share'] * 100:7.2f}% "
+                  f"{result['us_per_tick'] / 2e6 * 100:7.4f}% {result['expected_ticks']:7.0f} "
+                  f"{result['other_bus_ticks']:9.0f} {result['slow_bus_ticks']:6d}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
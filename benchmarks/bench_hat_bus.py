@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# Compare cost per fan write: open-per-write vs. persistent `HatBus` session.
+#
+# Needs a real yahboom RGB fan hat. Writes `--value` (fan off by default)
+# repeatedly to the fan speed register.
+#
+# Usage: python3 benchmarks/bench_hat_bus.py [--bus 1] [--count 500] [--value 0]
+
+import argparse
+import os
+import sys
+import time
+
+import smbus2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hat_bus import DEVICE_ADDR, FAN_SPEED_REG, HatBus  # noqa: E402
+
+
+def open_per_write(bus_number: int, count: int, value: int) -> float:
+    """Original daemon path: open, enable PEC, write and close on every write.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        with smbus2.SMBus(bus_number) as bus:
+            bus.enable_pec(True)
+            bus.write_byte_data(DEVICE_ADDR, FAN_SPEED_REG, value)
+    return time.perf_counter() - start
+
+
+def persistent_session(bus_number: int, count: int, value: int) -> float:
+    """`HatBus` path: one open, then only writes.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start = time.perf_counter()
+    with HatBus(bus_number) as hat:
+        for _ in range(count):
+            hat.write_byte_data(FAN_SPEED_REG, value)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cost per fan write: open-per-write vs. persistent session.")
+    parser.add_argument("--bus", type=int, default=1, help="i2c bus number")
+    parser.add_argument("--count", type=int, default=500, help="writes per run")
+    parser.add_argument("--value", type=lambda v: int(v, 0), default=0x00,
+                        help="fan speed value to write")
+    args = parser.parse_args()
+
+    results = [
+        ("open-per-write", open_per_write(args.bus, args.count, args.value)),
+        ("persistent", persistent_session(args.bus, args.count, args.value)),
+    ]
+    for name, elapsed in results:
+        print(f"{name:>16}: {elapsed / args.count * 1e6:9.1f} us/write")
+    print(f"{'speedup':>16}: {results[0][1] / results[1][1]:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
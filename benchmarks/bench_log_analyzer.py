@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Throughput of the log analyzer on rotated and compressed daemon logs of several hosts, sequential vs. process pool.
+#
+# Writes `--hosts` directories of synthetic daemon logs, like a debug level
+# daemon checking every `--interval` seconds: a temperature line per check,
+# fan actions around the trigger temperature, restarts and i2c error bursts.
+# Each host gets `--mb` MB of logs, rotated in 5 MB files as `setup_logging()`
+# does, the oldest rotations compressed with gzip, bzip2 and xz. It then
+# times the analysis with one process and with `--jobs` processes, and
+# reports the peak Python memory of a single host analysis.
+#
+# Usage: python3 benchmarks/bench_log_analyzer.py [--hosts 4] [--mb 50] [--jobs 4]
+
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from log_analyzer import LOG_NAME, analyze, analyze_host, find_hosts  # noqa: E402
+
+ROTATE_BYTES = 5 * 1024 * 1024
+"""Size of each rotated log file, in bytes."""
+COMPRESSORS = (lzma.open, bz2.open, gzip.open)
+"""Compressors of the oldest rotations, from the oldest."""
+
+
+def log_line(now: float, level: str, message: str) -> str:
+    return f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))},{int(now % 1 * 1000):03d} - {level} - {message}\n"
+
+
+def write_host(directory: str, size: int, interval: float, seed: int):
+    """Write the rotated logs of one host, oldest rotation with the highest number."""
+    rng = random.Random(seed)
+    now = time.time() - size / 60 * interval
+    temp, fan_on = 50.0, False
+    lines = [log_line(now, "INFO", "Starting yahboom-fan-ctrl log."),
+             log_line(now, "INFO", "Initial Temp: 50.00°C, trigger temp: >=55.00°C, hys. temp: -10.00°C."),
+             log_line(now, "INFO", "Initial fan level: 0%.")]
+    files, written = [], 0
+    while written < size:
+        chunk = []
+        chunk_size = 0
+        while chunk_size < ROTATE_BYTES and written + chunk_size < size:
+            now += interval
+            temp += rng.gauss(-0.4 if fan_on else 0.15, 0.3)
+            if not fan_on and temp >= 55.0 or fan_on and temp <= 45.0:
+                fan_on = not fan_on
+                line = log_line(now, "INFO", f"Temp: {temp:.2f}°C, Fan action: {'ON' if fan_on else 'OFF'}")
+            elif rng.random() < 0.0005:
+                line = "".join(log_line(now + i, "WARNING", f"Write i2c error, attempt {i + 2}: [Errno 121] Remote I/O error") for i in range(2))
+            elif rng.random() < 0.00002:
+                line = (log_line(now, "INFO", "Caught terminate signal 'SIGTERM - Terminated'. Turn fan off.\n") +
+                        log_line(now + 30, "INFO", "Starting yahboom-fan-ctrl log.") +
+                        log_line(now + 30, "INFO", f"Initial Temp: {temp:.2f}°C, trigger temp: >=55.00°C, hys. temp: -10.00°C."))
+                now += 30
+            else:
+                line = log_line(now, "DEBUG", f"Temp: {temp:.2f}°C, Fan action: {'ON' if fan_on else 'OFF'}")
+            chunk.append(line)
+            chunk_size += len(line.encode())
+        files.append("".join(lines + chunk).encode())
+        lines = []
+        written += chunk_size
+    # Newest file is the log file itself, older ones '.1' to '.N'
+    for number, data in enumerate(reversed(files)):
+        name = LOG_NAME if number == 0 else f"{LOG_NAME}.{number}"
+        compressed = len(files) - 1 - number
+        if number > 1 and compressed < len(COMPRESSORS):
+            opener = COMPRESSORS[compressed]
+            name += {lzma.open: ".xz", bz2.open: ".bz2", gzip.open: ".gz"}[opener]
+            with opener(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+        else:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(data)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure log analyzer throughput, sequential and parallel.")
+    parser.add_argument("--hosts", type=int, default=4, help="number of hosts")
+    parser.add_argument("--mb", type=float, default=50.0, help="uncompressed log size per host, in MB")
+    parser.add_argument("--interval", type=float, default=1.0, help="check interval of the logged daemon, in seconds")
+    parser.add_argument("--jobs", type=int, default=0, help="number of processes (default: one per CPU)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        for index in range(args.hosts):
+            directory = os.path.join(root, f"pi{index}")
+            os.mkdir(directory)
+            write_host(directory, int(args.mb * 1e6), args.interval, index)
+        hosts = find_hosts([root])
+        files = sum(len(paths) for paths in hosts.values())
+        total = args.hosts * args.mb
+
+        start = time.perf_counter()
+        reports = analyze(hosts, 55.0, jobs=1)
+        sequential = time.perf_counter() - start
+        start = time.perf_counter()
+        analyze(hosts, 55.0, jobs=args.jobs)
+        parallel = time.perf_counter() - start
+        tracemalloc.start()
+        analyze_host(*next(iter(hosts.items())), 55.0)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    report = reports[0]
+    print(f"{args.hosts} hosts, {files} files, {total:.0f} MB uncompressed")
+    print(f"Sequential: {sequential:.2f}s, {total / sequential:.0f} MB/s")
+    print(f"Process pool ({args.jobs or os.cpu_count()} jobs): {parallel:.2f}s, {total / parallel:.0f} MB/s, "
+          f"x{sequential / parallel:.1f}")
+    print(f"Peak memory of one host: {peak / 1024:.0f} KB, for {args.mb:.0f} MB of logs")
+    print(f"{report['host']}: {report['hours']:.1f}h, duty {report['duty_cycle']:.1f}%, "
+          f"{report['toggles_per_hour']:.2f} toggles/h, {report['above_trigger']:.1f}% above trigger, "
+          f"{report['i2c_errors']} i2c errors in {report['i2c_bursts']} bursts")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# Measure how long the control loop blocks on a log call: direct handlers vs. `LogWriter` queue.
+#
+# Each run logs the daemon's per-tick debug line into a small rotating log
+# file, so rotations happen during the run, and `--stall-every` calls also
+# hit a handler that sleeps `--stall-ms`, like a slow SD card or a busy
+# journal. Reported times are what the caller waits, per call, next to
+# the records the queued writer dropped: a fast path that loses the log
+# would not be a gain.
+#
+# Usage: python3 benchmarks/bench_logging.py [--count 20000] [--stall-every 500] [--stall-ms 20]
+
+import argparse
+import logging
+import logging.handlers
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from log_pipeline import COALESCE_SECONDS, LogWriter  # noqa: E402
+
+
+class StallingHandler(logging.Handler):
+    """Handler that sleeps on every n-th record."""
+
+    def __init__(self, every: int, seconds: float):
+        super().__init__()
+        self.every = every
+        self.seconds = seconds
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+        if self.every and self.count % self.every == 0:
+            time.sleep(self.seconds)
+
+
+def make_handlers(directory: str, stall_every: int, stall_ms: float):
+    fh = logging.handlers.RotatingFileHandler(
+        os.path.join(directory, "bench.log"), encoding='utf-8', maxBytes=64 * 1024, backupCount=3)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    return [fh, StallingHandler(stall_every, stall_ms / 1000.0)]
+
+
+def run(logger: logging.Logger, count: int, lazy: bool) -> list:
+    """Log the per-tick line `count` times.
+
+    Returns:
+        list: seconds blocked per call
+    """
+    times = []
+    temperature = 55.0
+    for i in range(count):
+        temperature = 55.0 + (i % 7) * 0.01
+        start = time.perf_counter()
+        if lazy:
+            logger.debug("Temp: %.2f°C, Fan action: %s", temperature, "ON")
+        else:
+            logger.debug(f"Temp: {temperature:.2f}°C, Fan action: ON")
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(name: str, times: list, dropped: int):
+    times = sorted(times)
+    n = len(times)
+    print(f"{name:>8}: mean {sum(times) / n * 1e6:9.2f} us, p99 {times[int(n * 0.99)] * 1e6:9.2f} us, "
+          f"max {times[-1] * 1e3:8.2f} ms, total {sum(times) * 1e3:8.1f} ms, dropped {dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure control loop blocking on logging: direct handlers vs. queued writer.")
+    parser.add_argument("--count", type=int, default=20000, help="log calls per run")
+    parser.add_argument("--stall-every", type=int, default=500, help="records between handler stalls, 0 for none")
+    parser.add_argument("--stall-ms", type=float, default=20.0, help="handler stall, in milliseconds")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        direct = logging.getLogger("bench-direct")
+        direct.setLevel(logging.DEBUG)
+        direct.propagate = False
+        for handler in make_handlers(directory, args.stall_every, args.stall_ms):
+            direct.addHandler(handler)
+        report("direct", run(direct, args.count, lazy=False), 0)
+
+        # Without coalescing, every record reaches the stalling handlers
+        for name, coalesce_seconds in (("queued", COALESCE_SECONDS), ("no coal.", 0.0)):
+            queued = logging.getLogger(f"bench-{name}")
+            queued.setLevel(logging.DEBUG)
+            queued.propagate = False
+            writer = LogWriter(make_handlers(directory, args.stall_every, args.stall_ms), coalesce_seconds)
+            queued.addHandler(writer.handler)
+            writer.start()
+            times = run(queued, args.count, lazy=True)
+            writer.stop(timeout=60.0)
+            report(name, times, writer.handler.dropped)
+            print(f"{'':>8}  {writer.records_written} records written, {writer.records_coalesced} coalesced")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Measure daemon startup: import time of `fan_temp_hysteresis`, and time to its first fan write.
+#
+# Each run starts a fresh interpreter. Import time comes from
+# `python -X importtime`. Time to first write runs the daemon's `main()`,
+# with `HatBus.write_byte_data` wrapped to stop the process on the first
+# write: it is measured from process spawn, so it includes interpreter
+# startup, imports, configuration, temperature read and the i2c write.
+# With `--dry-run` the write is not sent to the hat, so it also runs while
+# the daemon service owns the fan, and `--temp-file` reads the temperature
+# from another file, for machines without a thermal zone. Run from the install directory, or pass
+# `--config-dir`, so the daemon finds its configuration file.
+#
+# Usage: python3 benchmarks/bench_startup.py [--runs 10] [--dry-run] [--temp-file FILE] [--config-dir DIR]
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CHILD = """
+import os, sys, time
+sys.path.insert(0, {repo!r})
+import hat_bus
+write = hat_bus.HatBus.write_byte_data
+def first_write(self, register, value):
+    if not {dry_run!r}:
+        write(self, register, value)
+    sys.stdout.write("first_write %.6f\\n" % time.perf_counter())
+    sys.stdout.flush()
+    os._exit(0)
+hat_bus.HatBus.write_byte_data = first_write
+import thermal_sampler
+if {temp_file!r}:
+    thermal_sampler.CPU_TEMP_FILE = {temp_file!r}
+import fan_temp_hysteresis
+fan_temp_hysteresis.main()
+"""
+
+
+def import_time() -> float:
+    """Import `fan_temp_hysteresis` in a fresh interpreter.
+
+    Returns:
+        float: cumulative import time, in seconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {REPO_DIR!r}); import fan_temp_hysteresis"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    match = re.search(r"\|\s*(\d+) \| fan_temp_hysteresis$", result.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1e6
+
+
+def time_to_first_write(config_dir: str, dry_run: bool, temp_file: str) -> float:
+    """Start the daemon and wait for its first fan write.
+
+    Args:
+        config_dir (str): working directory of the daemon
+        dry_run (bool): whether to skip sending the write to the hat
+        temp_file (str): temperature file, empty for the daemon default
+
+    Returns:
+        float: seconds from process spawn to first write
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(repo=REPO_DIR, dry_run=dry_run, temp_file=temp_file)],
+        cwd=config_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=60)
+    end = time.perf_counter()
+    if "first_write" not in result.stdout:
+        raise RuntimeError(f"daemon exited without writing:\n{result.stderr}")
+    return end - start
+
+
+def report(name: str, values: list):
+    print(f"{name:>20}: median {statistics.median(values) * 1e3:8.1f} ms, "
+          f"min {min(values) * 1e3:8.1f} ms, max {max(values) * 1e3:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure daemon import time and time to first fan write.")
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters per measurement")
+    parser.add_argument("--dry-run", action="store_true", help="do not send the first write to the hat")
+    parser.add_argument("--temp-file", default="", help="temperature file, in millidegrees Celsius")
+    parser.add_argument("--config-dir", default=os.getcwd(), help="working directory of the daemon")
+    args = parser.parse_args()
+
+    report("import", [import_time() for _ in range(args.runs)])
+    report("first write", [time_to_first_write(args.config_dir, args.dry_run, args.temp_file) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Compare cost per OLED refresh: shell-outs of RGB_Cooling_HAT.py vs. `MetricsCollector`.
+#
+# The original path also slept 1 s between its two /proc/stat reads; that
+# sleep is excluded here, only process and parsing cost is measured.
+# Commands missing on this machine (like vcgencmd) still cost a fork.
+#
+# Usage: python3 benchmarks/bench_sys_metrics.py [--count 50]
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sys_metrics import MetricsCollector  # noqa: E402
+from thermal_sampler import CPU_TEMP_FILE  # noqa: E402
+
+SHELL_COMMANDS = [
+    "cat /proc/stat",
+    "cat /proc/stat",
+    "vcgencmd measure_temp",
+    "free -m | awk 'NR==2{printf \"RAM:%s/%s MB\", $2-$3,$2}'",
+    "df -h | awk '$NF==\"/\"{printf \"Disk:%d/%dMB\", ($2-$3)*1024,$2*1024}'",
+    "hostname -I | cut -d' ' -f1",
+]
+"""Commands run by one refresh of the original `setOLEDshow()`."""
+
+
+def shell_refresh(count: int) -> float:
+    """Original path: one process (or pipeline) per metric.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        for cmd in SHELL_COMMANDS:
+            subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def collector_refresh(count: int, temp_file: str, force: bool) -> float:
+    """`MetricsCollector` path, reading every metric or using the cache.
+
+    Returns:
+        float: elapsed seconds
+    """
+    metrics = MetricsCollector(temp_file=temp_file)
+    start = time.perf_counter()
+    for _ in range(count):
+        for name in ('cpu', 'temp', 'mem', 'disk', 'ip'):
+            metrics.get(name, force)
+    elapsed = time.perf_counter() - start
+    metrics.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cost per OLED refresh: shell-outs vs. in-process collector.")
+    parser.add_argument("--count", type=int, default=50, help="refreshes per run")
+    args = parser.parse_args()
+
+    temp_file = CPU_TEMP_FILE
+    tmp = None
+    if not os.path.exists(temp_file):
+        tmp = tempfile.NamedTemporaryFile('w', suffix='-temp', delete=False)
+        tmp.write("48312\n")
+        tmp.close()
+        temp_file = tmp.name
+    try:
+        results = [
+            ("shell-outs", shell_refresh(args.count)),
+            ("collector", collector_refresh(args.count, temp_file, True)),
+            ("collector cached", collector_refresh(args.count, temp_file, False)),
+        ]
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+    for name, elapsed in results:
+        print(f"{name:>17}: {elapsed / args.count * 1e3:9.3f} ms/refresh")
+    print(f"{'speedup':>17}: {results[0][1] / results[1][1]:9.1f}x (uncached)")
+
+
+if __name__ == "__main__":
+    main()
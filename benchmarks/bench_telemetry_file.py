@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# Cost of the binary telemetry file: append time, file size, card writes, and reading it while written.
+#
+# Appends `--samples` samples to a temporary telemetry file holding a week
+# at `--interval` seconds, and reports the time per append next to the
+# in-memory telemetry ring, the file size, and the pages the kernel has to
+# write back per hour at that interval: the header page plus the record
+# pages dirtied during each `--writeback-seconds` (the kernel's
+# dirty_expire_centisecs). It then reads the whole file as tuples and,
+# when NumPy is installed, as a zero-copy structured view and an ordered copy.
+#
+# Usage: python3 benchmarks/bench_telemetry_file.py [--samples 200000] [--interval 1.0] [--writeback-seconds 30]
+
+import argparse
+import math
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from telemetry import TelemetryRing  # noqa: E402
+from telemetry_file import RECORD, TelemetryFile, TelemetryFileReader, file_size  # noqa: E402
+
+WEEK_SECONDS = 7 * 24 * 3600
+"""Seconds in a week."""
+
+
+def time_appends(append, samples: int) -> float:
+    """Time appends of synthetic samples.
+
+    Returns:
+        float: time per append, in seconds
+    """
+    start = time.perf_counter()
+    for i in range(samples):
+        append(1.7e9 + i, 45.0 + (i % 100) * 0.1, (i // 50 % 2) * 100)
+    return (time.perf_counter() - start) / samples
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the cost of the binary telemetry file.")
+    parser.add_argument("--samples", type=int, default=200000, help="number of samples appended")
+    parser.add_argument("--interval", type=float, default=1.0, help="time between samples, in seconds")
+    parser.add_argument("--writeback-seconds", type=float, default=30.0,
+                        help="age of dirty pages written back by the kernel, in seconds")
+    args = parser.parse_args()
+
+    capacity = math.ceil(WEEK_SECONDS / args.interval)
+    ring = TelemetryRing(args.samples)
+    ring_time = time_appends(lambda t, temp, level: ring.append(t, temp, level, 0.0), args.samples)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fan.tlm")
+        start = time.perf_counter()
+        telemetry_file = TelemetryFile(path, capacity)
+        create_time = time.perf_counter() - start
+        file_time = time_appends(telemetry_file.append, args.samples)
+        blocks = os.stat(path).st_blocks * 512
+
+        reader = TelemetryFileReader(path)
+        start = time.perf_counter()
+        samples = reader.samples()
+        tuples_time = time.perf_counter() - start
+        try:
+            import numpy  # noqa: F401, imported before timing the views
+        except ImportError:
+            ring_view = array = None
+        else:
+            start = time.perf_counter()
+            ring_view = reader.ring()
+            view_time = time.perf_counter() - start
+            start = time.perf_counter()
+            array = reader.array()
+            array_time = time.perf_counter() - start
+        assert len(samples) == min(args.samples, capacity)
+
+        print(f"Append: {file_time * 1e6:.2f} us per sample to the file, "
+              f"{ring_time * 1e6:.2f} us to the in-memory ring")
+        print(f"File: {capacity} samples, a week at {args.interval:g}s: {file_size(capacity) / 1e6:.2f} MB, "
+              f"{blocks / 1e6:.2f} MB allocated, {RECORD.size} bytes per sample, created in {create_time * 1000:.1f} ms")
+        per_period = args.writeback_seconds / args.interval * RECORD.size / mmap.PAGESIZE
+        pages = (1 + math.ceil(per_period) + (1 if per_period % 1 else 0)) * 3600 / args.writeback_seconds
+        print(f"Card writes: at most {pages:.0f} pages of {mmap.PAGESIZE} bytes per hour "
+              f"({pages * mmap.PAGESIZE / 1024:.0f} KB), whatever the number of appends")
+        print(f"Read {len(samples)} samples: {tuples_time * 1000:.1f} ms as tuples", end="")
+        if array is None:
+            print(", NumPy not installed")
+        else:
+            print(f", {view_time * 1e6:.0f} us as zero-copy ring view, {array_time * 1000:.1f} ms as ordered array "
+                  f"(mean temp {array['temp'].mean() / 100:.2f}°C)")
+            del ring_view, array
+        reader.close()
+        telemetry_file.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
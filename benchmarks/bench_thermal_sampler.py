@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Compare cost per temperature sample: open/readline/float vs. `ThermalSampler`.
+#
+# Uses the real CPU temperature file when present, otherwise a temporary
+# file with a fixed value, so it also runs on machines without sensors.
+# Then times one `SensorSet` pass plus max fusion for 1 to `--sensors`
+# copies of that file, to check the cost per sensor stays flat.
+#
+# Usage: python3 benchmarks/bench_thermal_sampler.py [--path FILE] [--count 100000] [--sensors 8]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from thermal_sampler import CPU_TEMP_FILE, FusionPolicies, SensorFusion, SensorSet, ThermalSampler  # noqa: E402
+
+
+def open_per_read(path: str, count: int) -> float:
+    """Original path: open, readline, strip, float and close on every sample.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        with open(path, 'r') as f:
+            temp_str = f.readline()
+            float(temp_str.strip()) / 1000.0
+    return time.perf_counter() - start
+
+
+def persistent_pread(path: str, count: int) -> float:
+    """`ThermalSampler` path: one open, then only pread.
+
+    Returns:
+        float: elapsed seconds
+    """
+    start = time.perf_counter()
+    with ThermalSampler(path) as sampler:
+        for _ in range(count):
+            sampler.read()
+    return time.perf_counter() - start
+
+
+def sensor_pass(path: str, count: int, sensors: int) -> float:
+    """`SensorSet` path: one pread per sensor, then max fusion.
+
+    Returns:
+        float: elapsed seconds
+    """
+    sensor_set = SensorSet({f"sensor{i}": path for i in range(sensors)})
+    fusion = SensorFusion(sensor_set.names, FusionPolicies.MAX)
+    start = time.perf_counter()
+    for _ in range(count):
+        fusion.fuse(sensor_set.read(), 55.0)
+    elapsed = time.perf_counter() - start
+    sensor_set.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare cost per temperature sample: open/readline/float vs. pread.")
+    parser.add_argument("--path", default=CPU_TEMP_FILE, help="temperature file")
+    parser.add_argument("--count", type=int, default=100000, help="samples per run")
+    parser.add_argument("--sensors", type=int, default=8, help="largest sensor set")
+    args = parser.parse_args()
+
+    path = args.path
+    tmp = None
+    if not os.path.exists(path):
+        tmp = tempfile.NamedTemporaryFile('w', suffix='-temp', delete=False)
+        tmp.write("48312\n")
+        tmp.close()
+        path = tmp.name
+        print(f"'{args.path}' not found, using '{path}'.")
+    try:
+        results = [
+            ("open/readline", open_per_read(path, args.count)),
+            ("pread", persistent_pread(path, args.count)),
+        ]
+        passes = [(n, sensor_pass(path, args.count // 4, n)) for n in range(1, args.sensors + 1)]
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+    for name, elapsed in results:
+        print(f"{name:>14}: {elapsed / args.count * 1e6:8.2f} us/sample")
+    print(f"{'speedup':>14}: {results[0][1] / results[1][1]:8.2f}x")
+    for sensors, elapsed in passes:
+        per_pass = elapsed / (args.count // 4) * 1e6
+        print(f"{sensors:>6} sensors: {per_pass:8.2f} us/pass, {per_pass / sensors:6.2f} us/sensor")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# Per-tick cost of each stage of the fan daemon loop and of the OLED refresh, against stored baselines.
+#
+# Daemon stages mirror one iteration of `fan_temp_hysteresis.main()`:
+# temperature read, fan level decision of each control mode, fan write to
+# a simulated hat (changed and unchanged value), log call, telemetry,
+# metrics and polling interval, then the whole tick. OLED stages mirror one
+# refresh of `RGB_Cooling_HAT.py`: metrics collection, `renderOLED()`
+# drawing and pushing the changed spans to a panel that discards them.
+# OLED stages need Pillow, and are skipped without it.
+#
+# Each stage reports the best and median time per call over `--rounds`
+# rounds, the peak memory allocated while running `--count` calls, and the
+# memory still allocated afterwards, per call, which should stay near 0 in
+# the hot path. The best time is compared with the baseline of the same
+# machine type and Python version; `--save` records it as that baseline.
+# Exit code is 1 if a stage got slower or allocates more than
+# `--tolerance` allows, beyond a small fixed slack for the noise of
+# sub-microsecond stages. Allocations of stages that log are not compared:
+# they include the records waiting for the writer thread.
+#
+# Usage: python3 benchmarks/bench_tick.py [--count 2000] [--rounds 7] [--filter NAME] [--save]
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from fan_control import ControlModes, level_to_register  # noqa: E402
+from fan_settings import Settings  # noqa: E402
+from fan_simulator import SimulatedHat  # noqa: E402
+from hat_bus import FAN_SPEED_REG, HatBus, RegisterShadow  # noqa: E402
+from log_pipeline import LogWriter  # noqa: E402
+from metrics_exporter import MetricsRegistry  # noqa: E402
+from poll_scheduler import AdaptivePoller  # noqa: E402
+from telemetry import TelemetryRing  # noqa: E402
+from thermal_sampler import CPU_TEMP_FILE, ThermalSampler  # noqa: E402
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_tick_baseline.json")
+"""Stored baselines, by machine type and Python version."""
+ALLOC_SLACK_BYTES = 1024
+"""Peak allocation growth always tolerated, in bytes, for allocator noise."""
+TIME_SLACK_NS = 500
+"""Slowdown always tolerated, in nanoseconds, for timer and scheduling noise of sub-microsecond stages."""
+QUEUED_STAGES = ("log debug", "tick")
+"""Stages whose allocations depend on the log writer thread keeping up."""
+
+Stage = Tuple[str, Callable[[], object]]
+
+
+def daemon_stages(temp_file: str, log_dir: str) -> List[Stage]:
+    """Build the stages of one control loop iteration.
+
+    Args:
+        temp_file (str): temperature file
+        log_dir (str): directory of the log file
+
+    Returns:
+        List[Stage]: `(name, call)` of each stage
+    """
+    settings = Settings()
+    sampler = ThermalSampler(temp_file)
+    # Temperatures sweeping across the thresholds, so decisions change level
+    next_temp = itertools.cycle([44.0 + i * 0.1 for i in range(130)] + [57.0 - i * 0.1 for i in range(130)]).__next__
+    next_time = itertools.count(0.0, 0.5).__next__
+    controllers = {mode: settings.replace(control_mode=mode.value).controller() for mode in ControlModes}
+    hat = SimulatedHat()
+    registers = RegisterShadow(HatBus(settings.bus_number, bus_factory=hat.open))
+    next_value = itertools.cycle([level_to_register(0), level_to_register(100)]).__next__
+    fh = logging.handlers.RotatingFileHandler(
+        os.path.join(log_dir, "bench.log"), encoding='utf-8', maxBytes=64 * 1024, backupCount=1)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    writer = LogWriter([fh])
+    writer.start()
+    logger = logging.getLogger("bench-tick")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.addHandler(writer.handler)
+    telemetry = TelemetryRing(7201)
+    # Statistics of the daemon's hourly report, kept up to date from then on
+    telemetry.stats('temp', 3600.0)
+    telemetry.stats('level', 3600.0)
+    telemetry.percentile('temp', 3600.0, 95)
+    registry = MetricsRegistry()
+    temp_gauge = registry.gauge("temp", "")
+    level_gauge = registry.gauge("level", "")
+    toggles_counter = registry.counter("toggles", "")
+    writes_counter = registry.counter("writes", "")
+    loop_histogram = registry.histogram("loop", "", (0.0005, 0.001, 0.002, 0.005, 0.01))
+    poller = AdaptivePoller(settings.min_sleep_seconds, settings.sleep_seconds, settings.max_sleep_seconds)
+    hysteresis = controllers[ControlModes.HYSTERESIS]
+
+    def update_metrics(temperature: float, level: int, elapsed: float):
+        with registry.lock:
+            temp_gauge.set(temperature)
+            level_gauge.set(level)
+            toggles_counter.inc()
+            writes_counter.set(registers.writes_issued)
+            loop_histogram.observe(elapsed)
+
+    def tick():
+        start = time.perf_counter()
+        temperature = sampler.read()
+        now = next_time()
+        level = hysteresis.update(next_temp(), now)
+        if level is not None:
+            registers.write(FAN_SPEED_REG, level_to_register(level))
+        logger.debug("Temp: %.2f°C, Fan action: %s", temperature, "ON")
+        telemetry.append(now, temperature, 100, 0.0)
+        update_metrics(temperature, 100, time.perf_counter() - start)
+        poller.next_interval(temperature, *hysteresis.thresholds())
+
+    stages = [("temp read", sampler.read)]
+    for mode, controller in controllers.items():
+        stages.append((f"decide {mode.value}",
+                       lambda controller=controller: controller.update(next_temp(), next_time())))
+    stages += [
+        ("fan write changed", lambda: registers.write(FAN_SPEED_REG, next_value())),
+        ("fan write same", lambda: registers.write(FAN_SPEED_REG, 0x00)),
+        ("log debug", lambda: logger.debug("Temp: %.2f°C, Fan action: %s", next_temp(), "ON")),
+        ("telemetry", lambda: telemetry.append(next_time(), next_temp(), 100, 0.0)),
+        ("metrics", lambda: update_metrics(next_temp(), 100, 0.001)),
+        ("poll interval", lambda: poller.next_interval(next_temp(), 55.0, 45.0)),
+        ("tick", tick),
+    ]
+    return stages
+
+
+class NullPanel:
+    """SSD1306 driver stand-in, discarding commands and data."""
+
+    width = 128
+    height = 32
+
+    def __init__(self):
+        self._i2c = self
+
+    def command(self, value: int):
+        pass
+
+    def writeList(self, register: int, data: List[int]):
+        pass
+
+
+def oled_stages(temp_file: str) -> List[Stage]:
+    """Build the stages of one OLED refresh, empty without Pillow.
+
+    Args:
+        temp_file (str): temperature file
+
+    Returns:
+        List[Stage]: `(name, call)` of each stage
+    """
+    try:
+        from PIL import ImageFont
+    except ImportError:
+        print("Pillow not installed, OLED stages skipped.", file=sys.stderr)
+        return []
+    from oled_display import DirtyDisplay
+    from sys_metrics import MetricsCollector
+
+    metrics = MetricsCollector(temp_file=temp_file)
+    display = DirtyDisplay(NullPanel(), ImageFont.load_default())
+    next_load = itertools.cycle(range(0, 100, 7)).__next__
+
+    def collect():
+        for name in ('cpu', 'temp', 'mem', 'disk', 'ip'):
+            metrics.get(name, True)
+
+    def render():
+        # Same fields as renderOLED(), with a changing CPU load and temperature
+        load = next_load()
+        display.set_text('cpu', (0, -2), "CPU:%d%%" % load)
+        display.set_text('temp', (56, -2), "Temp:%.1fC" % (40.0 + load / 10))
+        display.set_text('mem', (0, 6), "RAM:%d/%d MB" % metrics.get('mem'))
+        display.set_text('disk', (0, 14), "Disk:%d/%dMB" % metrics.get('disk'))
+        display.set_text('ip', (0, 22), "wlan0:" + metrics.get('ip'))
+        return display.spans()
+
+    def refresh():
+        for span in render():
+            display.push_span(span)
+
+    return [
+        ("oled metrics", collect),
+        ("oled render", render),
+        ("oled refresh", refresh),
+    ]
+
+
+def time_rounds(stages: List[Stage], count: int, rounds: int) -> Dict[str, List[float]]:
+    """Time all stages, one round of each in turn, so a noisy moment of the machine hits all of them alike.
+
+    Returns:
+        Dict[str, List[float]]: nanoseconds per call of each round, by stage name
+    """
+    for _, call in stages:
+        for _ in range(min(count, 200)):
+            call()
+    times = {name: [] for name, _ in stages}
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            for name, call in stages:
+                start = time.perf_counter_ns()
+                for _ in range(count):
+                    call()
+                times[name].append((time.perf_counter_ns() - start) / count)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return times
+
+
+def trace_allocations(call: Callable[[], object], count: int) -> Tuple[int, float]:
+    """Run a stage with allocation tracing.
+
+    Returns:
+        Tuple[int, float]: peak bytes, and bytes still allocated per call
+    """
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            call()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, current / count
+
+
+def baseline_key() -> str:
+    return f"{platform.machine()} {platform.python_implementation()} {sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure per-tick cost of daemon and OLED stages against baselines.")
+    parser.add_argument("--count", type=int, default=2000, help="calls per round")
+    parser.add_argument("--rounds", type=int, default=7, help="timed rounds per stage")
+    parser.add_argument("--filter", default="", help="only run stages whose name contains this text")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown or allocation growth, as a ratio, larger on busy machines")
+    parser.add_argument("--save", action="store_true", help="store results as baseline of this machine type")
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+    key = baseline_key()
+    baseline = baselines.get(key, {})
+    if not baseline and not args.save:
+        print(f"No baseline for '{key}', run with --save to record one.", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as directory:
+        temp_file = CPU_TEMP_FILE
+        if not os.path.exists(temp_file):
+            temp_file = os.path.join(directory, "temp")
+            with open(temp_file, 'w') as f:
+                f.write("48312\n")
+        stages = daemon_stages(temp_file, directory) + oled_stages(temp_file)
+        stages = [(name, call) for name, call in stages if args.filter in name]
+        times = time_rounds(stages, args.count, args.rounds)
+        results = {}
+        for name, call in stages:
+            peak, retained = trace_allocations(call, args.count)
+            results[name] = {'ns_min': min(times[name]), 'ns': statistics.median(times[name]),
+                             'peak_bytes': peak, 'retained_bytes': retained}
+    logging.getLogger("bench-tick").handlers.clear()
+
+    regressions = []
+    print(f"{'stage':>18} {'best ns':>9} {'median ns':>9} {'baseline':>9} {'change':>7} "
+          f"{'peak B':>8} {'kept B/call':>11}")
+    for name, result in results.items():
+        old = baseline.get(name)
+        change = ""
+        if old:
+            ratio = result['ns_min'] / old['ns_min']
+            change = f"{(ratio - 1) * 100:+6.1f}%"
+            if result['ns_min'] > old['ns_min'] * (1 + args.tolerance) + TIME_SLACK_NS:
+                regressions.append(f"{name}: {(ratio - 1) * 100:.0f}% slower")
+            if (name not in QUEUED_STAGES
+                    and result['peak_bytes'] > old['peak_bytes'] * (1 + args.tolerance) + ALLOC_SLACK_BYTES):
+                regressions.append(f"{name}: peak allocation {old['peak_bytes']} -> {result['peak_bytes']} bytes")
+        print(f"{name:>18} {result['ns_min']:9.0f} {result['ns']:9.0f} {old['ns_min'] if old else float('nan'):9.0f} "
+              f"{change:>7} {result['peak_bytes']:8d} {result['retained_bytes']:11.2f}")
+
+    if args.save:
+        baselines[key] = {**baseline, **{name: {'ns_min': round(result['ns_min']), 'peak_bytes': result['peak_bytes']}
+                                         for name, result in results.items()}}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved for '{key}'.")
+        return 0
+    for regression in regressions:
+        print(f"Regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
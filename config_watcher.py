@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# Watcher of the fan daemon configuration file, with inotify, started once the fan is set.
+
+import os
+import select
+import struct
+import threading
+from typing import Callable, List, Optional
+
+IN_CLOSE_WRITE = 0x00000008
+"""inotify event: file opened for writing was closed."""
+IN_MOVED_TO = 0x00000080
+"""inotify event: file moved into the watched directory."""
+IN_CREATE = 0x00000100
+"""inotify event: file created in the watched directory."""
+IN_NONBLOCK = 0o4000
+"""inotify_init1 flag: non-blocking descriptor."""
+IN_CLOEXEC = 0o2000000
+"""inotify_init1 flag: close descriptor on exec."""
+INOTIFY_EVENT = struct.Struct('iIII')
+"""Header of an inotify event: watch, mask, cookie and name length."""
+SETTLE_SECONDS = 0.2
+"""Quiet time after a file change before reporting it, in seconds."""
+
+
+class ConfigWatcher:
+    """Watches a configuration file with inotify, from a background thread.
+
+    The directory is watched rather than the file, so editors that save by
+    renaming a new file over the old one are seen too. Bursts of events are
+    reported once, after `SETTLE_SECONDS` without further changes.
+    """
+
+    def __init__(self, path: str, callback: Callable[[], None]):
+        """Create a watcher, without starting it.
+
+        Args:
+            path (str): configuration file
+            callback (Callable[[], None]): called from the watcher thread on change
+        """
+        self.path = os.path.abspath(path)
+        """Watched configuration file."""
+        self.callback = callback
+        """Called from the watcher thread on change."""
+        self._fd = -1
+        self._stop_r, self._stop_w = -1, -1
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start watching.
+
+        Raises:
+            OSError: if inotify is not available
+        """
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify not available")
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.path.dirname(self.path).encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, os.strerror(errno), os.path.dirname(self.path))
+        self._fd = fd
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def _changed_names(self) -> List[bytes]:
+        names = []
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            names.append(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+        return names
+
+    def _watch(self):
+        name = os.path.basename(self.path).encode()
+        pending = False
+        while True:
+            ready, _, _ = select.select([self._fd, self._stop_r], [], [], SETTLE_SECONDS if pending else None)
+            if self._stop_r in ready:
+                break
+            if self._fd in ready:
+                pending = name in self._changed_names() or pending
+            elif pending:
+                pending = False
+                self.callback()
+        os.close(self._fd)
+        os.close(self._stop_r)
+
+    def stop(self):
+        """Stop watching."""
+        if self._thread is None:
+            return
+        os.write(self._stop_w, b'x')
+        self._thread.join(timeout=1.0)
+        os.close(self._stop_w)
+        self._thread = None
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# Unix domain control socket of the fan daemon: one JSON object per line, each way.
+
+import json
+import os
+import selectors
+import socket
+import threading
+from typing import Callable, Dict, Optional
+
+MAX_REQUEST_SIZE = 4096
+"""Maximum size of a request line, in bytes."""
+
+
+class _Connection:
+    """Client connection with its pending input and output."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.inbox = bytearray()
+        self.outbox = bytearray()
+
+
+class ControlServer:
+    """Serves control requests on a Unix domain socket, from a background thread.
+
+    Every socket is non-blocking and multiplexed with `selectors`, so a
+    slow or stuck client never delays other clients nor the control loop.
+    Each request line is decoded and passed to `handler`, whose returned
+    object is sent back as one JSON line. The handler runs in the server
+    thread and must only take short locks shared with the control loop.
+    """
+
+    def __init__(self, path: str, handler: Callable[[Dict], Dict], mode: int = 0o660):
+        """Create a server, without binding the socket yet.
+
+        Args:
+            path (str): socket path
+            handler (Callable[[Dict], Dict]): request handler, returning the response
+            mode (int): permissions of the socket file
+        """
+        self.path = path
+        """Socket path."""
+        self.handler = handler
+        """Request handler, returning the response."""
+        self.mode = mode
+        """Permissions of the socket file."""
+        self.requests: int = 0
+        """Number of requests handled."""
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._listener: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake_r, self._wake_w = -1, -1
+
+    def start(self):
+        """Bind the socket and start serving.
+
+        Raises:
+            OSError: if the socket cannot be bound
+        """
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(self.path)
+            os.chmod(self.path, self.mode)
+            listener.listen(8)
+            listener.setblocking(False)
+        except OSError:
+            listener.close()
+            raise
+        self._listener = listener
+        self._wake_r, self._wake_w = os.pipe()
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(listener, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._serve, name="control-socket", daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        selector = self._selector
+        while True:
+            for key, events in selector.select():
+                if key.fileobj == self._wake_r:
+                    self._shutdown()
+                    return
+                if key.data is None:
+                    self._accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(conn)
+                if events & selectors.EVENT_WRITE and conn.sock.fileno() >= 0:
+                    self._write(conn)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+
+    def _drop(self, conn: _Connection):
+        self._selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def _read(self, conn: _Connection):
+        try:
+            data = conn.sock.recv(MAX_REQUEST_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._drop(conn)
+            return
+        if not data:
+            self._drop(conn)
+            return
+        conn.inbox += data
+        while True:
+            end = conn.inbox.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(conn.inbox[:end])
+            del conn.inbox[:end + 1]
+            if line.strip():
+                conn.outbox += self._handle(line)
+        if len(conn.inbox) > MAX_REQUEST_SIZE:
+            conn.inbox.clear()
+            conn.outbox += _encode({'ok': False, 'error': "request too long"})
+        if conn.outbox:
+            self._write(conn)
+
+    def _handle(self, line: bytes) -> bytes:
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be an object")
+        except ValueError as e:
+            return _encode({'ok': False, 'error': f"invalid request: {e}"})
+        try:
+            response = self.handler(request)
+        except Exception as e:
+            # A bad request must never stop the server thread
+            response = {'ok': False, 'error': str(e)}
+        return _encode(response)
+
+    def _write(self, conn: _Connection):
+        try:
+            sent = conn.sock.send(conn.outbox)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._drop(conn)
+            return
+        del conn.outbox[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.outbox else 0)
+        self._selector.modify(conn.sock, events, conn)
+
+    def _shutdown(self):
+        for key in list(self._selector.get_map().values()):
+            if isinstance(key.data, _Connection):
+                key.data.sock.close()
+        self._selector.close()
+        self._listener.close()
+        os.close(self._wake_r)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def stop(self):
+        """Stop serving and remove the socket."""
+        if self._thread is None:
+            return
+        os.write(self._wake_w, b'x')
+        self._thread.join(timeout=1.0)
+        os.close(self._wake_w)
+        self._thread = None
+
+
+def _encode(response: Dict) -> bytes:
+    return json.dumps(response, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+def request(message: Dict, path: str, timeout: float = 2.0) -> Dict:
+    """Send a request to the daemon and wait for its response.
+
+    Args:
+        message (Dict): request, with its 'cmd' and arguments
+        path (str): socket path
+        timeout (float): maximum time to wait, in seconds
+
+    Returns:
+        Dict: response, with 'ok' False and an 'error' on failure
+
+    Raises:
+        OSError: if the daemon cannot be reached
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(_encode(message))
+        reply = bytearray()
+        while not reply.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                raise ConnectionError("connection closed by daemon")
+            reply += data
+    return json.loads(reply)
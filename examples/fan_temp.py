@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
+import os
 import smbus2
 import sys
 import time
 
+# Shared modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from thermal_sampler import CPU_TEMP_FILE, ThermalSampler  # noqa: E402
+
 # Device address
 DEVICE_ADDR = 0x0d
 # Fan control register
@@ -16,13 +21,13 @@ state_text = ""
 range_text = ""
 
 
+sampler = ThermalSampler(CPU_TEMP_FILE)
+
+
 def get_cpu_temp() -> float:
-    CPU_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
     temp: float = -173.15
     try:
-        with open(CPU_TEMP_FILE, 'r') as f:
-            temp_str = f.readline()
-            temp = float(temp_str.strip()) / 1000.0
+        temp = sampler.read()
     except FileNotFoundError:
         print(
             f"Error: Cannot find temperature file '{CPU_TEMP_FILE}'.",
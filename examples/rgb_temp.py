@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-import smbus2
+import os
 import sys
 import time
 
+# Shared modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hat_bus import HatBus, LedBatchModes, RgbLeds  # noqa: E402
+from thermal_sampler import CPU_TEMP_FILE, ThermalSampler  # noqa: E402
+
 # Device address
 DEVICE_ADDR = 0x0d
 # LED registers
@@ -15,6 +20,7 @@ RGB_OFF_REG = 0x07
 
 # Program constants
 MAX_LED = 3
+LED_BATCH_MODE = LedBatchModes.BYTE  # PEC checked; RDWR sends a frame in one ioctl, without PEC
 
 # Global variables
 bus_number: int = 1  # raspberry pi with 256MB uses bus_number = 0
@@ -24,26 +30,17 @@ level_temp: float = 0
 
 
 def setRGB(num, r, g, b):
-    if num >= MAX_LED:
-        bus.write_byte_data(
-            DEVICE_ADDR, LED_SELECT_REG, 0xff)   # Brightness
-        bus.write_byte_data(DEVICE_ADDR, LED_R_VALUE_REG, r & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_G_VALUE_REG, g & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_B_VALUE_REG, b & 0xff)
-    elif num >= 0:
-        bus.write_byte_data(DEVICE_ADDR, LED_SELECT_REG, num & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_R_VALUE_REG, r & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_G_VALUE_REG, g & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_B_VALUE_REG, b & 0xff)
+    if num >= 0:
+        leds.set_led(num, r, g, b)
+
+
+sampler = ThermalSampler(CPU_TEMP_FILE)
 
 
 def get_cpu_temp() -> float:
-    CPU_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
     temp: float = -173.15
     try:
-        with open(CPU_TEMP_FILE, 'r') as f:
-            temp_str = f.readline()
-            temp = float(temp_str.strip()) / 1000.0
+        temp = sampler.read()
     except FileNotFoundError:
         print(f"Error: Cannot find temperature file '{CPU_TEMP_FILE}'.")
         exit(3)
@@ -62,15 +59,17 @@ def get_cpu_temp() -> float:
 
 # Initialize i2c bus
 try:
-    bus = smbus2.SMBus(bus_number)
-    bus.enable_pec(True)  # Enable "Packet Error Checking"
+    bus = HatBus(bus_number, DEVICE_ADDR)  # "Packet Error Checking" enabled
+    bus.open()
+    leds = RgbLeds(bus, LED_BATCH_MODE)
 except Exception as e:
     print(
         f"Cannot open i2c device at bus {bus_number}, address '{hex(DEVICE_ADDR)}'! Aborting.\n",
         file=sys.stderr)
     exit(1)
 
-bus.write_byte_data(DEVICE_ADDR, RGB_OFF_REG, 0x00)
+bus.write_byte_data(RGB_OFF_REG, 0x00)
+leds.invalidate()
 time.sleep(1.0)
 
 while True:
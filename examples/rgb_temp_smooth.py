@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 #
 # Controls the RGB's based on the Pi's temperature. Uses an
-# algorithm to compute the color dynamically.
+# algorithm to compute the color dynamically. Samples are smoothed first,
+# so sensor jitter does not rewrite the LEDs on every check.
 #
 
-import smbus2
+import os
 import sys
 import time
 
+# Shared modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from hat_bus import HatBus, LedBatchModes, RgbLeds  # noqa: E402
+from temp_filter import EmaFilter  # noqa: E402
+from thermal_sampler import CPU_TEMP_FILE, ThermalSampler  # noqa: E402
+
 # Device address
 DEVICE_ADDR = 0x0d
 # LED registers
@@ -22,8 +29,10 @@ FAN_SPEED_REG = 0x08
 
 # Program constants
 MAX_LED = 3
+LED_BATCH_MODE = LedBatchModes.BYTE  # PEC checked; RDWR sends a frame in one ioctl, without PEC
 RGB_COLD = (0x00, 0x00, 0xff)
 RGB_HOT = (0xFF, 0x00, 0x00)
+FILTER_TIME_CONSTANT = 5.0  # seconds to follow 63% of a temperature step
 
 # Global variables
 bus_number: int = 1  # raspberry pi with 256MB use bus_number = 0
@@ -55,26 +64,18 @@ def calculateColor(temperature):
 
 
 def setRGB(num, r, g, b):
-    if num >= MAX_LED:
-        bus.write_byte_data(
-            DEVICE_ADDR, LED_SELECT_REG, 0xff)   # Brightness
-        bus.write_byte_data(DEVICE_ADDR, LED_R_VALUE_REG, r & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_G_VALUE_REG, g & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_B_VALUE_REG, b & 0xff)
-    elif num >= 0:
-        bus.write_byte_data(DEVICE_ADDR, LED_SELECT_REG, num & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_R_VALUE_REG, r & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_G_VALUE_REG, g & 0xff)
-        bus.write_byte_data(DEVICE_ADDR, LED_B_VALUE_REG, b & 0xff)
+    if num >= 0:
+        leds.set_led(num, r, g, b)
+
+
+sampler = ThermalSampler(CPU_TEMP_FILE)
+temp_filter = EmaFilter(FILTER_TIME_CONSTANT)
 
 
 def get_cpu_temp() -> float:
-    CPU_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
     temp: float = -173.15
     try:
-        with open(CPU_TEMP_FILE, 'r') as f:
-            temp_str = f.readline()
-            temp = float(temp_str.strip()) / 1000.0
+        temp = sampler.read()
     except FileNotFoundError:
         print(
             f"Error: Cannot find temperature file '{CPU_TEMP_FILE}'.",
@@ -95,20 +96,23 @@ def get_cpu_temp() -> float:
 
 # Initialize i2c bus
 try:
-    bus = smbus2.SMBus(bus_number)
-    bus.enable_pec(True)  # Enable "Packet Error Checking"
+    bus = HatBus(bus_number, DEVICE_ADDR)  # "Packet Error Checking" enabled
+    bus.open()
+    leds = RgbLeds(bus, LED_BATCH_MODE)
 except Exception as e:
     print(
         f"Cannot open i2c device at bus {bus_number}, address '{hex(DEVICE_ADDR)}'! Aborting.\n",
         file=sys.stderr)
     exit(1)
 
-bus.write_byte_data(DEVICE_ADDR, RGB_OFF_REG, 0x00)
+bus.write_byte_data(RGB_OFF_REG, 0x00)
+leds.invalidate()
 time.sleep(1.0)
 
 while True:
-    temperature = get_cpu_temp()
-    print("CPU Temperature: ", temperature)
+    raw_temperature = get_cpu_temp()
+    temperature = temp_filter.update(raw_temperature, time.monotonic())
+    print(f"CPU Temperature: {raw_temperature}, filtered: {temperature:.2f}")
     color = calculateColor(temperature)
 
     if color != previousColor:
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# Fan speed levels and control policies for the yahboom RGB fan hat.
+
+import math
+from collections import deque
+from enum import Enum
+from typing import Deque, List, Optional, Sequence, Tuple
+
+FAN_LEVELS = (0, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+"""Fan speeds supported by the hat, in percent."""
+
+CURVE_STEPS_PER_DEGREE = 10
+"""Temperature steps per Celsius degree of precompiled fan curve tables."""
+TREND_REBASE_SECONDS = 600.0
+"""Time after which trend sums are recomputed around a new time origin, to keep their precision."""
+
+
+class ControlModes(Enum):
+    """Possible fan control modes."""
+    HYSTERESIS = "hysteresis"
+    """Fan fully on above trigger temperature, off below hysteresis."""
+    CURVE = "curve"
+    """Fan speed from a temperature to level curve."""
+    PID = "pid"
+    """Fan speed from a PID controller toward a target temperature."""
+    PREDICTIVE = "predictive"
+    """Like hysteresis, on the temperature projected from its recent trend."""
+
+
+def nearest_level(percent: float) -> int:
+    """Round a fan speed to the nearest level supported by the hat.
+
+    Args:
+        percent (float): fan speed, in percent
+
+    Returns:
+        int: fan level, one of `FAN_LEVELS`
+    """
+    if percent < FAN_LEVELS[1] / 2:
+        return 0
+    if percent >= 100:
+        return 100
+    return min(FAN_LEVELS[1:], key=lambda level: abs(level - percent))
+
+
+def level_to_register(level: int) -> int:
+    """Get value of fan speed register for a fan level.
+
+    The hat takes 0x00 for 0%, 0x02-0x09 for 20%-90% and 0x01 for 100%.
+
+    Args:
+        level (int): fan level, one of `FAN_LEVELS`
+
+    Returns:
+        int: fan speed register value
+    """
+    if level <= 0:
+        return 0x00
+    if level >= 100:
+        return 0x01
+    return level // 10
+
+
+def register_to_level(value: int) -> int:
+    """Get fan level of a fan speed register value, inverse of `level_to_register`.
+
+    Args:
+        value (int): fan speed register value
+
+    Returns:
+        int: fan level, in percent
+    """
+    if value == 0x01:
+        return 100
+    if 0x02 <= value <= 0x09:
+        return value * 10
+    return 0
+
+
+def parse_curve(text: str) -> List[Tuple[float, int]]:
+    """Parse a fan curve from configuration.
+
+    Args:
+        text (str): comma separated `temperature:level` points, like "45:40, 50:60, 55:100"
+
+    Returns:
+        List[Tuple[float, int]]: points sorted by temperature, levels rounded to `FAN_LEVELS`
+
+    Raises:
+        ValueError: if text is not a valid curve
+    """
+    points = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        temp_str, sep, level_str = item.partition(':')
+        if not sep:
+            raise ValueError(f"Invalid fan curve point '{item}', expected 'temperature:level'.")
+        points.append((float(temp_str), nearest_level(float(level_str))))
+    if not points:
+        raise ValueError("Fan curve needs at least one point.")
+    points.sort()
+    for (_, low), (_, high) in zip(points, points[1:]):
+        if high < low:
+            raise ValueError("Fan curve levels must not decrease with temperature.")
+    return points
+
+
+class FanCurve:
+    """Temperature to fan level curve, with hysteresis on every step.
+
+    A point `(temperature, level)` means the fan runs at least at `level`
+    from `temperature` upwards, and below the first point the fan is off.
+    The fan steps up as soon as a point is reached, but only steps down once
+    the temperature drops `hysteresis_temp` below the point.
+
+    The curve is compiled at creation into two lookup tables, for rising
+    and falling temperature, indexed by temperature quantized to
+    `CURVE_STEPS_PER_DEGREE` steps per degree. Each update is then a
+    constant-time lookup.
+    """
+
+    def __init__(self, points: Sequence[Tuple[float, int]], hysteresis_temp: float):
+        """Compile the curve.
+
+        Args:
+            points (Sequence[Tuple[float, int]]): `(temperature, level)` points, sorted by temperature
+            hysteresis_temp (float): temperature drop below a point to step down, in Celsius
+        """
+        self.points = list(points)
+        """Curve points, as `(temperature, level)`."""
+        self.hysteresis_temp = hysteresis_temp
+        """Temperature drop below a point to step down, in Celsius."""
+        self.level: int = 0
+        """Current fan level."""
+        self._base_index = math.floor((self.points[0][0] - hysteresis_temp) * CURVE_STEPS_PER_DEGREE) - 1
+        size = math.ceil(self.points[-1][0] * CURVE_STEPS_PER_DEGREE) - self._base_index + 2
+        temps = [(self._base_index + i) / CURVE_STEPS_PER_DEGREE for i in range(size)]
+        self._rising = bytes(self._level_at(temp, 0.0) for temp in temps)
+        self._falling = bytes(self._level_at(temp, hysteresis_temp) for temp in temps)
+        self._last_index = size - 1
+        self._bounds = {}
+        for point_temp, point_level in self.points:
+            self._bounds.setdefault(point_level, point_temp - hysteresis_temp)
+        self._bounds[0] = float('-inf')
+
+    def _level_at(self, temperature: float, offset: float) -> int:
+        # Small epsilon, so a point exactly on the quantization grid is reached
+        level = 0
+        for point_temp, point_level in self.points:
+            if temperature + 1e-6 >= point_temp - offset:
+                level = point_level
+        return level
+
+    def update(self, temperature: float) -> int:
+        """Get fan level for a new temperature sample.
+
+        Args:
+            temperature (float): current temperature, in Celsius
+
+        Returns:
+            int: fan level, one of `FAN_LEVELS`
+        """
+        index = math.floor(temperature * CURVE_STEPS_PER_DEGREE + 1e-6) - self._base_index
+        if index < 0:
+            index = 0
+        elif index > self._last_index:
+            index = self._last_index
+        rising = self._rising[index]
+        if rising > self.level:
+            self.level = rising
+        else:
+            falling = self._falling[index]
+            if falling < self.level:
+                self.level = falling
+        return self.level
+
+    def bounds(self) -> Tuple[float, float]:
+        """Get temperatures at which the current level changes.
+
+        Returns:
+            Tuple[float, float]: temperature to step up and temperature to step down, in Celsius
+        """
+        up_temp = float('inf')
+        for point_temp, point_level in self.points:
+            if point_level > self.level:
+                up_temp = point_temp
+                break
+        return up_temp, self._bounds.get(self.level, float('-inf'))
+
+
+class PidController:
+    """Closed-loop fan control toward a target temperature.
+
+    The output is the PID sum of the temperature error, in percent, with
+    derivative on the measurement to avoid kicks. The integral only
+    accumulates while the output is not saturated in the direction of the
+    error (conditional integration), and is clamped to the output range,
+    so it does not wind up while the fan is already at 0% or 100%.
+
+    The output is quantized to the hat's `FAN_LEVELS`, and the level may
+    only change once every `rate_limit_seconds`, so the controller does not
+    flood the bus with small corrections.
+    """
+
+    def __init__(self, target_temp: float, kp: float, ki: float, kd: float,
+                 rate_limit_seconds: float):
+        """Create a controller, with fan off and empty integral.
+
+        Args:
+            target_temp (float): target temperature, in Celsius
+            kp (float): proportional gain, in percent per Celsius
+            ki (float): integral gain, in percent per Celsius second
+            kd (float): derivative gain, in percent second per Celsius
+            rate_limit_seconds (float): minimum time between level changes, in seconds
+        """
+        self.target_temp = target_temp
+        """Target temperature, in Celsius."""
+        self.kp = kp
+        """Proportional gain, in percent per Celsius."""
+        self.ki = ki
+        """Integral gain, in percent per Celsius second."""
+        self.kd = kd
+        """Derivative gain, in percent second per Celsius."""
+        self.rate_limit_seconds = rate_limit_seconds
+        """Minimum time between level changes, in seconds."""
+        self.level: int = 0
+        """Current fan level."""
+        self.output: float = 0.0
+        """Last unquantized output, in percent."""
+        self.integral: float = 0.0
+        """Integral term, in percent."""
+        self._last_temp: Optional[float] = None
+        self._last_time: Optional[float] = None
+        self._last_change: Optional[float] = None
+
+    def update(self, temperature: float, now: float) -> int:
+        """Get fan level for a new temperature sample.
+
+        Args:
+            temperature (float): current temperature, in Celsius
+            now (float): monotonic time of sample, in seconds
+
+        Returns:
+            int: fan level, one of `FAN_LEVELS`
+        """
+        error = temperature - self.target_temp
+        dt = 0.0 if self._last_time is None else max(0.0, now - self._last_time)
+        derivative = 0.0
+        if dt > 0 and self._last_temp is not None:
+            derivative = (temperature - self._last_temp) / dt
+        self._last_temp = temperature
+        self._last_time = now
+
+        proportional = self.kp * error + self.kd * derivative
+        output = proportional + self.integral
+        # Conditional integration: skip while saturated in the error direction
+        if not ((output >= 100.0 and error > 0) or (output <= 0.0 and error < 0)):
+            self.integral = min(100.0, max(0.0, self.integral + self.ki * error * dt))
+            output = proportional + self.integral
+        self.output = min(100.0, max(0.0, output))
+
+        level = nearest_level(self.output)
+        if level != self.level and (self._last_change is None
+                                    or now - self._last_change >= self.rate_limit_seconds):
+            self.level = level
+            self._last_change = now
+        return self.level
+
+
+class TrendPredictor:
+    """Least squares line of the temperature over a sliding time window.
+
+    Sums of times, temperatures and their products are updated as samples
+    enter and leave the window, so each sample costs constant work. Times
+    are kept relative to an origin moved every `TREND_REBASE_SECONDS`,
+    recomputing the sums once, so squared times never lose precision on a
+    long running daemon.
+    """
+
+    def __init__(self, window_seconds: float):
+        """Create a predictor, without samples.
+
+        Args:
+            window_seconds (float): length of the sliding window, in seconds
+        """
+        self.window_seconds = window_seconds
+        """Length of the sliding window, in seconds."""
+        self._samples: Deque[Tuple[float, float]] = deque()
+        self._origin = 0.0
+        self._sum_t = self._sum_x = self._sum_tt = self._sum_tx = 0.0
+
+    def add(self, temperature: float, now: float):
+        """Add a sample, dropping those out of the window.
+
+        Args:
+            temperature (float): sample temperature, in Celsius
+            now (float): monotonic time of sample, in seconds
+        """
+        samples = self._samples
+        samples.append((now, temperature))
+        if now - self._origin > TREND_REBASE_SECONDS:
+            self._origin = now
+            self._sum_t = self._sum_x = self._sum_tt = self._sum_tx = 0.0
+            for sample_time, sample_temp in samples:
+                self._accumulate(sample_time, sample_temp, 1.0)
+        else:
+            self._accumulate(now, temperature, 1.0)
+        while samples[0][0] < now - self.window_seconds:
+            self._accumulate(*samples.popleft(), -1.0)
+
+    def _accumulate(self, now: float, temperature: float, sign: float):
+        t = now - self._origin
+        self._sum_t += sign * t
+        self._sum_x += sign * temperature
+        self._sum_tt += sign * t * t
+        self._sum_tx += sign * t * temperature
+
+    def slope(self) -> float:
+        """Get the temperature trend.
+
+        Returns:
+            float: slope of the fitted line in Celsius per second, 0 with less than two samples
+        """
+        count = len(self._samples)
+        if count < 2:
+            return 0.0
+        variance = count * self._sum_tt - self._sum_t * self._sum_t
+        if variance <= 1e-9:
+            return 0.0
+        return (count * self._sum_tx - self._sum_t * self._sum_x) / variance
+
+    def project(self, now: float, seconds: float) -> float:
+        """Get the temperature of the fitted line ahead in time.
+
+        Args:
+            now (float): monotonic time of the last sample, in seconds
+            seconds (float): time ahead, in seconds
+
+        Returns:
+            float: projected temperature, in Celsius
+        """
+        count = len(self._samples)
+        if not count:
+            return 0.0
+        mean_t = self._sum_t / count
+        return self._sum_x / count + self.slope() * (now - self._origin + seconds - mean_t)
+
+    def reset(self):
+        """Forget past samples."""
+        self._samples.clear()
+        self._origin = 0.0
+        self._sum_t = self._sum_x = self._sum_tt = self._sum_tx = 0.0
+
+
+class LoadFeedForward:
+    """Temperature offset from sustained CPU load, added ahead of the fan decision.
+
+    Heat from a load burst reaches the sensor seconds after the load
+    itself. Once the load stays above `threshold` for `hold_seconds`, each
+    percent over it adds `weight` Celsius to the temperature the control
+    mode sees, so the fan starts or speeds up early. The offset then stays
+    until the load has been below the threshold for `hold_seconds` too, so
+    short gaps between compile jobs do not stop the fan.
+    """
+
+    def __init__(self, weight: float, threshold: float, hold_seconds: float):
+        """Create an inactive feed-forward.
+
+        Args:
+            weight (float): temperature offset per load percent over threshold, in Celsius, 0 to disable
+            threshold (float): load from which the offset applies, in percent
+            hold_seconds (float): time the load must stay over, then under, threshold to switch, in seconds
+        """
+        self.weight = weight
+        """Temperature offset per load percent over threshold, in Celsius."""
+        self.threshold = threshold
+        """Load from which the offset applies, in percent."""
+        self.hold_seconds = hold_seconds
+        """Time the load must stay over, then under, threshold to switch, in seconds."""
+        self.active: bool = False
+        """Whether the offset applies."""
+        self.offset: float = 0.0
+        """Current temperature offset, in Celsius."""
+        self._since: Optional[float] = None
+
+    def update(self, load: Optional[float], now: float) -> float:
+        """Get temperature offset for a new load sample.
+
+        Args:
+            load (Optional[float]): CPU load since previous sample in percent, None if unknown
+            now (float): monotonic time of sample, in seconds
+
+        Returns:
+            float: temperature offset, in Celsius
+        """
+        if load is None or self.weight <= 0:
+            self.active = False
+            self._since = None
+            self.offset = 0.0
+            return 0.0
+        over = load > self.threshold
+        if over == self.active:
+            # Load agrees with the current state, no switch pending
+            self._since = None
+        elif self._since is None:
+            self._since = now
+        if self._since is not None and now - self._since >= self.hold_seconds:
+            self.active = over
+            self._since = None
+        if not self.active:
+            self.offset = 0.0
+        elif over:
+            self.offset = self.weight * (load - self.threshold)
+        return self.offset
+
+    def reset(self):
+        """Forget the load history, without offset."""
+        self.active = False
+        self.offset = 0.0
+        self._since = None
+
+
+class FanController:
+    """Fan level decision of every control mode, without any i2c access.
+
+    The daemon and the simulator both drive the fan through this class, so
+    a policy compared in simulation is the one the daemon runs.
+
+    In hysteresis mode the fan is fully on from `trigger_temp`, and off
+    from `hysteresis_temp` below it. In between the fan keeps its state and
+    no write is needed, except on the first update and after `restore()`.
+
+    Predictive mode applies the same thresholds to the temperature
+    projected `predict_seconds` ahead by the trend, when it is rising, so
+    the fan starts before a burst reaches `trigger_temp`, and only stops
+    once the temperature is low and no longer rising.
+
+    In every mode the offset of the load feed-forward is added to the
+    temperature first.
+    """
+
+    def __init__(self, mode: ControlModes, trigger_temp: float, hysteresis_temp: float,
+                 curve: FanCurve, pid: PidController, predictor: TrendPredictor, predict_seconds: float,
+                 feed_forward: LoadFeedForward):
+        """Create a controller, with fan off.
+
+        Args:
+            mode (ControlModes): control mode
+            trigger_temp (float): temperature at which fan is turned on in hysteresis mode, in Celsius
+            hysteresis_temp (float): temperature drop below trigger to turn fan off, in Celsius
+            curve (FanCurve): fan curve, used in curve mode
+            pid (PidController): fan speed controller, used in PID mode
+            predictor (TrendPredictor): temperature trend, used in predictive mode
+            predict_seconds (float): time ahead of the projected temperature, in seconds
+            feed_forward (LoadFeedForward): temperature offset from CPU load
+        """
+        self.mode = mode
+        """Control mode."""
+        self.trigger_temp = trigger_temp
+        """Temperature at which fan is turned on in hysteresis mode, in Celsius."""
+        self.hysteresis_temp = hysteresis_temp
+        """Temperature drop below trigger to turn fan off in hysteresis mode, in Celsius."""
+        self.curve = curve
+        """Fan curve, used in curve mode."""
+        self.pid = pid
+        """Fan speed controller, used in PID mode."""
+        self.predictor = predictor
+        """Temperature trend, used in predictive mode."""
+        self.predict_seconds = predict_seconds
+        """Time ahead of the projected temperature in predictive mode, in seconds."""
+        self.feed_forward = feed_forward
+        """Temperature offset from CPU load, in every mode."""
+        self.fan_on: bool = False
+        """Fan state of hysteresis mode."""
+        self._restore = True
+
+    def restore(self):
+        """Write the hysteresis state on next update, even between thresholds.
+
+        Needed after the fan was set by other means, like an override or
+        another control mode.
+        """
+        self._restore = True
+
+    def update(self, temperature: float, now: float, load: Optional[float] = None) -> Optional[int]:
+        """Get fan level for a new temperature sample.
+
+        Args:
+            temperature (float): current temperature, in Celsius
+            now (float): monotonic time of sample, in seconds
+            load (Optional[float]): CPU load since previous sample in percent, None if not sampled
+
+        Returns:
+            Optional[int]: fan level to write, one of `FAN_LEVELS`, None if the fan keeps its state
+        """
+        temperature += self.feed_forward.update(load, now)
+        if self.mode == ControlModes.CURVE:
+            return self.curve.update(temperature)
+        if self.mode == ControlModes.PID:
+            return self.pid.update(temperature, now)
+        if self.mode == ControlModes.PREDICTIVE:
+            self.predictor.add(temperature, now)
+            temperature = max(temperature, self.predictor.project(now, self.predict_seconds))
+        restore = self._restore
+        self._restore = False
+        if temperature >= self.trigger_temp:
+            self.fan_on = True
+        elif temperature <= self.trigger_temp - self.hysteresis_temp:
+            self.fan_on = False
+        elif not restore:
+            return None
+        return 100 if self.fan_on else 0
+
+    def thresholds(self) -> Tuple[float, float]:
+        """Get temperatures near which the fan level may change, to poll faster.
+
+        Returns:
+            Tuple[float, float]: upper and lower threshold of the sensor temperature, in Celsius
+        """
+        offset = self.feed_forward.offset
+        if self.mode == ControlModes.CURVE:
+            up_temp, down_temp = self.curve.bounds()
+        elif self.mode == ControlModes.PID:
+            up_temp, down_temp = self.pid.target_temp, self.pid.target_temp
+        elif self.mode == ControlModes.PREDICTIVE:
+            # Where a sample at the current trend projects onto the trigger
+            lead = max(0.0, self.predictor.slope()) * self.predict_seconds
+            up_temp, down_temp = self.trigger_temp - lead, self.trigger_temp - self.hysteresis_temp
+        else:
+            up_temp, down_temp = self.trigger_temp, self.trigger_temp - self.hysteresis_temp
+        return up_temp - offset, down_temp - offset
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# Command line client of the yahboom-fan-ctrl control socket.
+
+import argparse
+import json
+import sys
+
+from control_socket import request
+from fan_settings import CONTROL_SOCKET
+
+# Error codes
+OK_EXIT = 0
+ERR_SYSTEM = 1
+ERR_REQUEST = 2
+
+
+def parse_setting(text: str):
+    """Parse a `name=value` setting argument.
+
+    Args:
+        text (str): setting argument
+
+    Returns:
+        Tuple[str, float]: setting name and value
+
+    Raises:
+        argparse.ArgumentTypeError: if not a `name=number` pair
+    """
+    name, sep, value = text.partition('=')
+    try:
+        if not sep:
+            raise ValueError
+        return name.strip(), float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' is not name=number")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Query or control the running yahboom-fan-ctrl daemon.")
+    parser.add_argument('--socket', default=CONTROL_SOCKET, help=f"control socket path (default: {CONTROL_SOCKET})")
+    parser.add_argument('--json', action='store_true', help="print the raw JSON response")
+    commands = parser.add_subparsers(dest='cmd', required=True)
+    commands.add_parser('status', help="show temperature, fan level and settings")
+    history = commands.add_parser('history', help="show recent samples")
+    history.add_argument('seconds', type=float, nargs='?', default=60.0, help="history length, in seconds")
+    override = commands.add_parser('override', help="force a fan level for a while, or 'clear'")
+    override.add_argument('level', help="fan level in percent (0, 20-90 in steps of 10, 100), or 'clear'")
+    override.add_argument('ttl', type=float, nargs='?', default=600.0, help="override duration, in seconds")
+    settings = commands.add_parser('set', help="change thresholds until restart")
+    settings.add_argument('settings', type=parse_setting, nargs='+', metavar='name=value',
+                          help="trigger_temp, hysteresis_temp or pid_target_temp, in Celsius")
+    args = parser.parse_args()
+
+    message = {'cmd': args.cmd}
+    if args.cmd == 'history':
+        message['seconds'] = args.seconds
+    elif args.cmd == 'override':
+        if args.level == 'clear':
+            message['level'] = None
+        else:
+            try:
+                message['level'] = int(args.level)
+            except ValueError:
+                parser.error(f"invalid level '{args.level}'")
+            message['ttl'] = args.ttl
+    elif args.cmd == 'set':
+        message.update(args.settings)
+
+    try:
+        response = request(message, args.socket)
+    except OSError as e:
+        print(f"Error: Cannot reach daemon at '{args.socket}': {e}", file=sys.stderr)
+        return ERR_SYSTEM
+    if args.json or not response.get('ok'):
+        print(json.dumps(response, indent=2))
+        return OK_EXIT if response.get('ok') else ERR_REQUEST
+
+    if args.cmd == 'status':
+        print(f"Mode: {response['mode']}, temp: {response['temp']}°C, fan level: {response['level']}%")
+        if response['override']:
+            print(f"Override: {response['override']['level']}% for {response['override']['expires_in']:.0f}s more")
+        print("Settings: " + ", ".join(f"{name} = {value}" for name, value in response['settings'].items()))
+        print(f"Poll interval: {response['interval']:.2f}s, i2c: " +
+              ", ".join(f"{name} {value}" for name, value in response['i2c'].items()))
+        for name, device in response.get('devices', {}).items():
+            print(f"Device {name} (bus {device['bus']}, {device['address']}): mode: {device['mode']}, "
+                  f"temp: {device['temp']}°C, fan level: {device['level']}%, i2c errors: {device['i2c']['errors']}")
+    elif args.cmd == 'history':
+        for age, temp, level, latency in response['samples']:
+            print(f"-{age:8.1f}s  {temp:6.2f}°C  {level:3d}%  i2c {latency * 1000:.2f}ms")
+    else:
+        print("Done.")
+    return OK_EXIT
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Extra fan hats of the daemon, each bus driven by its own worker thread.
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from fan_control import FAN_LEVELS, level_to_register
+from fan_settings import Settings
+from hat_bus import FAN_SPEED_REG, HatBus, RegisterShadow
+from poll_scheduler import AdaptivePoller
+from thermal_sampler import SensorSet, select_sensors
+
+FAILSAFE_LEVEL = FAN_LEVELS[-1]
+"""Fan level of a hat whose sensors all fail, in percent."""
+
+
+class FanDevice:
+    """One extra hat, with its own i2c session, sensors and control policy.
+
+    Unlike the main hat, errors never stop the daemon: a failed write is
+    logged once per failure streak and retried on the next check, which
+    reopens the session; a hat whose sensors all fail runs its fan at
+    `FAILSAFE_LEVEL` until they read again.
+    """
+
+    def __init__(self, name: str, settings: Settings, logger: logging.Logger,
+                 bus_factory: Optional[Callable[[int], "smbus2.SMBus"]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """Create a device, opening its sensors but not its bus yet.
+
+        Args:
+            name (str): device name, from its configuration section
+            settings (Settings): settings of the device
+            logger (logging.Logger): logger of the daemon
+            bus_factory (Optional[Callable[[int], smbus2.SMBus]]): opens the bus by number, None for `smbus2.SMBus`
+            clock (Callable[[], float]): monotonic time source, in seconds
+
+        Raises:
+            ValueError: if the sensors of the device match nothing
+        """
+        self.name = name
+        """Device name."""
+        self.settings = settings
+        """Settings of the device."""
+        self.hat_bus = HatBus(settings.bus_number, settings.device_address, bus_factory=bus_factory)
+        """Persistent i2c session with the hat."""
+        self.registers = RegisterShadow(self.hat_bus, settings.refresh_seconds, clock=clock)
+        """Shadow of hat registers, to skip writes of an unchanged fan state."""
+        self.sensors = SensorSet(select_sensors(settings.sensors))
+        """Temperature sensors of the device."""
+        self.fusion = settings.fusion(self.sensors.names)
+        """Combination of sensor readings into the temperature driving the fan."""
+        self.sample_filter = settings.sample_filter()
+        """Noise filter of the fused temperature."""
+        self.controller = settings.controller()
+        """Fan level decision of the device's control mode."""
+        self.poller = AdaptivePoller(settings.min_sleep_seconds, settings.sleep_seconds, settings.max_sleep_seconds,
+                                     clock=clock)
+        """Interval of temperature checks; the bus worker does the waiting."""
+        self.temperature: Optional[float] = None
+        """Last temperature in Celsius, None while sensors fail."""
+        self.level: int = -1
+        """Last fan level written in percent, -1 before the first write or after a failed one."""
+        self.ticks: int = 0
+        """Number of temperature checks."""
+        self.cpu_seconds: float = 0.0
+        """CPU time spent in checks, in seconds."""
+        self.next_time: float = clock()
+        """Monotonic time of the next check, in seconds."""
+        self._logger = logger
+        self._write_failing = False
+        self._sensors_failing = False
+
+    def tick(self, now: float) -> float:
+        """Check the temperature and update the fan.
+
+        Args:
+            now (float): monotonic time, in seconds
+
+        Returns:
+            float: interval until next check, in seconds
+        """
+        start = time.thread_time()
+        try:
+            return self._tick(now)
+        finally:
+            self.ticks += 1
+            self.cpu_seconds += time.thread_time() - start
+
+    def _tick(self, now: float) -> float:
+        settings = self.settings
+        try:
+            temps = self.sensors.read()
+        except (OSError, ValueError) as e:
+            if not self._sensors_failing:
+                self._logger.error(f"Device '{self.name}': all sensors failing ({e}), fan at {FAILSAFE_LEVEL}%.")
+                self._sensors_failing = True
+            self.temperature = None
+            self.controller.restore()
+            self._write(FAILSAFE_LEVEL)
+            return settings.min_sleep_seconds
+        if self._sensors_failing:
+            self._logger.info(f"Device '{self.name}': sensors back.")
+            self._sensors_failing = False
+        temperature = self.sample_filter.update(self.fusion.fuse(temps, settings.trigger_temp), now)
+        self.temperature = temperature
+        fan_level = self.controller.update(temperature, now)
+        if fan_level is not None and not self._write(fan_level):
+            # Written again on next check, even between hysteresis thresholds
+            self.controller.restore()
+            return settings.min_sleep_seconds
+        return self.poller.next_interval(temperature, *self.controller.thresholds())
+
+    def _write(self, fan_level: int) -> bool:
+        for _ in range(self.settings.max_attempts):
+            try:
+                self.registers.write(FAN_SPEED_REG, level_to_register(fan_level))
+                break
+            except OSError:
+                continue
+        else:
+            self.level = -1
+            if not self._write_failing:
+                self._logger.error(
+                    f"Device '{self.name}': cannot write to i2c device at bus {self.settings.bus_number}, "
+                    f"address '{hex(self.settings.device_address)}', retrying.")
+                self._write_failing = True
+            return False
+        if self._write_failing:
+            self._logger.info(f"Device '{self.name}': i2c device back.")
+            self._write_failing = False
+        if fan_level != self.level:
+            if self.temperature is None:
+                self._logger.info(f"Device '{self.name}': Fan level: {fan_level}%")
+            else:
+                self._logger.info(f"Device '{self.name}': Temp: {self.temperature:.2f}°C, Fan level: {fan_level}%")
+            self.level = fan_level
+        return True
+
+    def stop(self):
+        """Turn the fan off and release the bus and sensors."""
+        try:
+            self.registers.write(FAN_SPEED_REG, level_to_register(0), force=True)
+        except OSError:
+            self._logger.warning(f"Device '{self.name}': cannot turn fan off.")
+        self.hat_bus.close()
+        self.sensors.close()
+
+    def status(self) -> Dict:
+        """Get the state of the device, for the control socket.
+
+        Returns:
+            Dict: temperature, level, bus and check statistics
+        """
+        return {
+            'bus': self.settings.bus_number,
+            'address': hex(self.settings.device_address),
+            'mode': self.settings.control_mode,
+            'temp': None if self.temperature is None else round(self.temperature, 2),
+            'level': self.level,
+            'i2c': {'writes': self.registers.writes_issued, 'suppressed': self.registers.writes_suppressed,
+                    'errors': self.hat_bus.errors, 'reconnects': self.hat_bus.reconnects},
+            'ticks': self.ticks,
+            'cpu_us_per_tick': round(self.cpu_seconds / self.ticks * 1e6, 1) if self.ticks else None,
+        }
+
+
+class BusWorker:
+    """Drives the extra hats of one i2c bus from its own thread.
+
+    Transfers on one bus are serialized by the adapter anyway, so each bus
+    gets one thread: a stuck or slow bus only delays its own hats. The
+    thread checks each hat when its adaptive interval expires, and sleeps
+    until the earliest next check.
+    """
+
+    def __init__(self, bus_number: int, devices: List[FanDevice], logger: logging.Logger,
+                 clock: Callable[[], float] = time.monotonic):
+        """Create a worker, without starting it.
+
+        Args:
+            bus_number (int): i2c bus number
+            devices (List[FanDevice]): hats on the bus
+            logger (logging.Logger): logger of the daemon
+            clock (Callable[[], float]): monotonic time source, in seconds
+        """
+        self.bus_number = bus_number
+        """i2c bus number."""
+        self.devices = devices
+        """Hats on the bus."""
+        self._logger = logger
+        self._clock = clock
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start checking the hats."""
+        self._thread = threading.Thread(target=self._run, name=f"fan-bus-{self.bus_number}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            for device in self.devices:
+                now = self._clock()
+                if now < device.next_time:
+                    continue
+                try:
+                    interval = device.tick(now)
+                except Exception:
+                    # A bug in one hat must not stop the others
+                    self._logger.error(f"Device '{device.name}': check failed.", exc_info=True)
+                    interval = device.settings.max_sleep_seconds
+                # Far behind, e.g. after a system suspend: restart from now
+                device.next_time = max(device.next_time + interval, now)
+            self._stop.wait(max(0.0, min(device.next_time for device in self.devices) - self._clock()))
+
+    def stop(self, timeout: float = 5.0):
+        """Stop checking, turning the fans off.
+
+        Args:
+            timeout (float): time to wait for the thread, in seconds
+        """
+        stop_workers([self], timeout)
+
+    def signal(self):
+        """Ask the thread to stop after its current check, without waiting for it."""
+        self._stop.set()
+
+    def join(self, deadline: float) -> bool:
+        """Wait for the signalled thread, then turn the fans off and release the hats.
+
+        Args:
+            deadline (float): `time.monotonic()` time to wait until, in seconds
+
+        Returns:
+            bool: False if the thread is still running, its hats left as they are
+        """
+        if self._thread is not None:
+            self._thread.join(timeout=max(0.0, deadline - time.monotonic()))
+            if self._thread.is_alive():
+                # Still in a transfer: writing or closing the bus under it could corrupt it
+                self._logger.error(f"Bus {self.bus_number} worker stuck, fans of "
+                                   f"{', '.join(device.name for device in self.devices)} left as they are.")
+                return False
+            self._thread = None
+        for device in self.devices:
+            device.stop()
+        return True
+
+
+def stop_workers(workers: List[BusWorker], timeout: float = 5.0):
+    """Stop workers together, turning their fans off.
+
+    All threads are signalled before any is waited for, against one
+    deadline, so a stuck bus delays the shutdown by `timeout` at most
+    instead of once per bus. The hats of a worker still running after it
+    are left alone.
+
+    Args:
+        workers (List[BusWorker]): workers to stop
+        timeout (float): time to wait for all threads, in seconds
+    """
+    for worker in workers:
+        worker.signal()
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        worker.join(deadline)
+
+
+def create_workers(devices: Dict[str, Settings], logger: logging.Logger,
+                   bus_factory: Optional[Callable[[int], "smbus2.SMBus"]] = None,
+                   clock: Callable[[], float] = time.monotonic) -> List[BusWorker]:
+    """Create the extra hats, grouped in one worker per bus.
+
+    Args:
+        devices (Dict[str, Settings]): settings by device name
+        logger (logging.Logger): logger of the daemon
+        bus_factory (Optional[Callable[[int], smbus2.SMBus]]): opens a bus by number, None for `smbus2.SMBus`
+        clock (Callable[[], float]): monotonic time source, in seconds
+
+    Returns:
+        List[BusWorker]: workers, not started, by bus number
+
+    Raises:
+        ValueError: if the sensors of a device match nothing
+    """
+    by_bus: Dict[int, List[FanDevice]] = {}
+    for name, settings in devices.items():
+        try:
+            device = FanDevice(name, settings, logger, bus_factory, clock)
+        except ValueError as e:
+            raise ValueError(f"Device '{name}': invalid sensors '{settings.sensors}': {e}")
+        by_bus.setdefault(settings.bus_number, []).append(device)
+    return [BusWorker(bus_number, by_bus[bus_number], logger, clock) for bus_number in sorted(by_bus)]
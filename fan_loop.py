@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# One check of the fan control loop, shared by the daemon and the simulator.
+
+import time
+from typing import Callable, Optional, Tuple
+
+from fan_control import level_to_register
+from fan_settings import Settings
+from hat_bus import FAN_SPEED_REG, HatBus, RegisterShadow
+
+
+class FanLoop:
+    """Temperature filter, fan decision and fan write of the main hat.
+
+    Each `tick()` filters a temperature sample, updates the control policy
+    and writes a changed fan level, retrying failed writes up to
+    `max_attempts` times. The daemon's main loop and the simulator both
+    call it, so a simulation runs the daemon's own sequence; the bus and
+    the clock are injected, like for `FanDevice`. Reading the sensors and
+    waiting for the next check stay with the caller.
+    """
+
+    def __init__(self, settings: Settings,
+                 bus_factory: Optional[Callable[[int], "smbus2.SMBus"]] = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_retry: Optional[Callable[[int, Exception], None]] = None,
+                 on_failure: Optional[Callable[[int, Exception], None]] = None):
+        """Create the control loop of a hat, without opening its bus yet.
+
+        Args:
+            settings (Settings): settings of the hat
+            bus_factory (Optional[Callable[[int], smbus2.SMBus]]): opens the bus by number, None for `smbus2.SMBus`
+            clock (Callable[[], float]): monotonic time source, in seconds
+            on_retry (Optional[Callable[[int, Exception], None]]): called before each retry of a fan write,
+                with the number of the next attempt and the error, in the exception handler
+            on_failure (Optional[Callable[[int, Exception], None]]): called when a fan write failed every
+                attempt, with their number and the last error, in the exception handler
+        """
+        self.hat_bus = HatBus(settings.bus_number, settings.device_address, bus_factory=bus_factory)
+        """Persistent i2c session with the hat."""
+        self.registers = RegisterShadow(self.hat_bus, settings.refresh_seconds, clock=clock)
+        """Shadow of hat registers, to skip writes of an unchanged fan state."""
+        self.sample_filter = settings.sample_filter()
+        """Noise filter of the temperature, before the fan decision; replaced when its settings change."""
+        self.controller = settings.controller()
+        """Fan level decision of the control mode in use."""
+        self.max_attempts: int = settings.max_attempts
+        """Maximum number of attempts of a fan write."""
+        self.retries: int = 0
+        """Number of fan writes retried after an error."""
+        self.failed_writes: int = 0
+        """Number of fan writes that failed every attempt."""
+        self._clock = clock
+        self._on_retry = on_retry
+        self._on_failure = on_failure
+
+    def tick(self, raw_temperature: float, cpu_load: Optional[float] = None,
+             override_level: Optional[int] = None) -> Tuple[float, Optional[int]]:
+        """Filter a temperature sample, decide the fan level and write it if needed.
+
+        Args:
+            raw_temperature (float): temperature sample, in Celsius
+            cpu_load (Optional[float]): CPU load since previous check in percent, None if not sampled
+            override_level (Optional[int]): fan level to write instead of deciding one, in percent;
+                the control policy starts over once the override ends
+
+        Returns:
+            Tuple[float, Optional[int]]: filtered temperature in Celsius, and fan level written in percent,
+            None if the policy kept the fan as it is
+        """
+        now = self._clock()
+        temperature = self.sample_filter.update(raw_temperature, now)
+        if override_level is not None:
+            self.controller.restore()
+            fan_level = override_level
+        else:
+            fan_level = self.controller.update(temperature, now, cpu_load)
+        if fan_level is not None:
+            self.write(fan_level)
+        return temperature, fan_level
+
+    def write(self, level: int, force: bool = False) -> bool:
+        """Set the fan level, retrying failed writes.
+        The write is skipped if the hat already holds the requested state,
+        unless its refresh is due.
+
+        Args:
+            level (int): fan level, in percent, one of `FAN_LEVELS`
+            force (bool): write even if the fan state did not change
+
+        Returns:
+            bool: False if every attempt failed
+        """
+        # 0x1 = 100% fan speed, 0x2-0x9 = 20%-90%, 0x0 = 0% fan speed
+        value = level_to_register(level)
+        attempt = 1
+        while True:
+            try:
+                # A failed write closes the session, the next attempt reopens it
+                self.registers.write(FAN_SPEED_REG, value, force)
+                return True
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    self.failed_writes += 1
+                    if self._on_failure is not None:
+                        self._on_failure(attempt, e)
+                    return False
+                attempt += 1
+                self.retries += 1
+                if self._on_retry is not None:
+                    self._on_retry(attempt, e)
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# Immutable settings of the fan daemon, loaded from its configuration file.
+
+import configparser
+import os
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Optional, Sequence, Tuple
+
+from fan_control import ControlModes, FanController, FanCurve, LoadFeedForward, PidController, TrendPredictor, \
+    parse_curve
+from temp_filter import FilterTypes, SampleFilter, create_filter
+from thermal_sampler import FusionPolicies, SensorFusion, parse_sensor_values
+
+REPOSITORY = "yahboom-raspi-cooling-fan"
+"""Product code of yahboom RGB fan hat."""
+MODULE_NAME = "yahboom-fan-ctrl"
+"""Module name used for configuration file and log file."""
+CONFIG_FILE_PATHS = (
+    f"/etc/{MODULE_NAME}/{MODULE_NAME}.conf",
+    f"./{MODULE_NAME}.conf")
+"""Configuration file paths, the first existing one is used."""
+CONTROL_SOCKET = f"/run/{MODULE_NAME}/control.sock"
+"""Default path of the control socket."""
+DEVICE_SECTION_PREFIX = "DEVICE:"
+"""Prefix of configuration sections of extra hats, followed by the device name."""
+
+
+def _option(default, section: str = 'FAN-CTRL', restart: bool = False):
+    return field(default=default, metadata={'section': section, 'restart': restart})
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Daemon settings, validated on creation.
+
+    Instances never change: a reload builds a new one and swaps it in, so
+    the control loop always sees a consistent set of values.
+    """
+    bus_number: int = _option(1, 'GENERAL', True)  # raspberry pi with 256MB uses bus_number = 0
+    """i2c bus number."""
+    device_address: int = _option(0x0d, 'GENERAL', True)
+    """i2c device address of the hat, 0x0d unless changed on the board."""
+    log_file: str = _option(f"/var/log/{REPOSITORY}/{MODULE_NAME}.log", 'GENERAL', True)
+    """Log file path."""
+    verbose: int = _option(1, 'GENERAL')
+    """Verbosity level of messages."""
+    max_log_size: int = _option(100*1024, 'GENERAL', True)
+    """Maximum size of log file, in bytes."""
+    max_log_backups: int = _option(3, 'GENERAL', True)
+    """Maximum number of log file backups."""
+    telemetry_file: str = _option("", 'GENERAL', True)
+    """Path of the binary telemetry ring file, empty to disable it."""
+    telemetry_file_samples: int = _option(7 * 24 * 3600, 'GENERAL', True)
+    """Number of samples kept in the telemetry file."""
+
+    hysteresis_temp: float = _option(10.0)
+    """Temperature hysteresis to turn off fan, in Celsius."""
+    trigger_temp: float = _option(55.0)
+    """Temperature at which fan is turned on in Celsius."""
+    max_attempts: int = _option(3)
+    """Maximum number of attempts to write to i2c device."""
+    sleep_seconds: float = _option(2.0)
+    """Time to sleep between temperature checks far from thresholds, in seconds."""
+    min_sleep_seconds: float = _option(0.5)
+    """Time to sleep between temperature checks near thresholds, in seconds."""
+    max_sleep_seconds: float = _option(10.0)
+    """Maximum time to sleep between temperature checks, in seconds."""
+    refresh_seconds: float = _option(60.0)
+    """Time after which an unchanged fan state is written again, in seconds. 0 to never refresh."""
+    control_mode: str = _option(ControlModes.HYSTERESIS.value)
+    """Fan control mode, a `ControlModes` value."""
+    fan_curve: str = _option("45:40, 47:60, 49:80, 51:90, 53:100")
+    """Fan curve points, as comma separated `temperature:level`, used in curve mode."""
+    curve_hysteresis_temp: float = _option(2.0)
+    """Temperature hysteresis to step down the fan curve, in Celsius."""
+    pid_target_temp: float = _option(50.0)
+    """Target temperature of PID mode, in Celsius."""
+    pid_kp: float = _option(10.0)
+    """Proportional gain of PID mode, in percent per Celsius."""
+    pid_ki: float = _option(0.2)
+    """Integral gain of PID mode, in percent per Celsius second."""
+    pid_kd: float = _option(0.0)
+    """Derivative gain of PID mode, in percent second per Celsius."""
+    pid_rate_limit_seconds: float = _option(10.0)
+    """Minimum time between fan level changes in PID mode, in seconds."""
+    predict_seconds: float = _option(30.0)
+    """Time ahead of the projected temperature in predictive mode, in seconds."""
+    predict_window_seconds: float = _option(30.0)
+    """Length of the temperature trend window in predictive mode, in seconds."""
+    load_weight: float = _option(0.0)
+    """Temperature offset per CPU load percent over `load_threshold`, in Celsius, 0 to disable."""
+    load_threshold: float = _option(70.0)
+    """CPU load from which the feed-forward offset applies, in percent."""
+    load_hold_seconds: float = _option(20.0)
+    """Time CPU load must stay over, then under, `load_threshold` to switch the offset, in seconds."""
+    telemetry_windows: str = _option("60, 600, 3600", restart=True)
+    """Windows of in-memory telemetry statistics, as comma separated seconds."""
+    control_socket_path: str = _option(CONTROL_SOCKET, restart=True)
+    """Path of the control socket, empty to disable it."""
+
+    sensors: str = _option("", 'SENSORS', True)
+    """Temperature sensors: empty for thermal_zone0, 'auto' for all, or name patterns and paths."""
+    sensor_fusion: str = _option(FusionPolicies.MAX.value, 'SENSORS')
+    """Way to combine sensors, a `FusionPolicies` value."""
+    sensor_weights: str = _option("", 'SENSORS')
+    """Weights of the weighted fusion, as comma separated `pattern:weight`."""
+    sensor_triggers: str = _option("", 'SENSORS')
+    """Own trigger temperatures of the threshold fusion, as comma separated `pattern:temperature`."""
+    temp_filter: str = _option(FilterTypes.NONE.value, 'SENSORS')
+    """Noise filter of the fused temperature, a `FilterTypes` value."""
+    filter_time_constant: float = _option(5.0, 'SENSORS')
+    """Time constant of the EMA filter, in seconds."""
+    filter_window: int = _option(5, 'SENSORS')
+    """Number of samples of the median filter."""
+    filter_process_noise: float = _option(0.02, 'SENSORS')
+    """Temperature drift variance of the Kalman filter, in Celsius squared per second."""
+    filter_measurement_noise: float = _option(0.3, 'SENSORS')
+    """Sample noise variance of the Kalman filter, in Celsius squared."""
+
+    metrics_address: str = _option("127.0.0.1", 'METRICS', True)
+    """Listen address of the Prometheus metrics endpoint."""
+    metrics_port: int = _option(0, 'METRICS', True)
+    """Port of the Prometheus metrics endpoint, 0 to disable it."""
+    metrics_textfile: str = _option("", 'METRICS', True)
+    """Path of the node-exporter textfile with metrics, empty to disable it."""
+    metrics_textfile_seconds: float = _option(15.0, 'METRICS', True)
+    """Time between writes of the metrics textfile, in seconds."""
+
+    def __post_init__(self):
+        if self.control_mode not in [mode.value for mode in ControlModes]:
+            raise ValueError(f"Unknown control mode '{self.control_mode}'.")
+        try:
+            parse_curve(self.fan_curve)
+        except ValueError as e:
+            raise ValueError(f"Invalid fan curve '{self.fan_curve}': {e}")
+        try:
+            if not parse_windows(self.telemetry_windows):
+                raise ValueError("no window given.")
+        except ValueError as e:
+            raise ValueError(f"Invalid telemetry windows '{self.telemetry_windows}': {e}")
+        if self.hysteresis_temp < 0 or self.curve_hysteresis_temp < 0:
+            raise ValueError("Hysteresis temperatures must not be negative.")
+        if not 0x03 <= self.device_address <= 0x77:
+            raise ValueError(f"Invalid i2c device address {hex(self.device_address)}.")
+        if self.max_attempts < 1:
+            raise ValueError(f"Invalid max attempts {self.max_attempts}.")
+        if self.sleep_seconds <= 0 or not 0 < self.min_sleep_seconds <= self.max_sleep_seconds:
+            raise ValueError(
+                f"Invalid sleep times {self.min_sleep_seconds}, {self.sleep_seconds}, {self.max_sleep_seconds} seconds.")
+        if self.predict_seconds < 0 or self.predict_window_seconds <= 0:
+            raise ValueError(
+                f"Invalid prediction of {self.predict_seconds} seconds over {self.predict_window_seconds} seconds.")
+        if self.load_weight < 0 or not 0 <= self.load_threshold < 100 or self.load_hold_seconds < 0:
+            raise ValueError(
+                f"Invalid load feed-forward weight {self.load_weight}, threshold {self.load_threshold}% "
+                f"or hold {self.load_hold_seconds} seconds.")
+        if self.sensor_fusion not in [policy.value for policy in FusionPolicies]:
+            raise ValueError(f"Unknown sensor fusion '{self.sensor_fusion}'.")
+        try:
+            if any(weight < 0 for _, weight in parse_sensor_values(self.sensor_weights)):
+                raise ValueError("weights must not be negative.")
+            parse_sensor_values(self.sensor_triggers)
+        except ValueError as e:
+            raise ValueError(f"Invalid sensor weights or triggers: {e}")
+        if self.temp_filter not in [kind.value for kind in FilterTypes]:
+            raise ValueError(f"Unknown temperature filter '{self.temp_filter}'.")
+        if self.filter_time_constant < 0 or self.filter_window < 1:
+            raise ValueError(
+                f"Invalid filter time constant {self.filter_time_constant} seconds or window {self.filter_window}.")
+        if self.filter_process_noise < 0 or self.filter_measurement_noise < 0:
+            raise ValueError("Filter noise variances must not be negative.")
+        if self.telemetry_file_samples < 1:
+            raise ValueError(f"Invalid telemetry file samples {self.telemetry_file_samples}.")
+        if not 0 <= self.metrics_port <= 65535:
+            raise ValueError(f"Invalid metrics port {self.metrics_port}.")
+        if self.metrics_textfile_seconds <= 0:
+            raise ValueError(f"Invalid metrics textfile period {self.metrics_textfile_seconds}.")
+
+    def diff(self, other: "Settings") -> Dict[str, Tuple[object, object]]:
+        """Compare with newer settings.
+
+        Args:
+            other (Settings): newer settings
+
+        Returns:
+            Dict[str, Tuple[object, object]]: old and new value, by changed setting name
+        """
+        return {f.name: (getattr(self, f.name), getattr(other, f.name))
+                for f in fields(self) if getattr(self, f.name) != getattr(other, f.name)}
+
+    def replace(self, **changes) -> "Settings":
+        """Get a copy with some values changed, validated.
+
+        Raises:
+            ValueError: if a new value is not valid
+        """
+        return replace(self, **changes)
+
+    def fusion(self, names: Sequence[str]) -> SensorFusion:
+        """Build the fusion of some sensors with these settings.
+
+        Args:
+            names (Sequence[str]): sensor names, in reading order
+
+        Returns:
+            SensorFusion: sensor fusion
+        """
+        return SensorFusion(names, FusionPolicies(self.sensor_fusion),
+                            parse_sensor_values(self.sensor_weights), parse_sensor_values(self.sensor_triggers))
+
+    def sample_filter(self) -> SampleFilter:
+        """Build the temperature noise filter of these settings.
+
+        Returns:
+            SampleFilter: filter, without samples
+        """
+        return create_filter(FilterTypes(self.temp_filter), self.filter_time_constant, self.filter_window,
+                             self.filter_process_noise, self.filter_measurement_noise)
+
+    def controller(self) -> FanController:
+        """Build a fan controller with these settings.
+
+        Returns:
+            FanController: controller, with fan off
+        """
+        return FanController(
+            ControlModes(self.control_mode), self.trigger_temp, self.hysteresis_temp,
+            FanCurve(parse_curve(self.fan_curve), self.curve_hysteresis_temp),
+            PidController(self.pid_target_temp, self.pid_kp, self.pid_ki, self.pid_kd,
+                          self.pid_rate_limit_seconds),
+            TrendPredictor(self.predict_window_seconds), self.predict_seconds,
+            LoadFeedForward(self.load_weight, self.load_threshold, self.load_hold_seconds))
+
+
+RESTART_SETTINGS = tuple(f.name for f in fields(Settings) if f.metadata['restart'])
+"""Settings only applied when the daemon starts."""
+DEVICE_SETTINGS = ('bus_number', 'device_address') + tuple(
+    f.name for f in fields(Settings)
+    if f.metadata['section'] in ('FAN-CTRL', 'SENSORS')
+    and f.name not in ('telemetry_windows', 'control_socket_path') and not f.name.startswith('load_'))
+"""Settings a device section can change, the others come from the main sections.
+The CPU load feed-forward only drives the main hat."""
+
+
+def parse_windows(text: str) -> list:
+    """Parse telemetry windows from configuration.
+
+    Args:
+        text (str): comma separated window lengths, in seconds
+
+    Returns:
+        list: window lengths, in seconds
+
+    Raises:
+        ValueError: if a window is not a positive number
+    """
+    windows = [float(item) for item in text.split(',') if item.strip()]
+    if any(window <= 0 for window in windows):
+        raise ValueError("windows must be positive.")
+    return windows
+
+
+def find_config_file() -> Optional[str]:
+    """Get the configuration file in use.
+
+    Returns:
+        Optional[str]: path of the first existing file of `CONFIG_FILE_PATHS`, None if none
+    """
+    for config_file_path in CONFIG_FILE_PATHS:
+        if os.path.exists(config_file_path):
+            return config_file_path
+    return None
+
+
+def load_settings(path: Optional[str] = None) -> Settings:
+    """Read settings from a configuration file.
+
+    Options missing from the file keep their default value. General options
+    are read from the `[GENERAL]` section, or `[DEFAULT]` in older files.
+
+    Args:
+        path (Optional[str]): configuration file, None for defaults only
+
+    Returns:
+        Settings: validated settings
+
+    Raises:
+        ValueError: if a value is not valid
+        configparser.Error: if the file cannot be parsed
+    """
+    config = configparser.ConfigParser()
+    if path is not None:
+        with open(path, encoding='utf-8') as f:
+            config.read_file(f)
+    general = 'GENERAL' if config.has_section('GENERAL') else 'DEFAULT'
+    values = {}
+    for f in fields(Settings):
+        section = f.metadata['section']
+        if section == 'GENERAL':
+            section = general
+        values[f.name] = _read_option(config, section, f.name, f.default)
+    return Settings(**values)
+
+
+def _read_option(config: configparser.ConfigParser, section: str, name: str, default):
+    if name == 'device_address':
+        # Usually written in hex, like 0x0d
+        return int(config.get(section, name, fallback=str(default)), 0)
+    if isinstance(default, int):
+        return config.getint(section, name, fallback=default)
+    if isinstance(default, float):
+        return config.getfloat(section, name, fallback=default)
+    value = config.get(section, name, fallback=default).strip()
+    if name in ('control_mode', 'sensor_fusion', 'temp_filter'):
+        value = value.lower()
+    return value
+
+
+def load_devices(path: Optional[str], settings: Settings) -> Dict[str, Settings]:
+    """Read settings of extra hats from a configuration file.
+
+    Each `[DEVICE:name]` section describes one more hat. Its options, from
+    `DEVICE_SETTINGS`, replace those of the main sections, which give the
+    defaults of every device.
+
+    Args:
+        path (Optional[str]): configuration file, None for no device
+        settings (Settings): settings of the main hat
+
+    Returns:
+        Dict[str, Settings]: validated settings, by device name, in file order
+
+    Raises:
+        ValueError: if a value is not valid, or two hats share a bus and address
+        configparser.Error: if the file cannot be parsed
+    """
+    devices: Dict[str, Settings] = {}
+    if path is None:
+        return devices
+    config = configparser.ConfigParser()
+    with open(path, encoding='utf-8') as f:
+        config.read_file(f)
+    defaults = {f.name: getattr(settings, f.name) for f in fields(Settings)}
+    used = {(settings.bus_number, settings.device_address): "main hat"}
+    for section in config.sections():
+        if not section.startswith(DEVICE_SECTION_PREFIX):
+            continue
+        name = section[len(DEVICE_SECTION_PREFIX):].strip()
+        if not name:
+            raise ValueError(f"Section '[{section}]' needs a device name.")
+        changes = {}
+        for option in config.options(section):
+            if option not in DEVICE_SETTINGS:
+                # Older files keep general options in [DEFAULT], seen by every section
+                if option in config.defaults():
+                    continue
+                raise ValueError(f"Unknown option '{option}' of device '{name}'.")
+            changes[option] = _read_option(config, section, option, defaults[option])
+        try:
+            device = settings.replace(**changes)
+        except ValueError as e:
+            raise ValueError(f"Device '{name}': {e}")
+        key = (device.bus_number, device.device_address)
+        if key in used:
+            raise ValueError(f"Device '{name}' uses bus {key[0]}, address {hex(key[1])} of {used[key]}.")
+        used[key] = f"device '{name}'"
+        devices[name] = device
+    return devices
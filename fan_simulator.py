@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+# Run the fan control policies against a simulated hat and CPU, on a virtual clock.
+#
+# Each check is the daemon's own `FanLoop` tick, filtering, deciding and
+# writing with retries, paced by the daemon's adaptive polling; only the
+# i2c device, the temperature source and the clock are simulated. The
+# temperature comes from a lumped thermal model heated by a CPU load
+# profile and cooled by the fan level held in the simulated hat register,
+# or from a recorded trace, replayed as is or through the CPU power it
+# implies.
+# Comparing temperature filters against `none` reports the fan changes and
+# bus writes each filter avoids, on the same samples and sensor noise.
+#
+# Usage: python3 fan_simulator.py [--mode hysteresis curve pid] [--load "0:3, 600:6"] [--seconds 3600]
+#        python3 fan_simulator.py --trace temps.csv [--set trigger_temp=60]
+#        python3 fan_simulator.py --trace temps.csv --filter none ema median kalman [--noise 0.5]
+#        python3 fan_simulator.py --trace temps.csv --replay-heat --mode hysteresis predictive
+
+import argparse
+import errno
+import json
+import math
+import random
+import sys
+from dataclasses import asdict, dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from fan_control import ControlModes, register_to_level
+from fan_loop import FanLoop
+from fan_settings import Settings, find_config_file, load_settings
+from hat_bus import DEVICE_ADDR, FAN_SPEED_REG, LED_ALL, LED_SELECT_REG, LED_VALUE_REGS, MAX_LED, RGB_OFF_REG
+from poll_scheduler import AdaptivePoller
+from temp_filter import FilterTypes
+
+# Error codes
+OK_EXIT = 0
+ERR_INPUT = 2
+
+REGISTER_COUNT = FAN_SPEED_REG + 1
+"""Number of hat registers, 0x00 to 0x08."""
+STEP_SECONDS = 0.1
+"""Integration step of the thermal model and of the statistics, in seconds."""
+AMBIENT_TEMP = 25.0
+"""Default ambient temperature of the thermal model, in Celsius."""
+HEAT_CAPACITY = 30.0
+"""Default heat capacity of SoC and heatsink, in joules per Celsius."""
+PASSIVE_CONDUCTANCE = 0.1
+"""Default heat loss to ambient with the fan off, in watts per Celsius."""
+FAN_CONDUCTANCE = 0.25
+"""Default extra heat loss with the fan at 100%, in watts per Celsius."""
+LOAD_PROFILE = "0:2.5, 300:6, 1200:3, 1800:6.5, 2400:2.5"
+"""Default CPU power profile, as comma separated `seconds:watts` steps."""
+IDLE_POWER = 2.5
+"""CPU power at 0% load of the thermal model, in watts."""
+FULL_POWER = 7.5
+"""CPU power at 100% load of the thermal model, in watts."""
+HEAT_STEP_SECONDS = 10.0
+"""Shortest step of a power profile recovered from a trace, in seconds, averaging out sensor noise."""
+
+
+class VirtualClock:
+    """Monotonic time that only moves when `sleep()` is called."""
+
+    def __init__(self, on_advance: Optional[Callable[[float], None]] = None):
+        """Create a clock at time 0.
+
+        Args:
+            on_advance (Optional[Callable[[float], None]]): called with the elapsed seconds before each jump
+        """
+        self.now: float = 0.0
+        """Current time, in seconds."""
+        self.on_advance = on_advance
+        """Called with the elapsed seconds before each jump."""
+
+    def monotonic(self) -> float:
+        """Get current time, like `time.monotonic`."""
+        return self.now
+
+    def sleep(self, seconds: float) -> bool:
+        """Jump forward in time, like `time.sleep`.
+
+        Returns:
+            bool: always False, a simulation is never woken early
+        """
+        if seconds > 0:
+            if self.on_advance is not None:
+                self.on_advance(seconds)
+            self.now += seconds
+        return False
+
+
+class SimulatedHat:
+    """Register model of the yahboom RGB fan hat, registers 0x00 to 0x08.
+
+    Like the real hat the registers are write-only over i2c, so the
+    simulation reads them directly. Every transfer counts as a
+    transaction, and fails with `error_rate` probability, to exercise the
+    daemon's retries and reconnects.
+    """
+
+    def __init__(self, error_rate: float = 0.0, rng: Optional[random.Random] = None, address: int = DEVICE_ADDR):
+        """Create a hat, with all registers at 0 and fan off.
+
+        Args:
+            error_rate (float): probability of a failed transfer, from 0 to 1
+            rng (Optional[random.Random]): random source of failures, seeded for repeatable runs
+            address (int): i2c device address of the hat
+        """
+        self.address = address
+        """i2c device address of the hat."""
+        self.error_rate = error_rate
+        """Probability of a failed transfer."""
+        self.registers = bytearray(REGISTER_COUNT)
+        """Last value written to each register."""
+        self.leds: List[Tuple[int, int, int]] = [(0, 0, 0)] * MAX_LED
+        """Color of each LED."""
+        self.transactions: int = 0
+        """Number of i2c transfers, failed ones included."""
+        self.errors: int = 0
+        """Number of failed i2c transfers."""
+        self.opens: int = 0
+        """Number of times the bus was opened."""
+        self.fan_changes: int = 0
+        """Number of fan level changes."""
+        self._rng = rng or random.Random(0)
+
+    @property
+    def fan_level(self) -> int:
+        """int: current fan level, in percent."""
+        return register_to_level(self.registers[FAN_SPEED_REG])
+
+    def open(self, bus_number: int) -> "FakeSMBus":
+        """Open a bus to the hat, usable as `HatBus` factory.
+
+        Args:
+            bus_number (int): i2c bus number, ignored
+
+        Returns:
+            FakeSMBus: bus handle
+        """
+        self.opens += 1
+        return FakeSMBus(self)
+
+    def transfer(self, device_addr: int, register: int, values: Sequence[int]):
+        """Write consecutive registers in one transfer.
+
+        Raises:
+            OSError: if the address or register does not exist, or on an injected failure
+        """
+        self.transactions += 1
+        if device_addr != self.address:
+            self.errors += 1
+            raise OSError(errno.ENXIO, f"No device at address {hex(device_addr)}")
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise OSError(errno.EREMOTEIO, "Simulated i2c failure")
+        if register + len(values) > REGISTER_COUNT:
+            self.errors += 1
+            raise OSError(errno.EIO, f"No register {hex(register + len(values) - 1)}")
+        for offset, value in enumerate(values):
+            self._write(register + offset, value & 0xff)
+
+    def _write(self, register: int, value: int):
+        if register == FAN_SPEED_REG and register_to_level(value) != self.fan_level:
+            self.fan_changes += 1
+        self.registers[register] = value
+        if register in LED_VALUE_REGS:
+            selected = self.registers[LED_SELECT_REG]
+            channel = LED_VALUE_REGS.index(register)
+            leds = range(MAX_LED) if selected == LED_ALL else range(selected, min(selected + 1, MAX_LED))
+            for led in leds:
+                color = list(self.leds[led])
+                color[channel] = value
+                self.leds[led] = tuple(color)
+        elif register == RGB_OFF_REG:
+            self.leds = [(0, 0, 0)] * MAX_LED
+
+
+class FakeSMBus:
+    """Open bus to a `SimulatedHat`, with the `smbus2.SMBus` methods used by `HatBus`."""
+
+    funcs = 0
+    """Supported i2c functions: none beyond byte writes, so LED frames use byte writes."""
+
+    def __init__(self, hat: SimulatedHat):
+        self.hat = hat
+        """Simulated hat behind the bus."""
+
+    def enable_pec(self, enable: bool = True):
+        pass
+
+    def close(self):
+        pass
+
+    def write_byte_data(self, device_addr: int, register: int, value: int):
+        self.hat.transfer(device_addr, register, [value])
+
+    def write_i2c_block_data(self, device_addr: int, register: int, values: List[int]):
+        self.hat.transfer(device_addr, register, values)
+
+    def i2c_rdwr(self, *msgs):
+        for msg in msgs:
+            data = list(msg)
+            self.hat.transfer(msg.addr, data[0], data[1:])
+
+
+def parse_load(text: str) -> List[Tuple[float, float]]:
+    """Parse a CPU power profile.
+
+    Args:
+        text (str): comma separated `seconds:watts` steps, like "0:3, 600:6"
+
+    Returns:
+        List[Tuple[float, float]]: steps sorted by time
+
+    Raises:
+        ValueError: if text is not a valid profile
+    """
+    steps = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        time_str, sep, watts_str = item.partition(':')
+        if not sep:
+            raise ValueError(f"Invalid load step '{item}', expected 'seconds:watts'.")
+        steps.append((float(time_str), float(watts_str)))
+    if not steps:
+        raise ValueError("Load profile needs at least one step.")
+    steps.sort()
+    return steps
+
+
+class ThermalModel:
+    """Lumped thermal model of the SoC and its heatsink.
+
+    The CPU power follows a step profile. Heat flows to ambient through a
+    passive conductance, plus a fan conductance proportional to the fan
+    level, so the temperature reacts to what the hat really holds.
+    Each step is integrated exactly, as an exponential approach to the
+    steady temperature of the current power and fan level.
+    """
+
+    def __init__(self, load: Sequence[Tuple[float, float]], start_temp: Optional[float] = None,
+                 ambient_temp: float = AMBIENT_TEMP, heat_capacity: float = HEAT_CAPACITY,
+                 passive_conductance: float = PASSIVE_CONDUCTANCE, fan_conductance: float = FAN_CONDUCTANCE):
+        """Create a model.
+
+        Args:
+            load (Sequence[Tuple[float, float]]): `(seconds, watts)` power steps, sorted by time
+            start_temp (Optional[float]): initial temperature in Celsius, None for the fan off steady state
+            ambient_temp (float): ambient temperature, in Celsius
+            heat_capacity (float): heat capacity, in joules per Celsius
+            passive_conductance (float): heat loss with fan off, in watts per Celsius
+            fan_conductance (float): extra heat loss with fan at 100%, in watts per Celsius
+        """
+        self.load = list(load)
+        """Power steps, as `(seconds, watts)`."""
+        self.ambient_temp = ambient_temp
+        """Ambient temperature, in Celsius."""
+        self.heat_capacity = heat_capacity
+        """Heat capacity, in joules per Celsius."""
+        self.passive_conductance = passive_conductance
+        """Heat loss with fan off, in watts per Celsius."""
+        self.fan_conductance = fan_conductance
+        """Extra heat loss with fan at 100%, in watts per Celsius."""
+        self.time: float = 0.0
+        """Model time, in seconds."""
+        self.temperature: float = (ambient_temp + self.power(0.0) / passive_conductance
+                                   if start_temp is None else start_temp)
+        """Current temperature, in Celsius."""
+        self.energy: float = 0.0
+        """CPU energy since time 0, in joules."""
+        self._last_load = (0.0, 0.0)
+
+    @property
+    def duration(self) -> float:
+        """float: default run length, the start of the last power step plus 10 minutes."""
+        return self.load[-1][0] + 600.0
+
+    def power(self, now: float) -> float:
+        """Get CPU power at a time.
+
+        Args:
+            now (float): model time, in seconds
+
+        Returns:
+            float: power, in watts
+        """
+        watts = self.load[0][1]
+        for start, step_watts in self.load:
+            if start > now:
+                break
+            watts = step_watts
+        return watts
+
+    def read(self) -> float:
+        """Get current temperature, in Celsius."""
+        return self.temperature
+
+    def cpu_load(self) -> Optional[float]:
+        """Get CPU load since the previous call, like `sys_metrics.CpuLoad`.
+
+        The load scales linearly from `IDLE_POWER` to `FULL_POWER`.
+
+        Returns:
+            Optional[float]: load in percent, None on first call
+        """
+        last_time, last_energy = self._last_load
+        self._last_load = (self.time, self.energy)
+        if self.time <= last_time:
+            return None
+        watts = (self.energy - last_energy) / (self.time - last_time)
+        return 100.0 * min(1.0, max(0.0, (watts - IDLE_POWER) / (FULL_POWER - IDLE_POWER)))
+
+    def advance(self, seconds: float, fan_level: int):
+        """Integrate the model over a time step.
+
+        Args:
+            seconds (float): step length, in seconds
+            fan_level (int): fan level during the step, in percent
+        """
+        conductance = self.passive_conductance + self.fan_conductance * fan_level / 100.0
+        power = self.power(self.time)
+        self.energy += power * seconds
+        steady = self.ambient_temp + power / conductance
+        decay = math.exp(-conductance * seconds / self.heat_capacity)
+        self.temperature = steady + (self.temperature - steady) * decay
+        self.time += seconds
+
+
+def load_trace(path: str) -> List[Tuple[float, float, Optional[int]]]:
+    """Read a recorded temperature trace.
+
+    Text files hold one `seconds temperature [level]` line per sample,
+    separated by spaces or a comma, temperatures in Celsius or in
+    millidegrees as in sysfs; other lines, like a header, are skipped.
+    JSON files are the output of `fan_ctl.py --json history`.
+
+    Args:
+        path (str): trace file
+
+    Returns:
+        List[Tuple[float, float, Optional[int]]]: `(seconds, temperature, fan level)` samples, from time 0,
+            level None if not recorded
+
+    Raises:
+        OSError: if the file cannot be read
+        ValueError: if the file holds less than two samples
+    """
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    samples = []
+    if text.lstrip().startswith('{'):
+        history = json.loads(text)
+        age = history['columns'].index('age')
+        temp = history['columns'].index('temp')
+        level = history['columns'].index('level')
+        samples = [(-sample[age], sample[temp], sample[level]) for sample in history['samples']]
+    else:
+        for line in text.splitlines():
+            items = line.replace(',', ' ').split()
+            try:
+                seconds, temperature = float(items[0]), float(items[1])
+                level = int(float(items[2])) if len(items) > 2 else None
+            except (IndexError, ValueError):
+                continue
+            samples.append((seconds, temperature / 1000.0 if abs(temperature) >= 1000 else temperature, level))
+    if len(samples) < 2:
+        raise ValueError(f"Trace '{path}' needs at least two samples.")
+    samples.sort(key=lambda sample: sample[0])
+    start = samples[0][0]
+    return [(seconds - start, temperature, level) for seconds, temperature, level in samples]
+
+
+def trace_to_load(samples: Sequence[Tuple[float, float, Optional[int]]], ambient_temp: float = AMBIENT_TEMP,
+                  heat_capacity: float = HEAT_CAPACITY, passive_conductance: float = PASSIVE_CONDUCTANCE,
+                  fan_conductance: float = FAN_CONDUCTANCE) -> List[Tuple[float, float]]:
+    """Recover the CPU power profile behind a recorded trace, inverting `ThermalModel`.
+
+    Over each `HEAT_STEP_SECONDS` step, the power is the heat stored plus
+    the heat lost at the recorded fan level, or with the fan off if the
+    trace has no levels. Replaying that profile through the model lets a
+    policy change the temperatures of the recorded workload.
+
+    Args:
+        samples (Sequence[Tuple[float, float, Optional[int]]]): `(seconds, temperature, fan level)` samples
+        ambient_temp (float): ambient temperature, in Celsius
+        heat_capacity (float): heat capacity, in joules per Celsius
+        passive_conductance (float): heat loss with fan off, in watts per Celsius
+        fan_conductance (float): extra heat loss with fan at 100%, in watts per Celsius
+
+    Returns:
+        List[Tuple[float, float]]: `(seconds, watts)` power steps, sorted by time
+    """
+    load = []
+    start = 0
+    while start < len(samples) - 1:
+        end = start + 1
+        while end < len(samples) - 1 and samples[end][0] - samples[start][0] < HEAT_STEP_SECONDS:
+            end += 1
+        (t0, temp0, level0), (t1, temp1, _) = samples[start], samples[end]
+        if t1 > t0:
+            conductance = passive_conductance + fan_conductance * (level0 or 0) / 100.0
+            watts = heat_capacity * (temp1 - temp0) / (t1 - t0) + conductance * ((temp0 + temp1) / 2 - ambient_temp)
+            load.append((t0, max(0.0, watts)))
+        start = end
+    return load
+
+
+class TraceReplay:
+    """Replays a recorded temperature trace, linearly interpolated.
+
+    The trace was recorded with some fan policy already acting, and does
+    not react to the simulated fan: it compares how policies respond to
+    the same temperatures, not how well they cool. See `trace_to_load`
+    for the latter.
+    """
+
+    def __init__(self, samples: Sequence[Tuple[float, float, Optional[int]]]):
+        """Create a replay at the first sample.
+
+        Args:
+            samples (Sequence[Tuple[float, float, Optional[int]]]): `(seconds, temperature, fan level)` samples,
+                sorted by time
+        """
+        self.samples = [(seconds, temperature) for seconds, temperature, _ in samples]
+        """Samples, as `(seconds, temperature)`."""
+        self.time: float = 0.0
+        """Replay time, in seconds."""
+        self._index = 0
+
+    @property
+    def duration(self) -> float:
+        """float: default run length, the trace length."""
+        return self.samples[-1][0]
+
+    def read(self) -> float:
+        """Get the temperature at the current replay time, in Celsius."""
+        samples = self.samples
+        while self._index < len(samples) - 2 and samples[self._index + 1][0] <= self.time:
+            self._index += 1
+        (t0, temp0), (t1, temp1) = samples[self._index], samples[self._index + 1]
+        if self.time <= t0 or t1 <= t0:
+            return temp0
+        if self.time >= t1:
+            return temp1
+        return temp0 + (temp1 - temp0) * (self.time - t0) / (t1 - t0)
+
+    def cpu_load(self) -> Optional[float]:
+        """Get CPU load, never recorded in a trace.
+
+        Returns:
+            Optional[float]: always None
+        """
+        return None
+
+    def advance(self, seconds: float, fan_level: int):
+        """Move the replay time forward; the fan level is ignored."""
+        self.time += seconds
+
+
+@dataclass
+class SimulationReport:
+    """Outcome of a simulation run."""
+    mode: str
+    """Control mode."""
+    temp_filter: str
+    """Temperature filter."""
+    seconds: float
+    """Simulated time, in seconds."""
+    wakeups: int
+    """Temperature checks of the control loop."""
+    toggles: int
+    """Fan level changes on the hat."""
+    seconds_above: float
+    """Time at or above the threshold temperature, in seconds."""
+    peak_temp: float
+    """Highest temperature, in Celsius."""
+    mean_level: float
+    """Time averaged fan level, in percent."""
+    fan_on_seconds: float
+    """Time with the fan on at any level, in seconds."""
+    fan_writes: int
+    """Fan register writes sent to the bus, refreshes and retries included."""
+    i2c_transactions: int
+    """i2c transfers, failed ones included."""
+    i2c_errors: int
+    """Failed i2c transfers."""
+    failed_writes: int
+    """Fan writes still failing after `max_attempts`; the daemon would exit."""
+
+
+def simulate(settings: Settings, source, seconds: float, threshold: Optional[float] = None,
+             error_rate: float = 0.0, seed: int = 0, noise: float = 0.0) -> SimulationReport:
+    """Run the daemon's control loop on a simulated hat, faster than real time.
+
+    Args:
+        settings (Settings): daemon settings
+        source (ThermalModel | TraceReplay): temperature source, at its start
+        seconds (float): simulated time, in seconds
+        threshold (Optional[float]): temperature of the time above statistic, None for trigger temperature
+        error_rate (float): probability of a failed i2c transfer
+        seed (int): seed of i2c failures and sensor noise
+        noise (float): standard deviation of sensor noise added to each sample, in Celsius
+
+    Returns:
+        SimulationReport: statistics of the run
+    """
+    if threshold is None:
+        threshold = settings.trigger_temp
+    hat = SimulatedHat(error_rate, random.Random(seed), settings.device_address)
+    peak_temp = source.read()
+    seconds_above = 0.0
+    level_seconds = 0.0
+    fan_on_seconds = 0.0
+
+    def advance(elapsed: float):
+        nonlocal peak_temp, seconds_above, level_seconds, fan_on_seconds
+        # Statistics stop at the end of the run, the last sleep may go past it
+        remaining = min(elapsed, seconds - clock.now)
+        fan_level = hat.fan_level
+        while remaining > 1e-9:
+            step = min(STEP_SECONDS, remaining)
+            source.advance(step, fan_level)
+            temperature = source.read()
+            peak_temp = max(peak_temp, temperature)
+            if temperature >= threshold:
+                seconds_above += step
+            level_seconds += fan_level * step
+            if fan_level:
+                fan_on_seconds += step
+            remaining -= step
+
+    clock = VirtualClock(advance)
+    fan_loop = FanLoop(settings, bus_factory=hat.open, clock=clock.monotonic)
+    poller = AdaptivePoller(settings.min_sleep_seconds, settings.sleep_seconds, settings.max_sleep_seconds,
+                            clock=clock.monotonic, sleep=clock.sleep)
+    # Own source, so every filter sees the same noise
+    noise_rng = random.Random(seed)
+    wakeups = 0
+    while clock.now < seconds:
+        # Sensor resolution of sysfs, millidegrees
+        temperature = round(source.read() + (noise_rng.gauss(0.0, noise) if noise > 0 else 0.0), 3)
+        temperature, _ = fan_loop.tick(temperature, source.cpu_load())
+        wakeups += 1
+        poller.wait(temperature, *fan_loop.controller.thresholds())
+    return SimulationReport(
+        settings.control_mode, settings.temp_filter, seconds, wakeups, hat.fan_changes, seconds_above, peak_temp,
+        level_seconds / seconds if seconds > 0 else 0.0, fan_on_seconds, fan_loop.registers.writes_issued,
+        hat.transactions, hat.errors, fan_loop.failed_writes)
+
+
+def parse_setting(text: str):
+    """Parse a `name=value` setting argument.
+
+    Args:
+        text (str): setting argument
+
+    Returns:
+        Tuple[str, str]: setting name and value, converted later to the setting type
+
+    Raises:
+        argparse.ArgumentTypeError: if not a `name=value` pair
+    """
+    name, sep, value = text.partition('=')
+    if not sep or not name.strip():
+        raise argparse.ArgumentTypeError(f"'{text}' is not name=value")
+    return name.strip(), value.strip()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare fan control policies on a simulated hat, faster than real time.")
+    parser.add_argument('--config', default=None,
+                        help="daemon configuration file (default: the one the daemon would use, if any)")
+    parser.add_argument('--set', type=parse_setting, action='append', default=[], metavar='name=value',
+                        help="change a setting of the configuration, may be repeated")
+    parser.add_argument('--mode', nargs='+', choices=[mode.value for mode in ControlModes],
+                        help="control modes to compare (default: the configured one)")
+    parser.add_argument('--filter', nargs='+', choices=[kind.value for kind in FilterTypes],
+                        help="temperature filters to compare, changes avoided are counted against 'none' "
+                             "(default: the configured one)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--trace', help="recorded temperatures, replayed instead of the thermal model")
+    parser.add_argument('--replay-heat', action='store_true',
+                        help="with --trace, drive the thermal model with the power the trace implies, "
+                             "so policies change the temperatures and peaks compare")
+    source.add_argument('--load', default=LOAD_PROFILE,
+                        help=f"CPU power profile of the thermal model, as seconds:watts steps (default: {LOAD_PROFILE})")
+    parser.add_argument('--seconds', type=float, help="simulated time (default: trace length, or profile plus 10 min)")
+    parser.add_argument('--start-temp', type=float, help="initial temperature of the thermal model, in Celsius")
+    parser.add_argument('--ambient', type=float, default=AMBIENT_TEMP, help="ambient temperature, in Celsius")
+    parser.add_argument('--threshold', type=float, help="temperature of time above (default: trigger_temp)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="probability of a failed i2c transfer")
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help="standard deviation of sensor noise added to each sample, in Celsius")
+    parser.add_argument('--seed', type=int, default=0, help="seed of i2c failures and sensor noise")
+    parser.add_argument('--json', action='store_true', help="print reports as JSON")
+    args = parser.parse_args()
+
+    try:
+        settings = load_settings(args.config or find_config_file())
+        changes = {}
+        types = {name: type(value) for name, value in asdict(settings).items()}
+        for name, value in args.set:
+            if name not in types:
+                raise ValueError(f"Unknown setting '{name}'.")
+            changes[name] = types[name](value)
+        settings = settings.replace(**changes)
+        if args.trace:
+            trace = load_trace(args.trace)
+            load = trace_to_load(trace, args.ambient) if args.replay_heat else None
+            if args.start_temp is None and args.replay_heat:
+                args.start_temp = trace[0][1]
+        else:
+            load = parse_load(args.load)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return ERR_INPUT
+
+    reports = []
+    for mode in args.mode or [settings.control_mode]:
+        for temp_filter in args.filter or [settings.temp_filter]:
+            if load is None:
+                source = TraceReplay(trace)
+            else:
+                source = ThermalModel(load, args.start_temp, args.ambient)
+            seconds = args.seconds if args.seconds is not None else (
+                trace[-1][0] if args.trace else source.duration)
+            reports.append(simulate(settings.replace(control_mode=mode, temp_filter=temp_filter), source, seconds,
+                                    args.threshold, args.error_rate, args.seed, args.noise))
+
+    if args.json:
+        print(json.dumps([asdict(report) for report in reports], indent=2))
+        return OK_EXIT
+    threshold = args.threshold if args.threshold is not None else settings.trigger_temp
+    print(f"{'mode':<11} {'filter':<7} {'toggles':>7} {f'>={threshold:g}°C':>10} {'peak':>8} {'level':>6} "
+          f"{'fan on':>7} {'wakeups':>7} {'writes':>6} {'i2c':>6} {'errors':>6}")
+    unfiltered = {report.mode: report for report in reports if report.temp_filter == FilterTypes.NONE.value}
+    for report in reports:
+        print(f"{report.mode:<11} {report.temp_filter:<7} {report.toggles:7d} {report.seconds_above:9.0f}s "
+              f"{report.peak_temp:6.2f}°C {report.mean_level:5.1f}% "
+              f"{report.fan_on_seconds / 60:5.1f}min {report.wakeups:7d} {report.fan_writes:6d} "
+              f"{report.i2c_transactions:6d} {report.i2c_errors:6d}")
+        if report.failed_writes:
+            print(f"  {report.failed_writes} fan writes failed after {settings.max_attempts} attempts")
+        base = unfiltered.get(report.mode)
+        if base is not None and report is not base:
+            print(f"  avoided vs. none: {base.toggles - report.toggles} toggles, "
+                  f"{base.fan_writes - report.fan_writes} fan writes, "
+                  f"{base.i2c_transactions - report.i2c_transactions} i2c transfers")
+    return OK_EXIT
+
+
+if __name__ == "__main__":
+    sys.exit(main())
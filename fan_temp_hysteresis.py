@@ -1,29 +1,30 @@
 ﻿#!/usr/bin/env python3
 # Control fan speed of yahboom RGB fan hat, based on CPU temperature.
 
-import smbus2
+# Only modules needed for the first fan write are imported here. Journal,
+# log files, telemetry, metrics, control socket and configuration watcher
+# are imported once the fan is set, so a restart on a hot SoC acts on the
+# fan as soon as possible. The configuration parser is not deferred: the
+# bus, address and fan policy of the first write come from the file.
+import atexit
 import signal
 import sys
 import configparser
 import os
-from time import sleep
+import math
+import threading
+from time import monotonic, perf_counter, time
 from enum import Enum
+from typing import Dict, List, Optional, Tuple
 import logging
-import logging.handlers
-from systemd.journal import JournalHandler
-
-# Device address
-DEVICE_ADDR = 0x0d
-"""i2c device address used by yahboom RBG fan hat."""
-# Fan control register
-FAN_SPEED_REG = 0x08
-"""i2c register address to regulate fan speed."""
-
-# Constants
-REPOSITORY = "yahboom-raspi-cooling-fan"
-"""Product code of yahboom RGB fan hat."""
-MODULE_NAME = "yahboom-fan-ctrl"
-"""Module name used for configuration file and log file."""
+from hat_bus import FAN_SPEED_REG, HatBus, RegisterShadow
+from thermal_sampler import SensorFusion, SensorSet, select_sensors
+from temp_filter import FilterTypes
+from poll_scheduler import AdaptivePoller
+from fan_control import FAN_LEVELS, ControlModes, FanController, FanCurve, level_to_register, parse_curve
+from fan_loop import FanLoop
+from fan_settings import (MODULE_NAME, RESTART_SETTINGS, Settings,
+                          find_config_file, load_devices, load_settings, parse_windows)
 
 # Error codes
 OK_EXIT = 0
@@ -32,27 +33,17 @@ ERR_PYTHON_VERSION = 2
 ERR_IC2_DEVICE = 3
 ERR_TEMPERATURE_FILE = 4
 ERR_LOG_FILE = 5
+ERR_CONFIG = 6
 
-# Configuration global variables
-bus_number: int = 1  # raspberry pi with 256MB uses bus_number = 0
-"""i2c bus number."""
-log_file: str = f"/var/log/{REPOSITORY}/" + MODULE_NAME + ".log"
-"""Log file path."""
-verbose: int = 1
-"""Verbosity level of messages."""
-max_log_size: int = 100*1024
-"""Maximum size of log file, in bytes."""
-max_log_backups: int = 3
-"""Maximum number of log file backups."""
-
-hysteresis_temp: float = 10.0
-"""Temperature hysteresis to turn off fan, in Celsius."""
-trigger_temp: float = 55.0
-"""Temperature at which fan is turned on in Celsius."""
-max_attempts = 3
-"""Maximum number of attempts to write to i2c device."""
-sleep_seconds = 2.0
-"""Time to sleep between temperature checks, in seconds."""
+POLL_REPORT_SECONDS = 3600.0
+"""Period of polling statistics in log, in seconds."""
+LOOP_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.5)
+"""Histogram buckets of control loop and i2c timing, in seconds."""
+
+RUNTIME_SETTINGS = ('trigger_temp', 'hysteresis_temp', 'pid_target_temp')
+"""Settings that can be changed through the control socket."""
+HISTORY_LIMIT = 3600
+"""Maximum number of samples returned by a history request."""
 
 
 class FanActions(Enum):
@@ -89,58 +80,62 @@ def signal_name(signum: int) -> str:
         return 'SIG_UNKNOWN'
 
 
-def read_config():
-    """Read configuration from file or command line arguments.
+def read_config() -> Settings:
+    """Read configuration from file, exiting if it is not valid.
+
+    Returns:
+        Settings: configuration, with default values for missing options
+    """
+    config_file_path = find_config_file()
+    try:
+        return load_settings(config_file_path)
+    except (OSError, ValueError, configparser.Error) as e:
+        print(f"Error: Invalid configuration file '{config_file_path}': {e} Aborting.", file=sys.stderr)
+        exit(ERR_CONFIG)
+
+
+def read_devices(settings: Settings) -> Dict[str, Settings]:
+    """Read settings of extra hats from the configuration file, exiting if they are not valid.
+
+    Args:
+        settings (Settings): settings of the main hat, defaults of every device
+
+    Returns:
+        Dict[str, Settings]: settings by device name
     """
-    global bus_number, log_file, verbose, max_log_size, max_log_backups
-    global hysteresis_temp, trigger_temp, max_attempts, sleep_seconds
-    # Read configuration from file
-    config = configparser.ConfigParser()
-
-    # Search for config file in /etc/yahboom-fan-ctrl/ and ./ directories
-    config_file_paths = [
-        f"/etc/{MODULE_NAME}/{MODULE_NAME}.conf",
-        f"./{MODULE_NAME}.conf"]
-    for config_file_path in config_file_paths:
-        if os.path.exists(config_file_path):
-            config.read(config_file_path)
-            break
-
-    # Set configuration variables from file or default values
-    bus_number = config.getint('DEFAULT', 'bus_number', fallback=bus_number)
-    log_file = config.get('DEFAULT', 'log_file', fallback=log_file)
-    verbose = config.getint('DEFAULT', 'verbose', fallback=verbose)
-    max_log_size = config.getint(
-        'DEFAULT', 'max_log_size', fallback=max_log_size)
-    max_log_backups = config.getint(
-        'DEFAULT', 'max_log_backups', fallback=max_log_backups)
-
-    hysteresis_temp = config.getfloat(
-        'FAN-CTRL', 'hysteresis_temp', fallback=hysteresis_temp)
-    trigger_temp = config.getfloat(
-        'FAN-CTRL', 'trigger_temp', fallback=trigger_temp)
-    max_attempts = config.getint(
-        'FAN-CTRL', 'max_attempts', fallback=max_attempts)
-    sleep_seconds = config.getfloat(
-        'FAN-CTRL', 'sleep_seconds', fallback=sleep_seconds)
-
-
-def setup_logging(verbose_level: int, log_file: str) -> logging.Logger:
+    config_file_path = find_config_file()
+    try:
+        return load_devices(config_file_path, settings)
+    except (OSError, ValueError, configparser.Error) as e:
+        print(f"Error: Invalid device sections in '{config_file_path}': {e} Aborting.", file=sys.stderr)
+        exit(ERR_CONFIG)
+
+
+def setup_logging(verbose_level: int, log_file: str, max_log_size: int,
+                  max_log_backups: int) -> Tuple[logging.Logger, "LogWriter"]:
     """Setup of Log management, to file and journalctl.
+    Records are queued, and written by a background thread, so a slow
+    file system or journal never stalls the control loop.
 
     Args:
         verbose_level (int): verbosity level
         log_file (str): file path to log file
+        max_log_size (int): maximum size of log file, in bytes
+        max_log_backups (int): maximum number of log file backups
 
     Returns:
-        logging.Logger: logger object
+        Tuple[logging.Logger, LogWriter]: logger object, and writer of its records
     """
+    import logging.handlers
+    from systemd.journal import JournalHandler
+    from log_pipeline import LogWriter
     #
     # Reference: https://docs.python.org/3.9/howto/logging.html
     new_logger = logging.getLogger(MODULE_NAME)
     jh = JournalHandler(SYSLOG_IDENTIFIER=MODULE_NAME)
+    jh.set_name('journal')
     jh.setLevel(logging.INFO if verbose_level < 2 else logging.DEBUG)
-    new_logger.addHandler(jh)
+    handlers = [jh]
     new_logger.setLevel(logging.DEBUG)
     # Reference for multiple handlers: https://docs.python.org/3.9/howto/logging-cookbook.html?highlight=logger#multiple-handlers-and-formatters
     # Reference for log to file: https://stackoverflow.com/questions/6386698/how-to-write-to-a-file-using-the-logging-python-module
@@ -151,14 +146,21 @@ def setup_logging(verbose_level: int, log_file: str) -> logging.Logger:
         formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s - %(message)s')
         fh.setFormatter(formatter)
-        new_logger.addHandler(fh)
-    return new_logger
+        handlers.append(fh)
+    writer = LogWriter(handlers)
+    writer.start()
+    # Write queued records on any exit, also on errors
+    atexit.register(writer.stop)
+    new_logger.addHandler(writer.handler)
+    return new_logger, writer
 
 
-def assure_log():
+def assure_log(log_file: str):
     """Check if log file and directory exists, if not create them.
+
+    Args:
+        log_file (str): file path to log file
     """
-    global log_file, max_log_size, max_log_backups
     # check non empty file name
     if len(log_file) == 0:
         print("Error: log file cannot be empty. Aborting.", file=sys.stderr)
@@ -180,19 +182,100 @@ def assure_log():
         exit(ERR_LOG_FILE)
 
 
+class StartupBuffer(logging.Handler):
+    """Keeps log records until log management is set up."""
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+        """Records kept, oldest first."""
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+
 def main():
     """Main function of the program.
        If python version is not 3.5 or higher, exit with error code 127.
     """
     # Variables
+    settings: Settings
+    """Current configuration, replaced as a whole on reload."""
     temperature: float
     """Current CPU temperature in Celsius."""
     fan_action: FanActions
     """Action to be taken by fan."""
     last_action: FanActions = FanActions.OFF
     """Last action taken by fan."""
+    fan_level: int
+    """Fan level to set, in percent."""
+    last_level: int = 0
+    """Last fan level set, in percent."""
+    fan_loop: FanLoop
+    """Filter, fan decision and fan write of each check, the simulator's too."""
+    controller: FanController
+    """Fan level decision of the control mode in use."""
+    telemetry: "TelemetryRing"
+    """In-memory history of samples, with window statistics."""
+    telemetry_file: Optional["TelemetryFile"] = None
+    """Binary ring file of samples, outliving restarts, None while disabled."""
+    sample_flags: int = 0
+    """`SampleFlags` of the next telemetry file sample."""
+    i2c_errors: int = 0
+    """i2c errors of the hat at the previous telemetry file sample."""
+    i2c_time: float
+    """Time spent writing to i2c device in current tick, in seconds."""
     common_logger: logging.Logger
     """Logger object to write to journal and log file."""
+    log_writer: "LogWriter"
+    """Background writer of log records to journal and log file."""
+    startup_buffer: StartupBuffer = StartupBuffer()
+    """Log records of the first fan write, until log management is set up."""
+    hat_bus: HatBus
+    """Persistent i2c session with the hat, owned by the daemon."""
+    registers: RegisterShadow
+    """Shadow of hat registers, to skip writes of an unchanged fan state."""
+    sensors: SensorSet
+    """Temperature sensors, keeping their kernel device files open."""
+    fusion: SensorFusion
+    """Combination of sensor readings into the temperature driving the fan."""
+    raw_temperature: float = 0.0
+    """Fused temperature before filtering, in Celsius."""
+    cpu_load: Optional["CpuLoad"] = None
+    """Sampler of CPU load for the feed-forward, None while disabled."""
+    cpu_loads: Dict[str, float] = {}
+    """CPU load since previous check in percent, by name: 'cpu' for all cores, then per core."""
+    failed_sensors: set = set()
+    """Names of sensors failing on last read, while others still work."""
+    poller: AdaptivePoller
+    """Scheduler of temperature checks."""
+    registry: "MetricsRegistry"
+    """Prometheus metrics of the daemon, created once the fan is set."""
+    exporter: "MetricsExporter"
+    """Exporter of metrics, over HTTP and/or a textfile."""
+    loop_start: float
+    """Start time of the current control loop iteration, in seconds."""
+    control_server: "ControlServer"
+    """Control socket server, answering from its own thread."""
+    devices: Dict[str, Settings]
+    """Settings of extra hats, by device name."""
+    workers: List["BusWorker"] = []
+    """Workers driving the extra hats, one per i2c bus."""
+    state_lock = threading.Lock()
+    """Lock of state shared by the control loop and control requests."""
+    wake = threading.Event()
+    """Set by control requests to run the control loop early."""
+    override_level: int = -1
+    """Fan level forced through the control socket, in percent, -1 if none."""
+    override_until: float = 0.0
+    """Monotonic time at which the fan level override expires, in seconds."""
+    pending_settings: dict = {}
+    """Settings changed through the control socket, applied on next loop."""
+    reload_requested: bool = False
+    """Whether the configuration file must be read again, on next loop."""
+    config_watcher: "ConfigWatcher"
+    """Watcher of configuration file changes."""
+
 
     def signal_handler(signal_num: int, frame):
         """Exit the program, after writing to log and turning off fan.
@@ -203,96 +286,307 @@ def main():
         """
         common_logger.info(
             f"Caught terminate signal '{signal_name(signal_num)}'. Turn fan off.\n")
-        set_fan(FanActions.OFF)
+        set_fan(FanActions.OFF, force=True)
+        common_logger.info(
+            f"i2c writes issued: {registers.writes_issued}, suppressed: {registers.writes_suppressed}.")
+        for subsystem in (exporter, control_server, config_watcher):
+            if subsystem is not None:
+                subsystem.stop()
+        hat_bus.close()
+        sensors.close()
+        if cpu_load is not None:
+            cpu_load.close()
+        if telemetry_file is not None:
+            telemetry_file.close()
         exit(OK_EXIT)
 
     def init_communication():
-        """Initialize communication with i2c device, also writing to log.
+        """Initialize communication with i2c device, setting the fan level of
+        the current temperature at once, also writing to log.
         If communication fails, exit with error code 2.
         """
+        nonlocal last_action, last_level
         common_logger.info(f"Starting {MODULE_NAME} log.")
+        temperature = fan_loop.sample_filter.update(get_cpu_temp(), monotonic())
+        # The first update always decides a level
+        last_level = controller.update(temperature, monotonic())
+        last_action = FanActions.ON if controller.fan_on else FanActions.OFF
         try:
-            with smbus2.SMBus(bus_number) as bus:
-                bus.enable_pec(True)  # Enable "Packet Error Checking"
-                # Stop fan
-                bus.write_byte_data(DEVICE_ADDR, FAN_SPEED_REG, 0x00)
+            # First fan decision, also opening the persistent session
+            registers.write(FAN_SPEED_REG, level_to_register(last_level), force=True)
         except Exception as e:
             common_logger.critical(
-                f"Cannot open i2c device at bus {bus_number}, address '{hex(DEVICE_ADDR)}'! Aborting.\n",
+                f"Cannot open i2c device at bus {settings.bus_number}, address '{hex(settings.device_address)}'! Aborting.\n",
                 exc_info=True)
             exit(ERR_IC2_DEVICE)
         else:
             common_logger.info(
-                f"Connected successfully to i2c device at bus {bus_number}, address '{hex(DEVICE_ADDR)}'.")
+                f"Connected successfully to i2c device at bus {settings.bus_number}, address '{hex(settings.device_address)}'.")
 
         common_logger.info(
-            f"Initial Temp: {get_cpu_temp():.2f}°C, trigger temp: >={trigger_temp:.2f}°C, hys. temp: {-hysteresis_temp:.2f}°C.")
+            f"Initial Temp: {temperature:.2f}°C, trigger temp: >={settings.trigger_temp:.2f}°C, hys. temp: {-settings.hysteresis_temp:.2f}°C.")
+        common_logger.info(f"Initial fan level: {last_level}%.")
+
+    def start_logging():
+        """Set up log management, then write the records kept since startup."""
+        nonlocal common_logger, log_writer
+        assure_log(settings.log_file)
+        common_logger, log_writer = setup_logging(
+            settings.verbose, settings.log_file, settings.max_log_size, settings.max_log_backups)
+        common_logger.removeHandler(startup_buffer)
+        for record in startup_buffer.records:
+            log_writer.handler.handle(record)
+        startup_buffer.records.clear()
 
     def get_cpu_temp() -> float:
-        """Get CPU temperature from kernel device file.
+        """Get temperature driving the fan, from kernel device files of the sensors.
+        Exits only if every sensor fails.
 
         Returns:
-            float: CPU temperature in Celsius
+            float: fused temperature in Celsius, before filtering
         """
-        CPU_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
-        temp: float = -173.15
+        nonlocal failed_sensors, raw_temperature
         try:
-            with open(CPU_TEMP_FILE, 'r') as f:
-                temp_str = f.readline()
-                temp = float(temp_str.strip()) / 1000.0
+            temps = sensors.read()
         except FileNotFoundError:
             common_logger.critical(
-                f"Error: Cannot find system temperature file '{CPU_TEMP_FILE}'.",
+                f"Error: Cannot find system temperature file '{sensors.paths[0]}'.",
                 exc_info=True)
             exit(ERR_TEMPERATURE_FILE)
         except PermissionError:
             common_logger.critical(
-                f"Error: Permission denied to access temperature file '{CPU_TEMP_FILE}'.",
+                f"Error: Permission denied to access temperature file '{sensors.paths[0]}'.",
                 exc_info=True)
             exit(ERR_TEMPERATURE_FILE)
         except:
             common_logger.critical(
-                f"Error: Unknown error reading temperature file '{CPU_TEMP_FILE}'.",
+                f"Error: Unknown error reading temperature file '{sensors.paths[0]}'.",
                 exc_info=True)
             exit(ERR_TEMPERATURE_FILE)
-        return temp
-
-    def set_fan(action: FanActions):
+        if sensors.failed != failed_sensors:
+            if sensors.failed - failed_sensors:
+                common_logger.warning(f"Sensors failing, left out: {', '.join(sorted(sensors.failed - failed_sensors))}.")
+            if failed_sensors - sensors.failed:
+                common_logger.info(f"Sensors back: {', '.join(sorted(failed_sensors - sensors.failed))}.")
+            failed_sensors = sensors.failed
+        raw_temperature = fusion.fuse(temps, settings.trigger_temp)
+        return raw_temperature
+
+    def set_fan(action: FanActions, force: bool = False):
         """Activate/deactivate fan, calling i2c write function.
 
         Args:
             action (FanActions): Requested action
+            force (bool): write even if the fan state did not change
         """
-        success = False
-        attempt = 1
-        # 0x1 = 100% fan speed, 0x0 = 0% fan speed
-        value = 0x01 if action == FanActions.ON else 0x00
-        while not success and attempt <= max_attempts:
-            try:
-                with smbus2.SMBus(bus_number) as bus:
-                    bus.enable_pec(True)
-                    bus.write_byte_data(DEVICE_ADDR, FAN_SPEED_REG, value)
-            except:
-                if attempt <= max_attempts:
-                    attempt += 1
-                    if verbose >= 2:
-                        common_logger.exception(
-                            f"Write i2c error, attempt {attempt}.",
-                            exc_info=True)
-                else:
-                    common_logger.critical(
-                        f"Cannot write to i2c device after {attempt} attempts.",
-                        exc_info=True)
-                    exit(ERR_IC2_DEVICE)
-            else:
-                success = True
+        fan_loop.write(100 if action == FanActions.ON else 0, force)
+
+    def log_retry(attempt: int, error: Exception):
+        """Log a failed fan write, before its retry.
+
+        Args:
+            attempt (int): number of the next attempt
+            error (Exception): error of the failed write
+        """
+        # Every retry is logged, for error bursts in log analysis
+        common_logger.warning(
+            "Write i2c error, attempt %d: %s", attempt, error,
+            exc_info=settings.verbose >= 2)
+
+    def stop_on_failure(attempts: int, error: Exception):
+        """Exit with error code 3 once a fan write failed every attempt.
+
+        Args:
+            attempts (int): number of attempts
+            error (Exception): error of the last attempt
+        """
+        common_logger.critical(
+            f"Cannot write to i2c device after {attempts} attempts.",
+            exc_info=True)
+        exit(ERR_IC2_DEVICE)
+
+    def interruptible_sleep(seconds: float) -> bool:
+        """Sleep, unless woken by a control request.
+
+        Args:
+            seconds (float): time to sleep, in seconds
 
-    # Read configuration from file(s), affecting global configuration variables
-    read_config()
-    assure_log()
+        Returns:
+            bool: True if woken early
+        """
+        woken = wake.wait(seconds)
+        wake.clear()
+        return woken
+
+    def request_reload(signal_num: int = 0, frame=None):
+        """Ask the control loop to read the configuration file again.
+        Called on SIGHUP and from the configuration watcher thread.
+
+        Args:
+            signal_num (int): signal value, 0 if not from a signal
+            frame (frame object): current stack frame
+        """
+        nonlocal reload_requested
+        reload_requested = True
+        wake.set()
+
+    def reload_config():
+        """Read the configuration file again and apply it, keeping the current one if not valid."""
+        config_file_path = find_config_file()
+        try:
+            new_settings = load_settings(config_file_path)
+        except (OSError, ValueError, configparser.Error) as e:
+            common_logger.error(
+                f"Invalid configuration file '{config_file_path}', keeping current settings: {e}")
+            return
+        try:
+            if load_devices(config_file_path, new_settings) != devices:
+                common_logger.warning("Restart needed to apply changes of extra hats.")
+        except (ValueError, configparser.Error) as e:
+            common_logger.error(f"Invalid device sections, keeping current extra hats: {e}")
+        apply_settings(new_settings, f"'{config_file_path}'")
 
-    # Log management
-    common_logger = setup_logging(verbose, log_file)
+    def apply_settings(new_settings: Settings, source: str):
+        """Swap in new settings, updating controllers without touching the fan.
+
+        Args:
+            new_settings (Settings): validated settings
+            source (str): origin of the change, for the log
+        """
+        nonlocal settings, fusion, cpu_load
+        changes = settings.diff(new_settings)
+        if not changes:
+            common_logger.info(f"Settings reloaded from {source}, no change.")
+            return
+        common_logger.info(f"Settings changed from {source}: " + ", ".join(
+            f"{name} {old!r} -> {new!r}" for name, (old, new) in changes.items()))
+        restart = [name for name in changes if name in RESTART_SETTINGS]
+        if restart:
+            common_logger.warning(f"Restart needed to apply: {', '.join(restart)}.")
+            # Keep reporting the values really in use
+            new_settings = new_settings.replace(**{name: getattr(settings, name) for name in restart})
+        registers.refresh_seconds = new_settings.refresh_seconds
+        fan_loop.max_attempts = new_settings.max_attempts
+        poller.set_intervals(
+            new_settings.min_sleep_seconds, new_settings.sleep_seconds, new_settings.max_sleep_seconds)
+        controller.trigger_temp = new_settings.trigger_temp
+        controller.hysteresis_temp = new_settings.hysteresis_temp
+        if 'fan_curve' in changes or 'curve_hysteresis_temp' in changes:
+            controller.curve = FanCurve(parse_curve(new_settings.fan_curve), new_settings.curve_hysteresis_temp)
+        pid = controller.pid
+        pid.target_temp = new_settings.pid_target_temp
+        pid.kp = new_settings.pid_kp
+        pid.ki = new_settings.pid_ki
+        pid.kd = new_settings.pid_kd
+        pid.rate_limit_seconds = new_settings.pid_rate_limit_seconds
+        controller.predict_seconds = new_settings.predict_seconds
+        controller.predictor.window_seconds = new_settings.predict_window_seconds
+        feed_forward = controller.feed_forward
+        feed_forward.weight = new_settings.load_weight
+        feed_forward.threshold = new_settings.load_threshold
+        feed_forward.hold_seconds = new_settings.load_hold_seconds
+        if new_settings.load_weight > 0 and cpu_load is None:
+            from sys_metrics import CpuLoad
+            cpu_load = CpuLoad()
+        if 'verbose' in changes:
+            for handler in log_writer.handlers:
+                if handler.get_name() == 'journal':
+                    handler.setLevel(logging.INFO if new_settings.verbose < 2 else logging.DEBUG)
+        if changes.keys() & {'sensor_fusion', 'sensor_weights', 'sensor_triggers'}:
+            fusion = new_settings.fusion(sensors.names)
+        if any(name == 'temp_filter' or name.startswith('filter_') for name in changes):
+            # Starts over from the next sample
+            fan_loop.sample_filter = new_settings.sample_filter()
+        if 'control_mode' in changes:
+            controller.mode = ControlModes(new_settings.control_mode)
+            controller.restore()
+        settings = new_settings
+
+    def handle_request(request: dict) -> dict:
+        """Answer a control socket request, in the server thread.
+
+        Args:
+            request (dict): 'cmd' and its arguments
+
+        Returns:
+            dict: response, with 'ok' and the requested data or an 'error'
+        """
+        nonlocal override_level, override_until
+        cmd = request.get('cmd')
+        now = monotonic()
+        with state_lock:
+            if cmd == 'status':
+                latest = telemetry.latest()
+                return {
+                    'ok': True,
+                    'mode': settings.control_mode,
+                    'temp': round(latest[1], 2) if latest else None,
+                    'raw_temp': round(raw_temperature, 2),
+                    'load': {name: round(load, 1) for name, load in cpu_loads.items()},
+                    'feed_forward': round(controller.feed_forward.offset, 2),
+                    'level': last_level,
+                    'override': {'level': override_level, 'expires_in': round(override_until - now, 1)}
+                    if override_level >= 0 else None,
+                    'settings': {name: getattr(settings, name) for name in RUNTIME_SETTINGS},
+                    'pending': dict(pending_settings),
+                    'sensors': {name: None if temp is None else round(temp, 2)
+                                for name, temp in zip(sensors.names, sensors.temps)},
+                    'interval': poller.interval,
+                    'devices': {device.name: device.status() for worker in workers for device in worker.devices},
+                    'i2c': {'writes': registers.writes_issued, 'suppressed': registers.writes_suppressed,
+                            'errors': hat_bus.errors, 'reconnects': hat_bus.reconnects},
+                }
+            if cmd == 'history':
+                seconds = float(request.get('seconds', 60))
+                limit = int(request.get('limit', HISTORY_LIMIT))
+                if limit <= 0:
+                    return {'ok': False, 'error': "limit must be a positive number of samples"}
+                limit = min(limit, HISTORY_LIMIT)
+                return {
+                    'ok': True,
+                    'columns': ['age', 'temp', 'level', 'latency'],
+                    'samples': [[round(now - sample[0], 3), round(sample[1], 2), sample[2], sample[3]]
+                                for sample in telemetry.history(now - seconds, limit)],
+                }
+            if cmd == 'override':
+                level = request.get('level')
+                if level is None:
+                    override_level = -1
+                    common_logger.info("Fan level override cleared.")
+                else:
+                    ttl = request.get('ttl')
+                    if level not in FAN_LEVELS or isinstance(level, bool):
+                        return {'ok': False, 'error': f"level must be one of {list(FAN_LEVELS)}"}
+                    if not isinstance(ttl, (int, float)) or isinstance(ttl, bool) or not math.isfinite(ttl) or ttl <= 0:
+                        return {'ok': False, 'error': "ttl must be a positive number of seconds"}
+                    override_level = int(level)
+                    override_until = now + ttl
+                    common_logger.info(f"Fan level override: {override_level}% for {ttl}s.")
+                wake.set()
+                return {'ok': True}
+            if cmd == 'set':
+                changes = {name: value for name, value in request.items() if name != 'cmd'}
+                for name, value in changes.items():
+                    if name not in RUNTIME_SETTINGS:
+                        return {'ok': False, 'error': f"unknown setting '{name}', one of {list(RUNTIME_SETTINGS)}"}
+                    if not isinstance(value, (int, float)) or isinstance(value, bool) or not math.isfinite(value):
+                        return {'ok': False, 'error': f"{name} must be a number"}
+                try:
+                    settings.replace(**{**pending_settings, **changes})
+                except ValueError as e:
+                    return {'ok': False, 'error': str(e)}
+                pending_settings.update(changes)
+                wake.set()
+                return {'ok': True}
+        return {'ok': False, 'error': f"unknown command '{cmd}', one of status, history, override, set"}
+
+    # Read configuration from file(s)
+    settings = read_config()
+
+    # Log records are kept until the fan is set
+    common_logger = logging.getLogger(MODULE_NAME)
+    common_logger.setLevel(logging.DEBUG)
+    common_logger.addHandler(startup_buffer)
 
     # Check python version on runtime
     if sys.version_info < (3, 5):
@@ -301,36 +595,255 @@ def main():
             exc_info=True)
         exit(ERR_PYTHON_VERSION)
 
+    # Temperature sensors
+    try:
+        sensors = SensorSet(select_sensors(settings.sensors))
+    except ValueError as e:
+        print(f"Error: Invalid sensors '{settings.sensors}': {e} Aborting.", file=sys.stderr)
+        exit(ERR_CONFIG)
+    fusion = settings.fusion(sensors.names)
+
+    # Extra hats, started once the main one is set
+    devices = read_devices(settings)
+    if devices:
+        from fan_devices import create_workers
+        try:
+            workers = create_workers(devices, common_logger)
+        except ValueError as e:
+            print(f"Error: {e} Aborting.", file=sys.stderr)
+            exit(ERR_CONFIG)
+
+    # i2c session, kept open for the whole life of the daemon
+    fan_loop = FanLoop(settings, on_retry=log_retry, on_failure=stop_on_failure)
+    hat_bus, registers, controller = fan_loop.hat_bus, fan_loop.registers, fan_loop.controller
+    exporter = None
+    control_server = None
+    config_watcher = None
+    poller = AdaptivePoller(settings.min_sleep_seconds, settings.sleep_seconds, settings.max_sleep_seconds,
+                            sleep=interruptible_sleep)
+    if settings.load_weight > 0:
+        from sys_metrics import CpuLoad
+        cpu_load = CpuLoad()
+
     # System signal management
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, request_reload)
 
-    # Init
-    init_communication()
+    # Init: fan first, then log management and the other subsystems
+    try:
+        init_communication()
+    finally:
+        start_logging()
+
+    # Metrics and telemetry
+    from telemetry import TelemetryRing
+    from metrics_exporter import MetricsExporter, MetricsRegistry
+    registry = MetricsRegistry()
+    temp_gauge = registry.gauge(
+        "yahboom_fan_temperature_celsius", "CPU temperature.")
+    level_gauge = registry.gauge(
+        "yahboom_fan_level_percent", "Fan level set on the hat.")
+    interval_gauge = registry.gauge(
+        "yahboom_fan_poll_interval_seconds", "Last interval between temperature checks.")
+    toggles_counter = registry.counter(
+        "yahboom_fan_toggles_total", "Fan level changes.")
+    writes_counter = registry.counter(
+        "yahboom_fan_i2c_writes_total", "Register writes issued to the hat.")
+    suppressed_counter = registry.counter(
+        "yahboom_fan_i2c_writes_suppressed_total", "Register writes skipped, the hat already holding the value.")
+    retries_counter = registry.counter(
+        "yahboom_fan_i2c_retries_total", "Register writes retried after an i2c error.")
+    errors_counter = registry.counter(
+        "yahboom_fan_i2c_errors_total", "Failed i2c transfers.")
+    reconnects_counter = registry.counter(
+        "yahboom_fan_i2c_reconnects_total", "Reopenings of the i2c session after an error.")
+    loop_histogram = registry.histogram(
+        "yahboom_fan_loop_duration_seconds", "Work time of a control loop iteration.", LOOP_BUCKETS)
+    i2c_histogram = registry.histogram(
+        "yahboom_fan_i2c_duration_seconds", "Time spent writing the fan level, per iteration.", LOOP_BUCKETS)
+    # Enough samples for the largest window at the fastest polling
+    windows = parse_windows(settings.telemetry_windows)
+    telemetry = TelemetryRing(
+        math.ceil(max(windows) / max(0.1, min(settings.min_sleep_seconds, settings.sleep_seconds))) + 1, windows)
+    if settings.telemetry_file:
+        from telemetry_file import SampleFlags, TelemetryFile
+        try:
+            telemetry_file = TelemetryFile(settings.telemetry_file, settings.telemetry_file_samples)
+        except OSError:
+            # The file is optional, fan control goes on without it
+            common_logger.error(f"Cannot open telemetry file '{settings.telemetry_file}'.", exc_info=True)
+        else:
+            kept = min(telemetry_file.count, telemetry_file.capacity) if telemetry_file.reused else 0
+            common_logger.info(
+                f"Writing telemetry to '{settings.telemetry_file}' ({telemetry_file.capacity} samples, {kept} kept).")
+            sample_flags = SampleFlags.START
+    common_logger.info(f"Control mode: {settings.control_mode}.")
+    if settings.sensors:
+        common_logger.info(
+            f"Temperature sensors: {', '.join(sensors.names)}, fusion: {settings.sensor_fusion}.")
+    if settings.temp_filter != FilterTypes.NONE.value:
+        common_logger.info(f"Temperature filter: {settings.temp_filter}.")
+    exporter = MetricsExporter(registry, settings.metrics_address, settings.metrics_port,
+                               settings.metrics_textfile, settings.metrics_textfile_seconds)
+    try:
+        exporter.start()
+    except OSError:
+        # Monitoring is optional, fan control goes on without it
+        common_logger.error(
+            f"Cannot serve metrics on {settings.metrics_address}:{settings.metrics_port}.", exc_info=True)
+    else:
+        if settings.metrics_port:
+            common_logger.info(f"Serving metrics on http://{settings.metrics_address}:{settings.metrics_port}/metrics.")
+        if settings.metrics_textfile:
+            common_logger.info(f"Writing metrics to '{settings.metrics_textfile}'.")
+    if settings.control_socket_path:
+        from control_socket import ControlServer
+        control_server = ControlServer(settings.control_socket_path, handle_request)
+        try:
+            control_server.start()
+        except OSError:
+            # Control is optional, fan control goes on without it
+            common_logger.error(
+                f"Cannot create control socket '{settings.control_socket_path}'.", exc_info=True)
+        else:
+            common_logger.info(f"Listening for control requests on '{settings.control_socket_path}'.")
+    for worker in workers:
+        worker.start()
+    if workers:
+        from fan_devices import stop_workers
+        # On any exit, also when the main hat or its sensors fail: extra hats stop cleanly
+        atexit.register(stop_workers, workers)
+        common_logger.info(f"Driving {len(devices)} more hats on {len(workers)} i2c buses: {', '.join(devices)}.")
+    config_file_path = find_config_file()
+    if config_file_path is not None:
+        from config_watcher import ConfigWatcher
+        try:
+            config_watcher = ConfigWatcher(config_file_path, request_reload)
+            config_watcher.start()
+        except OSError:
+            # SIGHUP still reloads the configuration
+            config_watcher = None
+            common_logger.warning(
+                f"Cannot watch configuration file '{config_file_path}', reload with SIGHUP.", exc_info=True)
 
     # Main loop
     while True:
         fan_action = FanActions.NONE
-        temperature = get_cpu_temp()
-
-        if temperature >= trigger_temp:
-            fan_action = FanActions.ON
-        elif temperature <= trigger_temp - hysteresis_temp:
-            fan_action = FanActions.OFF
-
-        if fan_action != FanActions.NONE:
-            set_fan(fan_action)
-            if fan_action != last_action:
+        loop_start = perf_counter()
+        previous_level = last_level
+        raw_temperature = get_cpu_temp()
+        if cpu_load is not None:
+            try:
+                cpu_loads = cpu_load.sample_all()
+            except OSError:
+                # Fan control goes on from the temperature alone
+                cpu_loads = {}
+        with state_lock:
+            if reload_requested:
+                reload_requested = False
+                reload_config()
+            if pending_settings:
+                try:
+                    apply_settings(settings.replace(**pending_settings), "control socket")
+                except ValueError:
+                    # Valid alone, but not with a reloaded configuration
+                    common_logger.error("Settings from control socket not valid anymore.", exc_info=True)
+                pending_settings.clear()
+            if override_level >= 0 and monotonic() >= override_until:
+                common_logger.info("Fan level override expired.")
+                override_level = -1
+            fan_level = override_level
+        i2c_start = perf_counter()
+        overridden = fan_level >= 0
+
+        if overridden:
+            # Override from the control socket, the control mode resumes on expiry
+            temperature, _ = fan_loop.tick(raw_temperature, override_level=fan_level)
+            i2c_time = perf_counter() - i2c_start
+            if fan_level != last_level:
                 common_logger.info(
-                    f"Temp: {temperature:.2f}°C, Fan action: {fan_action.name}")
-                last_action = fan_action
+                    "Temp: %.2f°C, Fan level: %d%% (override)", temperature, fan_level)
+                last_level = fan_level
+        else:
+            feed_forward_active = controller.feed_forward.active
+            temperature, fan_level = fan_loop.tick(raw_temperature, cpu_loads.get('cpu'))
+            if controller.feed_forward.active != feed_forward_active:
+                if controller.feed_forward.active:
+                    common_logger.info(
+                        "CPU load %.0f%% over %.0f%% for %.0fs, feed-forward +%.2f°C.", cpu_loads['cpu'],
+                        settings.load_threshold, settings.load_hold_seconds, controller.feed_forward.offset)
+                else:
+                    common_logger.info("CPU load back under %.0f%%, feed-forward off.", settings.load_threshold)
+            if fan_level is None:
+                i2c_time = 0.0
+                if settings.verbose >= 2:
+                    common_logger.debug("Temp: %.2f°C", temperature)
             else:
-                common_logger.debug(
-                    f"Temp: {temperature:.2f}°C, Fan action: {fan_action.name}")
-        elif verbose >= 2:
-            common_logger.debug(f"Temp: {temperature:.2f}°C")
+                i2c_time = perf_counter() - i2c_start
+                if controller.mode in (ControlModes.HYSTERESIS, ControlModes.PREDICTIVE):
+                    fan_action = FanActions.ON if controller.fan_on else FanActions.OFF
+                    if fan_action != last_action:
+                        if controller.mode == ControlModes.PREDICTIVE:
+                            common_logger.info(
+                                "Temp: %.2f°C, trend: %+.3f°C/s, Fan action: %s",
+                                temperature, controller.predictor.slope(), fan_action.name)
+                        else:
+                            common_logger.info(
+                                "Temp: %.2f°C, Fan action: %s", temperature, fan_action.name)
+                        last_action = fan_action
+                    else:
+                        common_logger.debug(
+                            "Temp: %.2f°C, Fan action: %s", temperature, fan_action.name)
+                elif fan_level != last_level:
+                    common_logger.info(
+                        "Temp: %.2f°C, Fan level: %d%%", temperature, fan_level)
+                elif settings.verbose >= 2:
+                    common_logger.debug(
+                        "Temp: %.2f°C, Fan level: %d%%", temperature, fan_level)
+                last_level = fan_level
+
+        with state_lock:
+            telemetry.append(monotonic(), temperature, last_level, i2c_time)
+        if telemetry_file is not None:
+            if overridden:
+                sample_flags |= SampleFlags.OVERRIDE
+            if failed_sensors:
+                sample_flags |= SampleFlags.SENSOR_FAILURE
+            if controller.feed_forward.active:
+                sample_flags |= SampleFlags.FEED_FORWARD
+            if hat_bus.errors != i2c_errors:
+                sample_flags |= SampleFlags.I2C_ERROR
+                i2c_errors = hat_bus.errors
+            telemetry_file.append(time(), temperature, last_level, sample_flags)
+            sample_flags = 0
+        with registry.lock:
+            temp_gauge.set(temperature)
+            level_gauge.set(last_level)
+            if last_level != previous_level:
+                toggles_counter.inc()
+            writes_counter.set(registers.writes_issued)
+            suppressed_counter.set(registers.writes_suppressed)
+            retries_counter.set(fan_loop.retries)
+            errors_counter.set(hat_bus.errors)
+            reconnects_counter.set(hat_bus.reconnects)
+            i2c_histogram.observe(i2c_time)
+            loop_histogram.observe(perf_counter() - loop_start)
+
+        if poller.report_elapsed >= POLL_REPORT_SECONDS:
+            elapsed, wakeups, saved_per_hour = poller.report()
+            common_logger.info(
+                f"Polling: {wakeups} wakeups in {elapsed:.0f}s, {saved_per_hour:.0f} saved per hour vs. fixed {settings.sleep_seconds:.2f}s interval.")
+            window = max(telemetry.windows)
+            temp_stats = telemetry.stats('temp', window)
+            common_logger.info(
+                f"Last {window:.0f}s: temp min {temp_stats.min:.2f}°C, mean {temp_stats.mean:.2f}°C, "
+                f"p95 {telemetry.percentile('temp', window, 95):.2f}°C, max {temp_stats.max:.2f}°C, "
+                f"fan level mean {telemetry.stats('level', window).mean:.0f}%.")
 
-        sleep(sleep_seconds)
+        poller.wait(temperature, *controller.thresholds())
+        with registry.lock:
+            interval_gauge.set(poller.interval)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# Persistent i2c session with the yahboom RGB fan hat.
+
+import time
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Device address
+DEVICE_ADDR = 0x0d
+"""i2c device address used by yahboom RBG fan hat."""
+# LED registers
+LED_SELECT_REG = 0x00
+"""i2c register address to select the LED written by the value registers."""
+LED_R_VALUE_REG = 0x01
+"""i2c register address of red value of selected LED."""
+LED_G_VALUE_REG = 0x02
+"""i2c register address of green value of selected LED."""
+LED_B_VALUE_REG = 0x03
+"""i2c register address of blue value of selected LED."""
+# RGB effects registers
+RGB_EFFECT_REG = 0x04
+"""i2c register address of RGB effect."""
+RGB_SPEED_REG = 0x05
+"""i2c register address of RGB effect speed."""
+RGB_COLOR_REG = 0x06
+"""i2c register address of RGB effect color."""
+RGB_OFF_REG = 0x07
+"""i2c register address to turn off all LEDs."""
+# Fan control register
+FAN_SPEED_REG = 0x08
+"""i2c register address to regulate fan speed."""
+
+MAX_LED = 3
+"""Number of RGB LEDs on the hat."""
+LED_ALL = 0xff
+"""Value of `LED_SELECT_REG` that selects all LEDs at once."""
+
+LED_VALUE_REGS = (LED_R_VALUE_REG, LED_G_VALUE_REG, LED_B_VALUE_REG)
+"""Registers whose meaning depends on the selected LED."""
+RGB_MODE_REGS = (RGB_EFFECT_REG, RGB_SPEED_REG, RGB_COLOR_REG, RGB_OFF_REG)
+"""Registers that make the hat overwrite the LED values on its own."""
+
+
+class HatBus:
+    """Long-lived i2c session with the yahboom RGB fan hat.
+
+    The `/dev/i2c-N` device is opened on first use and kept open between
+    writes, so every write costs a single ioctl instead of
+    open/ioctl(PEC)/ioctl(write)/close. Any bus error closes the session,
+    and the next write reopens it transparently.
+    """
+
+    def __init__(self, bus_number: int, device_addr: int = DEVICE_ADDR, pec: bool = True,
+                 bus_factory: Optional[Callable[[int], "smbus2.SMBus"]] = None):
+        """Create a session, without opening the bus yet.
+
+        Args:
+            bus_number (int): i2c bus number
+            device_addr (int): i2c device address of the hat
+            pec (bool): enable "Packet Error Checking"
+            bus_factory (Optional[Callable[[int], smbus2.SMBus]]): opens the bus by number,
+                None for `smbus2.SMBus`; a simulated device needs no smbus2 install
+        """
+        self.bus_number = bus_number
+        """i2c bus number."""
+        self.device_addr = device_addr
+        """i2c device address of the hat."""
+        self.pec = pec
+        """Packet Error Checking enabled."""
+        self.bus_factory = bus_factory
+        """Opens the bus by number, None for `smbus2.SMBus`."""
+        self.writes: int = 0
+        """Number of successful writes."""
+        self.errors: int = 0
+        """Number of failed writes."""
+        self.reconnects: int = 0
+        """Number of times the bus was reopened after an error."""
+        self._bus = None
+        self._had_error = False
+
+    @property
+    def is_open(self) -> bool:
+        """bool: True if the i2c device is currently open."""
+        return self._bus is not None
+
+    def open(self):
+        """Open the i2c device, if not already open.
+
+        Raises:
+            OSError: if the i2c device cannot be opened
+        """
+        if self._bus is not None:
+            return
+        if self.bus_factory is None:
+            import smbus2
+            bus = smbus2.SMBus(self.bus_number)
+        else:
+            bus = self.bus_factory(self.bus_number)
+        try:
+            bus.enable_pec(self.pec)
+        except Exception:
+            bus.close()
+            raise
+        self._bus = bus
+        if self._had_error:
+            self.reconnects += 1
+            self._had_error = False
+
+    def close(self):
+        """Close the i2c device. A later write opens it again."""
+        if self._bus is not None:
+            try:
+                self._bus.close()
+            finally:
+                self._bus = None
+
+    def write_byte_data(self, register: int, value: int):
+        """Write one byte to a register of the hat.
+
+        On error the session is closed, so the next call reconnects.
+
+        Args:
+            register (int): register address
+            value (int): byte value
+
+        Raises:
+            OSError: if the write fails
+        """
+        try:
+            self.open()
+            self._bus.write_byte_data(self.device_addr, register, value)
+        except Exception:
+            self.errors += 1
+            self._had_error = True
+            self.close()
+            raise
+        self.writes += 1
+
+    def supports(self, func: int) -> bool:
+        """Check if the i2c adapter supports a function.
+
+        Args:
+            func (int): `smbus2.I2cFunc` flag
+
+        Returns:
+            bool: True if supported
+
+        Raises:
+            OSError: if the i2c device cannot be opened
+        """
+        self.open()
+        return bool(self._bus.funcs & func)
+
+    def write_block_data(self, register: int, values: Sequence[int]):
+        """Write consecutive registers in one i2c block write transaction.
+
+        Only valid if the hat auto-increments the register address.
+        On error the session is closed, so the next call reconnects.
+
+        Args:
+            register (int): first register address
+            values (Sequence[int]): byte values
+
+        Raises:
+            OSError: if the write fails
+        """
+        try:
+            self.open()
+            self._bus.write_i2c_block_data(self.device_addr, register, list(values))
+        except Exception:
+            self.errors += 1
+            self._had_error = True
+            self.close()
+            raise
+        self.writes += 1
+
+    def write_batch(self, pairs: Sequence[Tuple[int, int]]):
+        """Write several registers with a single `I2C_RDWR` ioctl.
+
+        Each register is still its own write message on the bus, but they
+        are sent back to back with one system call. The kernel does not add
+        PEC to `I2C_RDWR` messages.
+        On error the session is closed, so the next call reconnects.
+
+        Args:
+            pairs (Sequence[Tuple[int, int]]): `(register, value)` pairs, in write order
+
+        Raises:
+            OSError: if the write fails
+        """
+        if not pairs:
+            return
+        import smbus2
+        msgs = [smbus2.i2c_msg.write(self.device_addr, [register, value & 0xff])
+                for register, value in pairs]
+        try:
+            self.open()
+            self._bus.i2c_rdwr(*msgs)
+        except Exception:
+            self.errors += 1
+            self._had_error = True
+            self.close()
+            raise
+        self.writes += len(pairs)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RegisterShadow:
+    """Shadow copy of the hat registers, skipping writes of unchanged values.
+
+    The hat registers are write-only, so the shadow holds the last value
+    written by this process. A write reaches the bus only when the value
+    differs from the shadow, or when the shadow entry is older than
+    `refresh_seconds`, to recover from a hat reset or another process
+    writing the same registers.
+
+    LED value registers are tracked per selected LED. Writing any RGB effect
+    register forgets the LED values, because the hat animates them itself.
+    """
+
+    def __init__(self, bus: HatBus, refresh_seconds: float = 0.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """Create an empty shadow, so the first write of each register always hits the bus.
+
+        Args:
+            bus (HatBus): i2c session with the hat
+            refresh_seconds (float): rewrite unchanged values older than this, 0 to never refresh
+            clock (Callable[[], float]): monotonic time source, in seconds
+        """
+        self.bus = bus
+        """i2c session with the hat."""
+        self.refresh_seconds = refresh_seconds
+        """Age after which an unchanged value is written again, 0 to disable."""
+        self.writes_issued: int = 0
+        """Number of writes sent to the bus."""
+        self.writes_suppressed: int = 0
+        """Number of writes skipped because the hat already holds the value."""
+        self._clock = clock
+        self._shadow: Dict[Tuple[int, int], Tuple[int, float]] = {}
+
+    def _key(self, register: int) -> Tuple[int, int]:
+        if register in LED_VALUE_REGS:
+            # An unknown selection gets its own key, -1
+            selected = self._shadow.get((LED_SELECT_REG, 0))
+            return (register, -1 if selected is None else selected[0])
+        return (register, 0)
+
+    def get(self, register: int) -> Optional[int]:
+        """Get shadowed value of a register.
+
+        Args:
+            register (int): register address
+
+        Returns:
+            Optional[int]: last written value, None if unknown
+        """
+        entry = self._shadow.get(self._key(register))
+        return None if entry is None else entry[0]
+
+    def invalidate(self, register: Optional[int] = None):
+        """Forget shadowed values, so the next write hits the bus.
+
+        Args:
+            register (Optional[int]): register address, None for all registers
+        """
+        if register is None:
+            self._shadow.clear()
+        else:
+            for key in [k for k in self._shadow if k[0] == register]:
+                del self._shadow[key]
+
+    def write(self, register: int, value: int, force: bool = False) -> bool:
+        """Write a register, only if its value changed or its refresh is due.
+
+        Args:
+            register (int): register address
+            value (int): byte value
+            force (bool): write even if the shadow holds the same value
+
+        Returns:
+            bool: True if the value was sent to the bus
+
+        Raises:
+            OSError: if the write fails, the shadow entry is then forgotten
+        """
+        value &= 0xff
+        key = self._key(register)
+        now = self._clock()
+        entry = self._shadow.get(key)
+        if (not force and entry is not None and entry[0] == value
+                and (self.refresh_seconds <= 0 or now - entry[1] < self.refresh_seconds)):
+            self.writes_suppressed += 1
+            return False
+        try:
+            self.bus.write_byte_data(register, value)
+        except Exception:
+            self._shadow.pop(key, None)
+            raise
+        self.writes_issued += 1
+        self._update(register, key, value, now)
+        return True
+
+    def _update(self, register: int, key: Tuple[int, int], value: int, now: float):
+        if register in RGB_MODE_REGS:
+            for reg in LED_VALUE_REGS:
+                self.invalidate(reg)
+        elif register in LED_VALUE_REGS:
+            if key[1] == LED_ALL:
+                for led in range(MAX_LED):
+                    self._shadow[(register, led)] = (value, now)
+            else:
+                self._shadow.pop((register, LED_ALL), None)
+        self._shadow[key] = (value, now)
+
+
+class LedBatchModes(Enum):
+    """Ways to send a LED frame to the hat."""
+    BYTE = "byte"
+    """One SMBus byte write per register, with PEC."""
+    RDWR = "rdwr"
+    """All register writes of a frame in a single `I2C_RDWR` ioctl, without PEC."""
+    BLOCK = "block"
+    """One i2c block write per LED: select, red, green, blue. Needs register auto-increment, which is not checked."""
+
+
+class RgbLeds:
+    """Frame based API for the RGB LEDs of the hat.
+
+    A frame holds the color of every LED. Only LEDs whose color changed are
+    written, and only their changed channels; a uniform frame is written
+    once to all LEDs through `LED_ALL`. The resulting register writes are
+    sent according to the batch mode, falling back to byte writes when the
+    i2c adapter lacks the needed function.
+
+    Byte writes, the default, keep the PEC check of every transaction.
+    `LedBatchModes.RDWR` sends a frame with one system call but the kernel
+    adds no PEC to its messages, so a corrupted byte goes unnoticed: fine
+    for colors, which the next frame rewrites. `LedBatchModes.BLOCK` keeps
+    PEC, but the hat registers are write-only, so nothing can check that
+    it auto-increments register addresses: on a hat that does not, a
+    block writes the wrong registers. Use it only once the LEDs were seen
+    to take the right colors.
+
+    Writing an RGB effect register directly makes the hat animate the LEDs
+    on its own: call `invalidate()` afterwards.
+    """
+
+    def __init__(self, bus: HatBus, mode: LedBatchModes = LedBatchModes.BYTE):
+        """Create the LED API, with unknown LED colors.
+
+        Args:
+            bus (HatBus): i2c session with the hat
+            mode (LedBatchModes): preferred way to send frames
+        """
+        self.bus = bus
+        """i2c session with the hat."""
+        self.mode = mode
+        """Way to send frames, may fall back to `LedBatchModes.BYTE`."""
+        self.frames: int = 0
+        """Number of frames sent."""
+        self.transactions: int = 0
+        """Number of i2c transactions on the bus."""
+        self.ioctls: int = 0
+        """Number of system calls to the i2c driver."""
+        self._colors: List[Optional[Tuple[int, int, int]]] = [None] * MAX_LED
+        self._selected: Optional[int] = None
+        self._mode_checked = False
+
+    @property
+    def transactions_per_frame(self) -> float:
+        """float: average i2c transactions per frame sent."""
+        return self.transactions / self.frames if self.frames else 0.0
+
+    def invalidate(self):
+        """Forget LED colors, so the next frame writes all of them."""
+        self._colors = [None] * MAX_LED
+        self._selected = None
+
+    def set_led(self, num: int, r: int, g: int, b: int) -> int:
+        """Set the color of one LED, or of all LEDs if `num >= MAX_LED`.
+
+        Args:
+            num (int): LED number
+            r (int): red value
+            g (int): green value
+            b (int): blue value
+
+        Returns:
+            int: i2c transactions used
+        """
+        color = (r & 0xff, g & 0xff, b & 0xff)
+        if num >= MAX_LED:
+            return self.set_frame([color] * MAX_LED)
+        frame = [c if c is not None else color for c in self._colors]
+        frame[num] = color
+        # Unknown colors of other LEDs are left untouched
+        return self._send(self._plan(frame, only=num))
+
+    def set_frame(self, colors: Sequence[Tuple[int, int, int]]) -> int:
+        """Set the color of every LED.
+
+        Args:
+            colors (Sequence[Tuple[int, int, int]]): `(r, g, b)` of each LED
+
+        Returns:
+            int: i2c transactions used
+        """
+        frame = [(r & 0xff, g & 0xff, b & 0xff) for r, g, b in colors[:MAX_LED]]
+        return self._send(self._plan(frame))
+
+    def _plan(self, frame: List[Tuple[int, int, int]], only: Optional[int] = None) -> List[List[Tuple[int, int]]]:
+        # Register writes grouped per selected LED, first pair is the selection
+        changed = [i for i in range(len(frame))
+                   if (only is None or i == only) and frame[i] != self._colors[i]]
+        if not changed:
+            return []
+        if only is None and len(frame) == MAX_LED and len(changed) > 1 and len(set(frame)) == 1:
+            targets = [(LED_ALL, frame[0])]
+        else:
+            targets = [(i, frame[i]) for i in changed]
+        groups = []
+        for led, color in targets:
+            old = self._colors[led] if led != LED_ALL else None
+            if old is None and led == LED_ALL:
+                known = set(self._colors)
+                old = self._colors[0] if len(known) == 1 else None
+            group = [(LED_SELECT_REG, led)]
+            for reg, value, old_value in zip(LED_VALUE_REGS, color, old or (None,) * 3):
+                if value != old_value:
+                    group.append((reg, value))
+            groups.append(group)
+        return groups
+
+    def _send(self, groups: List[List[Tuple[int, int]]]) -> int:
+        if not groups:
+            return 0
+        self._check_mode()
+        transactions = 0
+        selected = self._selected
+        try:
+            if self.mode == LedBatchModes.BLOCK:
+                for group in groups:
+                    led = group[0][1]
+                    color = self._color_of(led, group)
+                    self.bus.write_block_data(LED_SELECT_REG, (led,) + color)
+                    self._commit(led, color)
+                    selected = led
+                    transactions += 1
+                    self.ioctls += 1
+            else:
+                pairs = []
+                for group in groups:
+                    if group[0][1] != selected:
+                        pairs.append(group[0])
+                        selected = group[0][1]
+                    pairs.extend(group[1:])
+                if self.mode == LedBatchModes.RDWR:
+                    self.bus.write_batch(pairs)
+                    self.ioctls += 1
+                else:
+                    for register, value in pairs:
+                        self.bus.write_byte_data(register, value)
+                        self.ioctls += 1
+                for group in groups:
+                    led = group[0][1]
+                    self._commit(led, self._color_of(led, group))
+                transactions = len(pairs)
+        except Exception:
+            self.invalidate()
+            raise
+        self._selected = selected
+        self.frames += 1
+        self.transactions += transactions
+        return transactions
+
+    def _color_of(self, led: int, group: List[Tuple[int, int]]) -> Tuple[int, int, int]:
+        old = self._colors[0 if led == LED_ALL else led] or (0, 0, 0)
+        color = list(old)
+        for register, value in group[1:]:
+            color[LED_VALUE_REGS.index(register)] = value
+        return tuple(color)
+
+    def _commit(self, led: int, color: Tuple[int, int, int]):
+        if led == LED_ALL:
+            self._colors = [color] * MAX_LED
+        else:
+            self._colors[led] = color
+
+    def _check_mode(self):
+        if self._mode_checked:
+            return
+        import smbus2
+        needed = {
+            LedBatchModes.RDWR: smbus2.I2cFunc.I2C,
+            LedBatchModes.BLOCK: smbus2.I2cFunc.SMBUS_WRITE_I2C_BLOCK,
+        }.get(self.mode)
+        if needed is not None and not self.bus.supports(needed):
+            self.mode = LedBatchModes.BYTE
+        self._mode_checked = True
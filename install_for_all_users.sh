@@ -5,6 +5,8 @@
 module_name='yahboom-raspi-cooling-fan'
 install_dir="/opt/${module_name}"
 log_dir="/var/log/${module_name}"
+# python modules imported by the daemon
+modules='hat_bus.py thermal_sampler.py temp_filter.py poll_scheduler.py fan_control.py fan_loop.py telemetry.py telemetry_file.py metrics_exporter.py control_socket.py fan_settings.py config_watcher.py fan_devices.py log_pipeline.py sys_metrics.py'
 
 # check if terminal supports output colors
 if which tput >/dev/null 2>&1 && [ "$(tput -T"$TERM" colors)" -ge 8 ]; then
@@ -41,10 +43,15 @@ chown "$user": ${install_dir}
 echo "${fmtBold}Created directory: '${install_dir}'.${fmtReset}"
 
 # copy files to /opt
-cp -t ${install_dir} fan_temp_hysteresis.py yahboom-fan-ctrl.conf
-chmod 0775 "${install_dir}/fan_temp_hysteresis.py"
+# shellcheck disable=SC2086
+cp -t ${install_dir} fan_temp_hysteresis.py fan_ctl.py log_analyzer.py ${modules} yahboom-fan-ctrl.conf
+chmod 0775 "${install_dir}/fan_temp_hysteresis.py" "${install_dir}/fan_ctl.py" "${install_dir}/log_analyzer.py"
 chmod 0664 "${install_dir}/yahboom-fan-ctrl.conf"
-chown "$user": "${install_dir}/fan_temp_hysteresis.py" yahboom-fan-ctrl.conf
+chown "$user": "${install_dir}/fan_temp_hysteresis.py" "${install_dir}/fan_ctl.py" "${install_dir}/log_analyzer.py" "${install_dir}/yahboom-fan-ctrl.conf"
+for module in ${modules}; do
+    chmod 0664 "${install_dir}/${module}"
+    chown "$user": "${install_dir}/${module}"
+done
 echo "${fmtBold}Copied files to '${install_dir}'.${fmtReset}"
 
 # create log file
@@ -4,6 +4,8 @@
 # variables
 as_user=''
 script_path=$(dirname "$(readlink -f "$0")")
+# python modules imported by RGB_Cooling_HAT.py
+modules='hat_bus.py thermal_sampler.py oled_display.py sys_metrics.py'
 
 # check if terminal supports output colors
 if which tput >/dev/null 2>&1 && [ "$(tput -T"$TERM" colors)" -ge 8 ]; then
@@ -50,11 +52,13 @@ if [ "$script_path" != "$user_home/RGB_Cooling_HAT" ]; then
     mkdir -p "$user_home/RGB_Cooling_HAT"
     # copy python script to user home
     cp "$script_path/RGB_Cooling_HAT.py" "$user_home/RGB_Cooling_HAT/RGB_Cooling_HAT.py"
+    # copy python modules imported by the script
+    for module in ${modules}; do
+        cp "$script_path/$module" "$user_home/RGB_Cooling_HAT/$module"
+    done
     # correct ownership of copied files
     if [ -n "$as_user" ]; then
-        chown "$user": \
-            "$user_home/RGB_Cooling_HAT" \
-            "$user_home/RGB_Cooling_HAT/RGB_Cooling_HAT.py"
+        chown -R "$user": "$user_home/RGB_Cooling_HAT"
     fi
     # make script executable
     chmod +x "$user_home/RGB_Cooling_HAT/RGB_Cooling_HAT.py"
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# Fleet report of fan duty cycle, toggles, time above trigger and i2c error bursts, from daemon log files.
+
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fan_settings import MODULE_NAME, Settings
+
+# Error codes
+OK_EXIT = 0
+ERR_SYSTEM = 1
+ERR_NO_LOGS = 2
+
+LOG_NAME = f"{MODULE_NAME}.log"
+"""Name of the daemon log file, rotations add '.1' to '.N', archives '.gz', '.bz2' or '.xz'."""
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+"""Openers of compressed log files, by extension."""
+READ_BUFFER = 256 * 1024
+"""Size of the chunks log files are read and parsed in, in bytes."""
+BURST_SECONDS = 60.0
+"""Longest time between i2c errors of one burst, in seconds."""
+MAX_GAP_SECONDS = 2 * 3600.0
+"""Longest time between log lines of a running daemon, in seconds: it reports polling every hour.
+Longer gaps, like a power cut, are not counted."""
+
+ROTATION = re.compile(re.escape(LOG_NAME) + r"(?:\.(\d+))?(\.gz|\.bz2|\.xz)?$")
+"""Name of a log file or of one of its rotations, with rotation number and compression."""
+LINE = re.compile(rb"^(.{16}):(..,...) - \w+ - (?:Temp: ([^\n]*)|([^\n]*))", re.MULTILINE)
+"""Log line: minute, second with millisecond, then a temperature check or any other message."""
+TEMP = re.compile(rb"(-?[\d.]+)(?:\xe2\x80\x93(-?[\d.]+))?\xc2\xb0C(?:, trend: [^,]+)?"
+                  rb"(?:, Fan action: (ON|OFF)|, Fan level: (\d+)%)?")
+"""Temperature check after its 'Temp: ' prefix, with fan action or level; coalesced checks give a temperature
+range."""
+INITIAL = re.compile(rb"Initial Temp: (-?\d+(?:\.\d+)?)\xc2\xb0C, trigger temp: >=(-?\d+(?:\.\d+)?)")
+"""Start message, with temperature and trigger temperature."""
+INITIAL_LEVEL = re.compile(rb"Initial fan level: (\d+)%")
+"""Start message, with first fan level."""
+TRIGGER_CHANGE = re.compile(rb"trigger_temp \S+ -> (-?\d+(?:\.\d+)?)")
+"""Settings change message, with new trigger temperature."""
+I2C_ERROR = re.compile(rb"Write i2c error|Cannot write to i2c device|Cannot open i2c device")
+"""Error messages of i2c writes to the main hat."""
+START = f"Starting {MODULE_NAME} log.".encode()
+"""Message of a daemon start."""
+STOP = b"Caught terminate signal"
+"""Message of a daemon stop, which turns the fan off."""
+
+# Event kinds
+EVENT_START = 0
+EVENT_STOP = 1
+EVENT_TEMP = 2
+EVENT_LEVEL = 3
+EVENT_TRIGGER = 4
+EVENT_I2C_ERROR = 5
+EVENT_TICK = 6
+
+
+def rotated_files(path: str) -> List[str]:
+    """Find a log file and its rotations, oldest first.
+
+    Args:
+        path (str): log file path, its rotations are searched next to it
+
+    Returns:
+        List[str]: paths, from the highest rotation number to the log file itself
+    """
+    directory, name = os.path.split(path)
+    if name != LOG_NAME:
+        return [path]
+    found = []
+    for entry in os.listdir(directory or "."):
+        match = ROTATION.match(entry)
+        if match:
+            found.append((int(match.group(1) or 0), entry))
+    return [os.path.join(directory, entry) for _, entry in sorted(found, reverse=True)]
+
+
+def find_hosts(paths: Iterable[str]) -> Dict[str, List[str]]:
+    """Group log files by host.
+
+    Args:
+        paths (Iterable[str]): log files, directories with a log file, or
+            directories with one such directory per host; `name=path` sets the host name
+
+    Returns:
+        Dict[str, List[str]]: log files oldest first, by host name
+
+    Raises:
+        ValueError: if a path has no log file, or two paths the same host name
+    """
+    hosts = {}
+    for argument in paths:
+        name, sep, path = argument.partition('=')
+        if not sep:
+            name, path = "", argument
+        path = os.path.normpath(path)
+        if os.path.isdir(path):
+            entries = os.listdir(path)
+            if any(ROTATION.match(entry) for entry in entries):
+                found = {name or os.path.basename(os.path.abspath(path)): rotated_files(os.path.join(path, LOG_NAME))}
+            else:
+                found = {}
+                for entry in sorted(entries):
+                    subdir = os.path.join(path, entry)
+                    if os.path.isdir(subdir) and any(ROTATION.match(sub) for sub in os.listdir(subdir)):
+                        found[f"{name}/{entry}" if name else entry] = rotated_files(os.path.join(subdir, LOG_NAME))
+                if not found:
+                    raise ValueError(f"No '{LOG_NAME}' files in '{path}'.")
+        elif os.path.exists(path):
+            found = {name or os.path.basename(os.path.dirname(os.path.abspath(path))): rotated_files(path)}
+        else:
+            raise ValueError(f"No such file or directory '{path}'.")
+        for host in found:
+            if host in hosts:
+                raise ValueError(f"Duplicate host '{host}', name it with 'host=path'.")
+        hosts.update(found)
+    return hosts
+
+
+def read_chunks(paths: Iterable[str]) -> Iterator[bytes]:
+    """Read log files in chunks of whole lines, decompressing archives.
+
+    Args:
+        paths (Iterable[str]): log files, in order
+
+    Returns:
+        Iterator[bytes]: chunks of about `READ_BUFFER` bytes ending with a line, undecoded
+
+    Raises:
+        OSError: if a file cannot be read or decompressed
+    """
+    for path in paths:
+        opener = OPENERS.get(os.path.splitext(path)[1])
+        try:
+            with (opener(path, 'rb') if opener else open(path, 'rb', buffering=0)) as f:
+                rest = b""
+                while True:
+                    data = f.read(READ_BUFFER)
+                    if not data:
+                        break
+                    end = data.rfind(b"\n") + 1
+                    if end == 0:
+                        rest += data
+                        continue
+                    yield rest + data[:end]
+                    rest = data[end:]
+                # Last line of a file without line end
+                if rest:
+                    yield rest
+        except (OSError, EOFError, lzma.LZMAError, zlib.error) as e:
+            # Compression errors do not tell the file
+            raise OSError(f"'{path}': {e}")
+
+
+def parse_events(chunks: Iterable[bytes]) -> Iterator[Tuple[float, int, float]]:
+    """Parse log lines into events.
+
+    A precompiled multiline expression splits whole chunks into timestamps
+    and messages in one call, without a match object per line. Temperature
+    checks, nearly every line at debug level, repeat a few thousand
+    messages: each is parsed once and cached. Other messages are told apart
+    by fixed prefixes before any other expression; timestamps are converted
+    once per minute. Lines without timestamp, like tracebacks, are skipped.
+    Fan levels are events only when they change.
+
+    Args:
+        chunks (Iterable[bytes]): log lines as written by the daemon's file handler, in chunks of whole lines
+
+    Returns:
+        Iterator[Tuple[float, int, float]]: time in seconds since the epoch, `EVENT_*` kind and value
+    """
+    minutes: Dict[bytes, float] = {}
+    checks: Dict[bytes, Tuple[Optional[float], Optional[float]]] = {}
+    last_minute, base = None, 0.0
+    last_level = None
+    for chunk in chunks:
+        for minute, second, check, message in LINE.findall(chunk):
+            if minute != last_minute:
+                last_minute = None
+                base = minutes.get(minute)
+                if base is None:
+                    try:
+                        base = time.mktime(time.strptime(minute.decode(), "%Y-%m-%d %H:%M"))
+                    except (ValueError, UnicodeDecodeError):
+                        continue
+                    if len(minutes) > 4096:
+                        minutes.clear()
+                    minutes[minute] = base
+                last_minute = minute
+            try:
+                now = base + float(second.replace(b",", b"."))
+            except ValueError:
+                continue
+            if check:
+                parsed = checks.get(check)
+                if parsed is None:
+                    parsed = None, None
+                    match = TEMP.match(check)
+                    if match:
+                        temp, high, action, level = match.groups()
+                        # Coalesced checks count as their highest temperature
+                        parsed = float(high or temp), (
+                            (100.0 if action == b"ON" else 0.0) if action is not None
+                            else float(level) if level is not None else None)
+                    if len(checks) > 4096:
+                        checks.clear()
+                    checks[check] = parsed
+                temp, level = parsed
+                if temp is not None:
+                    yield now, EVENT_TEMP, temp
+                    # Debug checks repeat the fan action, only changes are events
+                    if level is not None and level != last_level:
+                        last_level = level
+                        yield now, EVENT_LEVEL, level
+                    continue
+            elif message.startswith(START):
+                last_level = None
+                yield now, EVENT_START, 0.0
+                continue
+            elif message.startswith(b"Initial "):
+                match = INITIAL.match(message)
+                if match:
+                    yield now, EVENT_TEMP, float(match.group(1))
+                    yield now, EVENT_TRIGGER, float(match.group(2))
+                    continue
+                match = INITIAL_LEVEL.match(message)
+                if match:
+                    last_level = float(match.group(1))
+                    yield now, EVENT_LEVEL, last_level
+                    continue
+            elif message.startswith(STOP):
+                last_level = 0.0
+                yield now, EVENT_LEVEL, 0.0
+                yield now, EVENT_STOP, 0.0
+                continue
+            elif message.startswith(b"Settings changed"):
+                match = TRIGGER_CHANGE.search(message)
+                if match:
+                    yield now, EVENT_TRIGGER, float(match.group(1))
+                    continue
+            elif I2C_ERROR.match(message):
+                yield now, EVENT_I2C_ERROR, 0.0
+                continue
+            yield now, EVENT_TICK, 0.0
+
+
+class HostReport:
+    """Fan statistics of one host, accumulated from its log events.
+
+    Fan level and temperature hold from one logged value to the next. The
+    daemon logs every fan change, but temperatures only with them, unless
+    `verbose = 2`: time above trigger is exact at debug level only, and
+    repeated checks the log writer coalesced count as their highest
+    temperature, from the summary line on. Time
+    while the daemon is stopped, or between lines farther apart than
+    `max_gap_seconds`, is left out of every figure. Daemons before i2c
+    retries were logged as warnings only logged them at `verbose = 2`:
+    their logs count just the writes that failed every attempt.
+    """
+
+    def __init__(self, name: str, trigger_temp: float, burst_seconds: float = BURST_SECONDS,
+                 max_gap_seconds: float = MAX_GAP_SECONDS):
+        """Create an empty report.
+
+        Args:
+            name (str): host name
+            trigger_temp (float): trigger temperature until the log tells it, in Celsius
+            burst_seconds (float): longest time between i2c errors of one burst, in seconds
+            max_gap_seconds (float): longest time between lines of a running daemon, in seconds
+        """
+        self.name = name
+        """Host name."""
+        self.files: int = 0
+        """Number of log files read."""
+        self.first: Optional[float] = None
+        """Time of the first event, in seconds since the epoch."""
+        self.last: Optional[float] = None
+        """Time of the last event, in seconds since the epoch."""
+        self.seconds: float = 0.0
+        """Time the daemon ran, in seconds."""
+        self.level_seconds: float = 0.0
+        """Integral of the fan level over time, in percent seconds."""
+        self.on_seconds: float = 0.0
+        """Time with fan on, in seconds."""
+        self.above_seconds: float = 0.0
+        """Time with the last logged temperature at or over the trigger temperature, in seconds."""
+        self.toggles: int = 0
+        """Number of fan level changes."""
+        self.starts: int = 0
+        """Number of daemon starts."""
+        self.max_temp: Optional[float] = None
+        """Highest logged temperature, in Celsius."""
+        self.i2c_errors: int = 0
+        """Number of i2c error messages."""
+        self.i2c_bursts: int = 0
+        """Number of i2c error bursts."""
+        self.largest_burst: int = 0
+        """Number of errors of the largest burst."""
+        self._burst_seconds = burst_seconds
+        self._max_gap_seconds = max_gap_seconds
+        self._trigger = trigger_temp
+        self._temp: Optional[float] = None
+        self._level: Optional[float] = None
+        self._time: Optional[float] = None
+        self._last_error: Optional[float] = None
+        self._burst: int = 0
+
+    def feed(self, events: Iterable[Tuple[float, int, float]]):
+        """Accumulate events, in time order.
+
+        Args:
+            events (Iterable[Tuple[float, int, float]]): events from `parse_events()`
+        """
+        # Hot loop on locals, written back at the end
+        first, last, previous = self.first, self.last, self._time
+        temp, level, trigger = self._temp, self._level, self._trigger
+        above = temp is not None and temp >= trigger
+        max_temp = self.max_temp if self.max_temp is not None else -math.inf
+        max_gap = self._max_gap_seconds
+        seconds = level_seconds = on_seconds = above_seconds = 0.0
+        for now, kind, value in events:
+            if first is None:
+                first = now
+            last = now
+            # A start without stop, e.g. after a power cut: nothing is known since the last line
+            if previous is not None and kind != EVENT_START:
+                elapsed = now - previous
+                if 0 < elapsed <= max_gap:
+                    seconds += elapsed
+                    if level:
+                        level_seconds += level * elapsed
+                        on_seconds += elapsed
+                    if above:
+                        above_seconds += elapsed
+            previous = now
+            if kind == EVENT_TEMP:
+                temp = value
+                above = value >= trigger
+                if value > max_temp:
+                    max_temp = value
+            elif kind == EVENT_TICK:
+                pass
+            elif kind == EVENT_LEVEL:
+                if level is not None and value != level:
+                    self.toggles += 1
+                level = value
+            elif kind == EVENT_TRIGGER:
+                trigger = value
+                above = temp is not None and temp >= trigger
+            elif kind == EVENT_I2C_ERROR:
+                self.i2c_errors += 1
+                if self._last_error is None or now - self._last_error > self._burst_seconds:
+                    self.i2c_bursts += 1
+                    self._burst = 0
+                self._burst += 1
+                self.largest_burst = max(self.largest_burst, self._burst)
+                self._last_error = now
+            elif kind == EVENT_START:
+                self.starts += 1
+                level = temp = None
+                above = False
+            elif kind == EVENT_STOP:
+                previous = None
+        self.first, self.last, self._time = first, last, previous
+        self._temp, self._level, self._trigger = temp, level, trigger
+        self.max_temp = max_temp if max_temp > -math.inf else None
+        self.seconds += seconds
+        self.level_seconds += level_seconds
+        self.on_seconds += on_seconds
+        self.above_seconds += above_seconds
+
+    def summary(self) -> Dict:
+        """Get the report figures.
+
+        Returns:
+            Dict: figures by name, ratios in percent
+        """
+        hours = self.seconds / 3600.0
+        return {
+            'host': self.name,
+            'files': self.files,
+            'first': self.first,
+            'last': self.last,
+            'hours': round(hours, 2),
+            'starts': self.starts,
+            'duty_cycle': round(self.level_seconds / self.seconds, 2) if self.seconds else None,
+            'fan_on': round(self.on_seconds / self.seconds * 100, 2) if self.seconds else None,
+            'toggles': self.toggles,
+            'toggles_per_hour': round(self.toggles / hours, 2) if hours else None,
+            'above_trigger_hours': round(self.above_seconds / 3600.0, 3),
+            'above_trigger': round(self.above_seconds / self.seconds * 100, 2) if self.seconds else None,
+            'max_temp': self.max_temp,
+            'i2c_errors': self.i2c_errors,
+            'i2c_bursts': self.i2c_bursts,
+            'largest_burst': self.largest_burst,
+        }
+
+
+def analyze_host(name: str, paths: List[str], trigger_temp: float, burst_seconds: float = BURST_SECONDS,
+                 max_gap_seconds: float = MAX_GAP_SECONDS) -> Dict:
+    """Analyze the log files of one host, streaming them in constant memory.
+
+    Args:
+        name (str): host name
+        paths (List[str]): log files, oldest first
+        trigger_temp (float): trigger temperature until the log tells it, in Celsius
+        burst_seconds (float): longest time between i2c errors of one burst, in seconds
+        max_gap_seconds (float): longest time between lines of a running daemon, in seconds
+
+    Returns:
+        Dict: report figures, from `HostReport.summary()`
+    """
+    report = HostReport(name, trigger_temp, burst_seconds, max_gap_seconds)
+    report.feed(parse_events(read_chunks(paths)))
+    report.files = len(paths)
+    return report.summary()
+
+
+def analyze(hosts: Dict[str, List[str]], trigger_temp: float, burst_seconds: float = BURST_SECONDS,
+            max_gap_seconds: float = MAX_GAP_SECONDS, jobs: int = 0) -> List[Dict]:
+    """Analyze the logs of several hosts, each in its own process.
+
+    Args:
+        hosts (Dict[str, List[str]]): log files oldest first, by host name
+        trigger_temp (float): trigger temperature until a log tells it, in Celsius
+        burst_seconds (float): longest time between i2c errors of one burst, in seconds
+        max_gap_seconds (float): longest time between lines of a running daemon, in seconds
+        jobs (int): number of processes, 0 for one per CPU
+
+    Returns:
+        List[Dict]: report figures, by host in given order
+    """
+    jobs = min(jobs or os.cpu_count() or 1, len(hosts))
+    arguments = [(name, paths, trigger_temp, burst_seconds, max_gap_seconds) for name, paths in hosts.items()]
+    if jobs <= 1:
+        return [analyze_host(*args) for args in arguments]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(analyze_host, *zip(*arguments)))
+
+
+def _format(value, spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Report fan duty cycle, toggles, time above trigger and i2c error bursts from daemon logs.",
+        epilog="Temperatures between fan changes are logged at verbose = 2 only, time above trigger is exact "
+               "with it, but for repeated checks coalesced into one line, counted at their highest temperature. Older daemons logged i2c retries at verbose = 2 only, their error counts miss retries "
+               "that succeeded.")
+    parser.add_argument('paths', nargs='+', metavar='[host=]path',
+                        help=f"'{LOG_NAME}' file, found with its rotations and archives, a directory holding it, "
+                             "or a directory with one such directory per host")
+    parser.add_argument('--trigger-temp', type=float, default=Settings.trigger_temp,
+                        help="trigger temperature of logs that do not tell it, in Celsius "
+                             f"(default: {Settings.trigger_temp})")
+    parser.add_argument('--burst-seconds', type=float, default=BURST_SECONDS,
+                        help=f"longest time between i2c errors of one burst, in seconds (default: {BURST_SECONDS:g})")
+    parser.add_argument('--max-gap', type=float, default=MAX_GAP_SECONDS,
+                        help="longest time between lines of a running daemon, longer is downtime, in seconds "
+                             f"(default: {MAX_GAP_SECONDS:g})")
+    parser.add_argument('--jobs', type=int, default=0, help="number of processes (default: one per CPU)")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    try:
+        hosts = find_hosts(args.paths)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return ERR_NO_LOGS
+    try:
+        reports = analyze(hosts, args.trigger_temp, args.burst_seconds, args.max_gap, args.jobs)
+    except OSError as e:
+        print(f"Error: Cannot read logs: {e}", file=sys.stderr)
+        return ERR_SYSTEM
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return OK_EXIT
+    print(f"{'host':<16} {'hours':>8} {'starts':>6} {'duty':>6} {'on':>6} {'tog/h':>6} "
+          f"{'>trig':>6} {'max °C':>6} {'i2c err':>7} {'bursts':>6} {'largest':>7}")
+    for report in reports:
+        print(f"{report['host']:<16} {report['hours']:8.1f} {report['starts']:6d} "
+              f"{_format(report['duty_cycle'], '5.1f')}% {_format(report['fan_on'], '5.1f')}% "
+              f"{_format(report['toggles_per_hour'], '6.2f')} {_format(report['above_trigger'], '5.1f')}% "
+              f"{_format(report['max_temp'], '6.1f')} {report['i2c_errors']:7d} {report['i2c_bursts']:6d} "
+              f"{report['largest_burst']:7d}")
+    return OK_EXIT
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Background log writer for the fan daemon: queued records, formatted off the control loop, repeats coalesced.
+
+import logging
+import logging.handlers
+import math
+import queue
+import re
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+QUEUE_SIZE = 1024
+"""Maximum number of records waiting for the writer thread."""
+COALESCE_SECONDS = 300.0
+"""Longest time repeated records are counted before their summary is written, in seconds."""
+BLOCK_LEVEL = logging.WARNING
+"""Lowest level of records that wait for room in a full queue instead of being dropped."""
+BLOCK_SECONDS = 1.0
+"""Longest wait for room in a full queue, in seconds."""
+FORMAT_SPEC = re.compile(r"%(\(\w+\))?[#0 +-]*(\*|\d+)?(?:\.(\*|\d+))?[hlL]?([diouxXeEfFgGcrsa%])")
+"""Conversion specifier of a %-style log message."""
+
+_STOP = object()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never formats nor blocks in the caller.
+
+    The stock `QueueHandler` formats the message before queueing it; here
+    the record is queued as is, and formatted by the writer thread. A full
+    queue drops the record instead of waiting, unless its level is at
+    least `block_level`: warnings and errors wait up to `block_seconds`
+    for room, as they are rare and the ones worth keeping.
+    """
+
+    def __init__(self, record_queue: queue.Queue, block_level: int = BLOCK_LEVEL,
+                 block_seconds: float = BLOCK_SECONDS):
+        super().__init__(record_queue)
+        self.block_level = block_level
+        """Lowest level of records waiting for room in a full queue."""
+        self.block_seconds = block_seconds
+        """Longest wait for room in a full queue, in seconds."""
+        self.dropped: int = 0
+        """Number of records dropped because the queue was full."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            if record.levelno >= self.block_level:
+                self.queue.put(record, timeout=self.block_seconds)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _span(seconds: float) -> str:
+    if seconds < 120:
+        return f"{seconds:.0f}s"
+    return f"{seconds / 60:.0f} min"
+
+
+def _render_ranges(msg: str, args: tuple, ranges: List[Optional[List[float]]]) -> Optional[str]:
+    """Render a %-style message, with each float argument that varied as a `low–high` range.
+
+    Returns:
+        Optional[str]: message, None if it has other than plain positional conversions
+    """
+    pieces = []
+    position = index = 0
+    for match in FORMAT_SPEC.finditer(msg):
+        pieces.append(msg[position:match.start()])
+        position = match.end()
+        if match.group(4) == '%':
+            pieces.append('%')
+            continue
+        if match.group(1) or match.group(2) == '*' or match.group(3) == '*' or index >= len(args):
+            return None
+        spec = match.group(0)
+        span = ranges[index]
+        if span is None or span[0] == span[1]:
+            pieces.append(spec % (args[index],))
+        else:
+            pieces.append(f"{spec % (span[0],)}–{spec % (span[1],)}")
+        index += 1
+    if index != len(args):
+        return None
+    pieces.append(msg[position:])
+    return "".join(pieces)
+
+
+class LogWriter:
+    """Writes queued log records to slow handlers from a background thread.
+
+    The logger only holds a `LazyQueueHandler`, so a slow SD card, a log
+    rotation or the journal socket never stall the caller. Records with
+    the same level, message template and arguments as the previous one,
+    float arguments aside, are counted instead of written, and summarized
+    as "<last message> ×N in last 4 min" when a different record arrives,
+    or after `coalesce_seconds`. Float arguments that varied, like the
+    temperature of per-check lines, are summarized as their range:
+    "Temp: 55.00–57.25°C, Fan action: ON ×120 in last 4 min".
+    """
+
+    def __init__(self, handlers: Iterable[logging.Handler], coalesce_seconds: float = COALESCE_SECONDS,
+                 queue_size: int = QUEUE_SIZE):
+        """Create a writer, without starting it.
+
+        Args:
+            handlers (Iterable[logging.Handler]): handlers writing the records
+            coalesce_seconds (float): longest time repeats are counted, in seconds, 0 to disable coalescing
+            queue_size (int): maximum number of waiting records
+        """
+        self.handlers: List[logging.Handler] = list(handlers)
+        """Handlers writing the records, from the writer thread."""
+        self.coalesce_seconds = coalesce_seconds
+        """Longest time repeated records are counted before their summary is written, in seconds."""
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        """Records waiting for the writer thread."""
+        self.handler = LazyQueueHandler(self.queue)
+        """Handler to add to loggers."""
+        self.records_written: int = 0
+        """Number of records written to handlers, summaries included."""
+        self.records_coalesced: int = 0
+        """Number of repeated records counted instead of written."""
+        self._thread: Optional[threading.Thread] = None
+        self._pending_key: Optional[Tuple] = None
+        self._pending_since = 0.0
+        self._pending_last: Optional[logging.LogRecord] = None
+        self._pending_count = 0
+        self._pending_ranges: List[Optional[List[float]]] = []
+        self._dropped_reported = 0
+
+    def start(self):
+        """Start the writer thread."""
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Write pending records and stop the writer thread.
+
+        Args:
+            timeout (float): maximum time to wait for pending records, in seconds
+        """
+        if self._thread is None:
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        self._thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._pending_key is not None:
+                timeout = max(0.0, self._pending_since + self.coalesce_seconds - time.time())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(keep=True)
+                continue
+            if record is _STOP:
+                self._flush()
+                self._report_dropped()
+                return
+            self._report_dropped()
+            self._process(record)
+
+    def _key(self, record: logging.LogRecord) -> Optional[Tuple]:
+        if self.coalesce_seconds <= 0 or record.exc_info:
+            return None
+        args = record.args
+        if isinstance(record.msg, str) and isinstance(args, tuple) and any(type(arg) is float for arg in args):
+            # Floats, like temperatures, are summarized as ranges; an action or level change is a new group
+            return record.levelno, record.msg, tuple(None if type(arg) is float else arg for arg in args)
+        try:
+            return record.levelno, record.getMessage()
+        except (TypeError, ValueError):
+            # Left to the handlers, which report formatting errors
+            return None
+
+    def _process(self, record: logging.LogRecord):
+        key = self._key(record)
+        if key is not None and key == self._pending_key:
+            self._pending_last = record
+            self._pending_count += 1
+            if len(key) == 3:
+                for span, arg in zip(self._pending_ranges, record.args):
+                    if span is not None:
+                        span[0] = min(span[0], arg)
+                        span[1] = max(span[1], arg)
+            self.records_coalesced += 1
+            if record.created - self._pending_since >= self.coalesce_seconds:
+                self._flush(keep=True)
+            return
+        self._flush()
+        self._emit(record)
+        if key is not None:
+            self._pending_key = key
+            self._pending_since = record.created
+            self._pending_last = record
+            self._reset_ranges()
+
+    def _reset_ranges(self):
+        # Ranges cover the repeats only, the first record of a group is written as is
+        if len(self._pending_key) == 3:
+            self._pending_ranges = [None if type(arg) is not float else [math.inf, -math.inf]
+                                    for arg in self._pending_last.args]
+        else:
+            self._pending_ranges = []
+
+    def _flush(self, keep: bool = False):
+        # With `keep`, a group that had repeats goes on counting after its summary
+        if self._pending_count:
+            last = self._pending_last
+            try:
+                message = _render_ranges(last.msg, last.args, self._pending_ranges) if self._pending_ranges else None
+                if message is None:
+                    message = last.getMessage()
+            except (TypeError, ValueError):
+                # The handlers already reported the first record of the group
+                message = str(last.msg)
+            summary = logging.makeLogRecord(last.__dict__)
+            summary.msg = f"{message} ×{self._pending_count} in last {_span(time.time() - self._pending_since)}"
+            summary.args = None
+            self._emit(summary)
+            if keep:
+                self._pending_since = time.time()
+                self._pending_count = 0
+                self._reset_ranges()
+                return
+        self._pending_key = None
+        self._pending_last = None
+        self._pending_count = 0
+        self._pending_ranges = []
+
+    def _report_dropped(self):
+        dropped = self.handler.dropped
+        if dropped != self._dropped_reported:
+            record = logging.makeLogRecord({
+                'name': "log-writer", 'levelno': logging.WARNING, 'levelname': "WARNING",
+                'msg': f"{dropped - self._dropped_reported} log records dropped, writer too slow."})
+            self._dropped_reported = dropped
+            self._emit(record)
+
+    def _emit(self, record: logging.LogRecord):
+        self.records_written += 1
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Prometheus text format metrics of the fan daemon, over localhost HTTP or a node-exporter textfile.
+
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Optional, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+"""HTTP content type of Prometheus text format."""
+
+
+def _format_value(value: float) -> str:
+    if not math.isfinite(value):
+        # Spelled as the Prometheus text format wants, Python's would not parse
+        return "NaN" if math.isnan(value) else "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    """Base of metrics: caches its rendered text until its value changes."""
+
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._header = f"# HELP {name} {help_text}\n# TYPE {name} {self.type_name}\n"
+        self._text: Optional[str] = None
+
+    @abstractmethod
+    def _render(self) -> str:
+        """Render the samples of the metric, without the header."""
+
+    def render(self) -> str:
+        text = self._text
+        if text is None:
+            text = self._header + self._render()
+            self._text = text
+        return text
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.value: float = 0.0
+
+    def set(self, value: float):
+        """Set the value, invalidating the cached text only if it changed."""
+        if value != self.value:
+            self.value = value
+            self._text = None
+
+    def _render(self) -> str:
+        return f"{self.name} {_format_value(self.value)}\n"
+
+
+class Counter(Gauge):
+    """Monotonically increasing total."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0):
+        """Increase the total."""
+        if amount:
+            self.value += amount
+            self._text = None
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        super().__init__(name, help_text)
+        # The +Inf bucket is always there
+        self.buckets = sorted(b for b in buckets if b != math.inf)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum: float = 0.0
+        self._labels = [f'{name}_bucket{{le="{_format_value(b)}"}} ' for b in self.buckets]
+        self._labels.append(f'{name}_bucket{{le="+Inf"}} ')
+
+    def observe(self, value: float):
+        """Add an observation."""
+        i = 0
+        buckets = self.buckets
+        while i < len(buckets) and value > buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self._text = None
+
+    def _render(self) -> str:
+        lines = []
+        total = 0
+        for label, count in zip(self._labels, self.counts):
+            total += count
+            lines.append(f"{label}{total}\n")
+        lines.append(f"{self.name}_sum {_format_value(self.sum)}\n")
+        lines.append(f"{self.name}_count {total}\n")
+        return "".join(lines)
+
+
+class MetricsRegistry:
+    """Set of metrics, rendered to Prometheus text format.
+
+    Updates happen in the control loop and renders in exporter threads, so
+    both take a short lock. Only metrics whose value changed since the last
+    render are formatted again; the others reuse their cached text.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        """Lock held while updating or rendering metrics."""
+        self._metrics: List[_Metric] = []
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        """Create and register a gauge."""
+        metric = Gauge(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        """Create and register a counter."""
+        metric = Counter(name, help_text)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float]) -> Histogram:
+        """Create and register a histogram."""
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        """Render all metrics.
+
+        Returns:
+            bytes: Prometheus text format, UTF-8 encoded
+        """
+        with self.lock:
+            return "".join(metric.render() for metric in self._metrics).encode('utf-8')
+
+
+class MetricsExporter:
+    """Serves a registry on localhost HTTP and/or writes it to a textfile.
+
+    Both run in background daemon threads, so a scrape or a slow disk never
+    blocks the control loop. The textfile is written to a temporary file and
+    renamed over the target, so node-exporter never reads a partial file.
+    """
+
+    def __init__(self, registry: MetricsRegistry, address: str = "127.0.0.1", port: int = 0,
+                 textfile: str = "", textfile_seconds: float = 15.0):
+        """Create an exporter, without starting it.
+
+        Args:
+            registry (MetricsRegistry): metrics to export
+            address (str): HTTP listen address
+            port (int): HTTP port, 0 to disable HTTP
+            textfile (str): node-exporter textfile path, empty to disable
+            textfile_seconds (float): period of textfile writes, in seconds
+        """
+        self.registry = registry
+        """Metrics to export."""
+        self.address = address
+        """HTTP listen address."""
+        self.port = port
+        """HTTP port, 0 if disabled."""
+        self.textfile = textfile
+        """node-exporter textfile path, empty if disabled."""
+        self.textfile_seconds = textfile_seconds
+        """Period of textfile writes, in seconds."""
+        self._server = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        """Start HTTP server and textfile writer, as configured.
+
+        Raises:
+            OSError: if the HTTP port cannot be bound
+        """
+        if self.port:
+            # Slow to import, and only needed when serving over HTTP
+            from http.server import BaseHTTPRequestHandler, HTTPServer
+            from socketserver import ThreadingMixIn
+
+            class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+                daemon_threads = True
+
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = registry.render()
+                    self.send_response(200)
+                    self.send_header('Content-Type', CONTENT_TYPE)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    # Keep scrapes out of the daemon log
+                    pass
+
+            self._server = ThreadingHTTPServer((self.address, self.port), Handler)
+            self._start_thread(self._server.serve_forever, "metrics-http")
+        if self.textfile:
+            self._start_thread(self._textfile_loop, "metrics-textfile")
+
+    def _start_thread(self, target, name: str):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def write_textfile(self):
+        """Write metrics to the textfile, atomically.
+
+        Raises:
+            OSError: if the file cannot be written
+        """
+        tmp_path = f"{self.textfile}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self.registry.render())
+        os.replace(tmp_path, self.textfile)
+
+    def _textfile_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.write_textfile()
+            except OSError:
+                # Retried next period, e.g. directory not yet mounted
+                pass
+            self._stop.wait(self.textfile_seconds)
+
+    def stop(self):
+        """Stop HTTP server and textfile writer."""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self._threads.clear()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# Dirty-region rendering of text fields on the SSD1306 OLED of the hat.
+
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from PIL import Image
+from PIL import ImageDraw
+
+SSD1306_COLUMNADDR = 0x21
+"""SSD1306 command to set column window."""
+SSD1306_PAGEADDR = 0x22
+"""SSD1306 command to set page window."""
+SSD1306_DATA = 0x40
+"""SSD1306 control byte for display data."""
+DATA_CHUNK = 16
+"""Display data bytes per i2c transaction."""
+RASTER_CACHE_SIZE = 64
+"""Maximum number of cached text rasters."""
+
+
+class DirtyDisplay:
+    """Text field display that only sends changed pixels to the OLED.
+
+    Each text field is rendered once per distinct value into a cached
+    raster. Changing a field erases the ink of its previous raster and
+    draws the new one, then only the framebuffer bytes under that area are
+    rebuilt. `spans()` compares them with what the panel already shows and
+    returns, per 8-pixel page, the range of columns that really changed, so
+    `push_span()` sends just those bytes.
+    """
+
+    def __init__(self, disp, font):
+        """Create an empty display, matching a panel that was just cleared.
+
+        Args:
+            disp (Adafruit_SSD1306.SSD1306Base): initialized display
+            font (ImageFont): font for all text fields
+        """
+        self.disp = disp
+        """OLED display driver."""
+        self.font = font
+        """Font for all text fields."""
+        self.width: int = disp.width
+        """Display width, in pixels."""
+        self.pages: int = disp.height // 8
+        """Display height, in 8-pixel pages."""
+        self.image = Image.new('1', (self.width, disp.height))
+        """Framebuffer image."""
+        self.bytes_sent: int = 0
+        """Display data bytes sent to the panel."""
+        self.rasters_rendered: int = 0
+        """Number of text rasters rendered, i.e. raster cache misses."""
+        self._pixels = self.image.load()
+        self._buffer = bytearray(self.width * self.pages)
+        self._sent = bytearray(self.width * self.pages)
+        self._dirty_pages: Dict[int, Tuple[int, int]] = {}
+        self._fields: Dict[str, Tuple[Tuple[int, int], str, Image.Image]] = {}
+        self._rasters: "OrderedDict[str, Image.Image]" = OrderedDict()
+
+    def _raster(self, text: str) -> Image.Image:
+        raster = self._rasters.get(text)
+        if raster is not None:
+            self._rasters.move_to_end(text)
+            return raster
+        if hasattr(self.font, 'getbbox'):
+            size = self.font.getbbox(text)[2:]
+        else:
+            size = self.font.getsize(text)
+        raster = Image.new('1', (max(1, size[0]), max(1, size[1])))
+        ImageDraw.Draw(raster).text((0, 0), text, font=self.font, fill=255)
+        self.rasters_rendered += 1
+        self._rasters[text] = raster
+        if len(self._rasters) > RASTER_CACHE_SIZE:
+            self._rasters.popitem(last=False)
+        return raster
+
+    def set_text(self, name: str, xy: Tuple[int, int], text: str):
+        """Set the text of a field, redrawing it only if changed.
+
+        Args:
+            name (str): field name
+            xy (Tuple[int, int]): top left position, in pixels
+            text (str): field text
+        """
+        old = self._fields.get(name)
+        if old is not None and old[0] == xy and old[1] == text:
+            return
+        raster = self._raster(text)
+        if old is not None:
+            # Erase only the old ink, so overlapping neighbour fields survive
+            self.image.paste(0, old[0], old[2])
+            self._mark(old[0], old[2].size)
+        self.image.paste(255, xy, raster)
+        self._mark(xy, raster.size)
+        self._fields[name] = (xy, text, raster)
+
+    def _mark(self, xy: Tuple[int, int], size: Tuple[int, int]):
+        x0 = max(0, xy[0])
+        x1 = min(self.width, xy[0] + size[0])
+        y0 = max(0, xy[1])
+        y1 = min(self.pages * 8, xy[1] + size[1])
+        if x0 >= x1 or y0 >= y1:
+            return
+        for page in range(y0 // 8, (y1 - 1) // 8 + 1):
+            start, end = self._dirty_pages.get(page, (x0, x1))
+            self._dirty_pages[page] = (min(start, x0), max(end, x1))
+
+    def spans(self) -> List[Tuple[int, int, int]]:
+        """Rebuild dirty framebuffer bytes and get the ranges to send.
+
+        Returns:
+            List[Tuple[int, int, int]]: `(page, first column, last column)` of changed bytes
+        """
+        pixels = self._pixels
+        spans = []
+        for page, (x0, x1) in sorted(self._dirty_pages.items()):
+            first = last = -1
+            base = page * self.width
+            y = page * 8
+            for x in range(x0, x1):
+                value = 0
+                for bit in range(8):
+                    if pixels[x, y + bit]:
+                        value |= 1 << bit
+                self._buffer[base + x] = value
+                if value != self._sent[base + x]:
+                    if first < 0:
+                        first = x
+                    last = x
+            if first >= 0:
+                spans.append((page, first, last))
+        self._dirty_pages.clear()
+        return spans
+
+    def push_span(self, span: Tuple[int, int, int]):
+        """Send one changed range of a page to the panel.
+
+        Args:
+            span (Tuple[int, int, int]): `(page, first column, last column)`, from `spans()`
+        """
+        page, first, last = span
+        self.disp.command(SSD1306_COLUMNADDR)
+        self.disp.command(first)
+        self.disp.command(last)
+        self.disp.command(SSD1306_PAGEADDR)
+        self.disp.command(page)
+        self.disp.command(page)
+        start = page * self.width + first
+        end = page * self.width + last + 1
+        for i in range(start, end, DATA_CHUNK):
+            self.disp._i2c.writeList(SSD1306_DATA, list(self._buffer[i:min(i + DATA_CHUNK, end)]))
+        self._sent[start:end] = self._buffer[start:end]
+        self.bytes_sent += end - start
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# Adaptive polling interval for the fan control loop.
+
+import time
+from typing import Callable, Optional, Tuple
+
+NEAR_THRESHOLD_TEMP = 2.0
+"""Distance to a threshold under which polling runs at the minimum interval, in Celsius."""
+BACKOFF_FACTOR = 1.5
+"""Growth of polling interval per wakeup while far from any threshold."""
+MAX_TEMP_SLEW = 1.0
+"""Assumed worst-case CPU temperature rise, in Celsius per second."""
+
+
+class AdaptivePoller:
+    """Sleeps between temperature checks, for longer the farther from a threshold.
+
+    Near the trigger or hysteresis temperature, polling runs every
+    `min_interval`. Farther away, the interval starts at `base_interval` and
+    grows geometrically up to `max_interval`, but never longer than the time
+    the temperature needs to reach the nearest threshold at `MAX_TEMP_SLEW`.
+
+    Wakeups follow absolute monotonic deadlines, so the time spent in the
+    loop body does not add drift to the interval.
+    """
+
+    def __init__(self, min_interval: float, base_interval: float, max_interval: float,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Optional[bool]] = time.sleep):
+        """Create a poller, starting its first deadline now.
+
+        Args:
+            min_interval (float): interval near a threshold, in seconds
+            base_interval (float): fixed interval used before, in seconds, also reference of saved wakeups
+            max_interval (float): longest interval, in seconds
+            clock (Callable[[], float]): monotonic time source, in seconds
+            sleep (Callable[[float], Optional[bool]]): sleep function, in seconds.
+                Returning True means it was woken early, e.g. by a control
+                request, and the next deadline counts from the wakeup.
+        """
+        self.min_interval: float
+        """Interval near a threshold, in seconds."""
+        self.max_interval: float
+        """Longest interval, in seconds."""
+        self.base_interval: float
+        """Starting interval far from thresholds, in seconds."""
+        self.reference_interval: float
+        """Fixed interval to compare wakeups with, in seconds."""
+        self.set_intervals(min_interval, base_interval, max_interval)
+        self.interval: float = self.min_interval
+        """Current interval, in seconds."""
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline = clock()
+        self._report_start = self._deadline
+        self._report_wakeups = 0
+
+    def set_intervals(self, min_interval: float, base_interval: float, max_interval: float):
+        """Change the intervals, keeping the current deadline and statistics.
+
+        Args:
+            min_interval (float): interval near a threshold, in seconds
+            base_interval (float): fixed interval used before, in seconds, also reference of saved wakeups
+            max_interval (float): longest interval, in seconds
+        """
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.base_interval = min(max(base_interval, self.min_interval), max_interval)
+        self.reference_interval = base_interval
+
+    def next_interval(self, temperature: float, on_temp: float, off_temp: float) -> float:
+        """Compute the interval until next temperature check.
+
+        Args:
+            temperature (float): current temperature, in Celsius
+            on_temp (float): temperature at which fan is turned on, in Celsius
+            off_temp (float): temperature at which fan is turned off, in Celsius
+
+        Returns:
+            float: interval, in seconds
+        """
+        distance = min(abs(temperature - on_temp), abs(temperature - off_temp))
+        if distance <= NEAR_THRESHOLD_TEMP:
+            interval = self.min_interval
+        elif self.interval < self.base_interval:
+            interval = self.base_interval
+        else:
+            interval = self.interval * BACKOFF_FACTOR
+        interval = min(interval, self.max_interval,
+                       max(self.min_interval, (distance - NEAR_THRESHOLD_TEMP) / MAX_TEMP_SLEW))
+        self.interval = interval
+        return interval
+
+    def wait(self, temperature: float, on_temp: float, off_temp: float):
+        """Sleep until the next deadline, chosen from the current temperature.
+
+        Args:
+            temperature (float): current temperature, in Celsius
+            on_temp (float): temperature at which fan is turned on, in Celsius
+            off_temp (float): temperature at which fan is turned off, in Celsius
+        """
+        self._deadline += self.next_interval(temperature, on_temp, off_temp)
+        now = self._clock()
+        if self._deadline < now - self.max_interval:
+            # Far behind, e.g. after a system suspend: restart from now
+            self._deadline = now
+        delay = self._deadline - now
+        if delay > 0 and self._sleep(delay):
+            self._deadline = self._clock()
+        self._report_wakeups += 1
+
+    @property
+    def report_elapsed(self) -> float:
+        """float: seconds since last report."""
+        return self._clock() - self._report_start
+
+    def report(self) -> Tuple[float, int, float]:
+        """Get wakeups since last report and restart counting.
+
+        Returns:
+            Tuple[float, int, float]: elapsed seconds, wakeups, and wakeups
+            saved per hour compared with a fixed `reference_interval`
+        """
+        now = self._clock()
+        elapsed = now - self._report_start
+        wakeups = self._report_wakeups
+        saved_per_hour = 0.0
+        if elapsed > 0 and self.reference_interval > 0:
+            saved_per_hour = (elapsed / self.reference_interval - wakeups) * 3600.0 / elapsed
+        self._report_start = now
+        self._report_wakeups = 0
+        return elapsed, wakeups, saved_per_hour
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# In-process system metrics, read from /proc, sysfs and statvfs.
+
+import fcntl
+import os
+import socket
+import struct
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from thermal_sampler import CPU_TEMP_FILE, ThermalSampler
+
+PROC_STAT_FILE = "/proc/stat"
+"""Kernel file with CPU time counters."""
+PROC_MEMINFO_FILE = "/proc/meminfo"
+"""Kernel file with memory usage."""
+SIOCGIFADDR = 0x8915
+"""ioctl to get IPv4 address of a network interface."""
+
+METRIC_INTERVALS = {
+    'cpu': 1.0,
+    'temp': 1.0,
+    'mem': 5.0,
+    'disk': 60.0,
+    'ip': 30.0,
+}
+"""Default refresh interval of each metric, in seconds."""
+
+
+class ProcReader:
+    """Reads a /proc file through a persistent descriptor, with pread at offset 0."""
+
+    def __init__(self, path: str, buffer_size: int = 4096):
+        """Create a reader, without opening the file yet.
+
+        Args:
+            path (str): path to file
+            buffer_size (int): maximum bytes read
+        """
+        self.path = path
+        """Path to file."""
+        self.buffer_size = buffer_size
+        """Maximum bytes read."""
+        self._fd = -1
+
+    def read(self) -> bytes:
+        """Read the file from its start.
+
+        Returns:
+            bytes: file contents, up to `buffer_size` bytes
+
+        Raises:
+            OSError: if the file cannot be read
+        """
+        if self._fd < 0:
+            self._fd = os.open(self.path, os.O_RDONLY)
+        try:
+            return os.pread(self._fd, self.buffer_size, 0)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        """Close the file. A later read opens it again."""
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            finally:
+                self._fd = -1
+
+
+class CpuLoad:
+    """CPU utilization from /proc/stat, as a delta with the previous sample.
+
+    Sampling never sleeps: the load is averaged over the time since the
+    previous call, so the caller's own period sets the averaging window.
+    """
+
+    def __init__(self, path: str = PROC_STAT_FILE):
+        """Create a sampler, taking no snapshot yet.
+
+        Args:
+            path (str): path to /proc/stat
+        """
+        self._reader = ProcReader(path, 16384)
+        self._last: Dict[bytes, Tuple[int, int]] = {}
+
+    def sample_all(self) -> Dict[str, float]:
+        """Sample utilization of all CPUs.
+
+        Returns:
+            Dict[str, float]: utilization in percent, by name: 'cpu' for
+            all cores and 'cpu0', 'cpu1'... per core. Empty on first call.
+        """
+        result = {}
+        for line in self._reader.read().split(b'\n'):
+            if not line.startswith(b'cpu'):
+                break
+            fields = line.split()
+            times = [int(value) for value in fields[1:11]]
+            total = sum(times)
+            # idle + iowait
+            idle = times[3] + (times[4] if len(times) > 4 else 0)
+            last = self._last.get(fields[0])
+            self._last[fields[0]] = (total, idle)
+            if last is not None and total > last[0]:
+                result[fields[0].decode()] = 100.0 * (1.0 - (idle - last[1]) / (total - last[0]))
+        return result
+
+    def sample(self) -> Optional[float]:
+        """Sample utilization of all cores together.
+
+        Returns:
+            Optional[float]: utilization in percent, None on first call
+        """
+        return self.sample_all().get('cpu')
+
+    def close(self):
+        """Close /proc/stat."""
+        self._reader.close()
+
+
+def read_memory(reader: ProcReader) -> Tuple[int, int]:
+    """Get available and total memory.
+
+    Args:
+        reader (ProcReader): reader of /proc/meminfo
+
+    Returns:
+        Tuple[int, int]: available and total memory, in MB
+    """
+    total = available = 0
+    for line in reader.read().split(b'\n'):
+        if line.startswith(b'MemTotal:'):
+            total = int(line.split()[1])
+        elif line.startswith(b'MemAvailable:'):
+            available = int(line.split()[1])
+            break
+    return available // 1024, total // 1024
+
+
+def read_disk(path: str = "/") -> Tuple[int, int]:
+    """Get free and total space of a filesystem.
+
+    Args:
+        path (str): mount point
+
+    Returns:
+        Tuple[int, int]: free and total space, in MB
+    """
+    st = os.statvfs(path)
+    return st.f_bfree * st.f_frsize // (1024 * 1024), st.f_blocks * st.f_frsize // (1024 * 1024)
+
+
+def read_ip_address() -> str:
+    """Get IPv4 address of the first configured interface other than loopback.
+
+    Returns:
+        str: IPv4 address, empty if none
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for _, name in socket.if_nameindex():
+            if name == 'lo':
+                continue
+            request = struct.pack('256s', name.encode()[:15])
+            try:
+                reply = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+            except OSError:
+                # No IPv4 address on this interface
+                continue
+            return socket.inet_ntoa(reply[20:24])
+    return ""
+
+
+class MetricsCollector:
+    """Cached system metrics, each refreshed at its own interval.
+
+    Replaces shell-outs to `cat`, `vcgencmd`, `free`, `df` and `hostname`:
+    every metric is read in-process, and `get()` returns the cached value
+    until the metric's interval expires.
+    """
+
+    def __init__(self, intervals: Optional[Dict[str, float]] = None,
+                 temp_file: str = CPU_TEMP_FILE,
+                 clock: Callable[[], float] = time.monotonic):
+        """Create a collector, with no metric read yet.
+
+        Args:
+            intervals (Optional[Dict[str, float]]): refresh interval by metric, in seconds
+            temp_file (str): CPU temperature file
+            clock (Callable[[], float]): monotonic time source, in seconds
+        """
+        self.intervals = dict(METRIC_INTERVALS)
+        """Refresh interval by metric, in seconds."""
+        if intervals:
+            self.intervals.update(intervals)
+        self.reads: int = 0
+        """Number of metric reads, i.e. cache misses."""
+        self._clock = clock
+        self._cpu = CpuLoad()
+        self._meminfo = ProcReader(PROC_MEMINFO_FILE)
+        self._temp = ThermalSampler(temp_file)
+        self._readers = {
+            'cpu': self._read_cpu,
+            'temp': self._temp.read,
+            'mem': lambda: read_memory(self._meminfo),
+            'disk': read_disk,
+            'ip': read_ip_address,
+        }
+        self._cache: Dict[str, Tuple[float, object]] = {}
+        self._cpu_load = 0.0
+
+    def _read_cpu(self) -> float:
+        load = self._cpu.sample()
+        if load is not None:
+            self._cpu_load = load
+        return self._cpu_load
+
+    def get(self, name: str, force: bool = False):
+        """Get a metric, from cache if still fresh.
+
+        Args:
+            name (str): one of 'cpu' (percent), 'temp' (Celsius),
+                'mem' and 'disk' (free and total MB), 'ip' (address)
+            force (bool): read the metric even if cached
+
+        Returns:
+            metric value
+        """
+        now = self._clock()
+        entry = self._cache.get(name)
+        if not force and entry is not None and now - entry[0] < self.intervals[name]:
+            return entry[1]
+        value = self._readers[name]()
+        self.reads += 1
+        self._cache[name] = (now, value)
+        return value
+
+    def close(self):
+        """Close all files kept open."""
+        self._cpu.close()
+        self._meminfo.close()
+        self._temp.close()
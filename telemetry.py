@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# In-memory telemetry of the fan control loop, with rolling window statistics.
+
+import math
+from array import array
+from collections import namedtuple
+from typing import Dict, List, Optional, Sequence, Tuple
+
+COLUMNS = ('time', 'temp', 'level', 'latency')
+"""Sample columns: monotonic time (s), temperature (Celsius), fan level (%), i2c time (s)."""
+COLUMN_TYPECODES = {'time': 'd', 'temp': 'f', 'level': 'B', 'latency': 'f'}
+"""`array` type code of each column."""
+HISTOGRAMS = {
+    'temp': (-40.0, 125.0, 0.1),
+    'latency': (0.0, 0.05, 0.00005),
+}
+"""Histogram range and bin width of columns with percentiles: `(low, high, step)`."""
+STAT_COLUMNS = ('temp', 'level', 'latency')
+"""Columns with window statistics."""
+
+WindowStats = namedtuple('WindowStats', ['count', 'min', 'max', 'mean'])
+"""Statistics of a column over a time window."""
+
+
+class _MonotonicQueue:
+    """Sliding window minimum (or maximum) over ring sequence numbers.
+
+    Backed by a preallocated `array` used as a circular deque, so pushes
+    and pops are amortized O(1) and allocate nothing.
+    """
+
+    def __init__(self, capacity: int, values: array, maximum: bool):
+        self._seqs = array('q', bytes(8 * capacity))
+        self._capacity = capacity
+        self._values = values
+        self._sign = -1.0 if maximum else 1.0
+        self._head = 0
+        self._size = 0
+
+    def push(self, seq: int, value: float):
+        capacity = self._capacity
+        values = self._values
+        sign = self._sign
+        # Drop queued samples that can no longer be the extreme
+        while self._size:
+            last = self._seqs[(self._head + self._size - 1) % capacity]
+            if sign * values[last % capacity] < sign * value:
+                break
+            self._size -= 1
+        self._seqs[(self._head + self._size) % capacity] = seq
+        self._size += 1
+
+    def evict(self, first_seq: int):
+        while self._size and self._seqs[self._head] < first_seq:
+            self._head = (self._head + 1) % self._capacity
+            self._size -= 1
+
+    def front(self) -> Optional[float]:
+        if not self._size:
+            return None
+        return self._values[self._seqs[self._head] % self._capacity]
+
+
+class _ColumnStats:
+    """Running sum, monotonic min/max queues and histogram of one column over a window."""
+
+    def __init__(self, name: str, capacity: int, values: array):
+        self.sum = 0.0
+        self.min = _MonotonicQueue(capacity, values, False)
+        self.max = _MonotonicQueue(capacity, values, True)
+        self.histogram: Optional[array] = None
+        if name in HISTOGRAMS:
+            low, high, step = HISTOGRAMS[name]
+            self._low, self._high, self._step = low, high, step
+            self._top = int(math.ceil((high - low) / step))
+            self.histogram = array('I', bytes(4 * (self._top + 1)))
+
+    def _bin(self, value: float) -> int:
+        if value <= self._low:
+            return 0
+        if value >= self._high:
+            return self._top
+        return int((value - self._low) / self._step)
+
+    def add(self, seq: int, value: float):
+        self.sum += value
+        self.min.push(seq, value)
+        self.max.push(seq, value)
+        if self.histogram is not None:
+            self.histogram[self._bin(value)] += 1
+
+    def remove(self, value: float):
+        # Queues drop the sample on `evict()`
+        self.sum -= value
+        if self.histogram is not None:
+            self.histogram[self._bin(value)] -= 1
+
+    def evict(self, first_seq: int):
+        self.min.evict(first_seq)
+        self.max.evict(first_seq)
+
+
+class _Window:
+    """Samples of the last `seconds`, with running statistics of the columns queried so far."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.first_seq = 0
+        self.stats: Dict[str, _ColumnStats] = {}
+
+
+class TelemetryRing:
+    """Fixed-size ring of control loop samples, with rolling window statistics.
+
+    Samples are stored column-wise in preallocated `array`s, so memory is
+    constant however long the daemon runs. The statistics of a column over
+    a window are built on its first query, from the samples in the window,
+    then kept up to date: running sum, monotonic min/max queues and
+    histogram are updated on append and on eviction, so min, max and mean
+    are O(1) to query, and percentiles cost a scan of the fixed histogram
+    bins, independent of window size. Appending only pays for the columns
+    and windows queried so far, the daemon reports temperature and fan
+    level of its largest window.
+
+    The capacity must hold the largest window at the fastest sample rate;
+    samples overwritten by the ring leave the windows early.
+    """
+
+    def __init__(self, capacity: int, windows: Sequence[float] = (60.0, 600.0, 3600.0)):
+        """Create an empty ring.
+
+        Args:
+            capacity (int): maximum number of samples kept
+            windows (Sequence[float]): statistic windows, in seconds
+        """
+        self.capacity = capacity
+        """Maximum number of samples kept."""
+        self.count: int = 0
+        """Total number of samples appended."""
+        self.columns: Dict[str, array] = {
+            name: array(COLUMN_TYPECODES[name], bytes(array(COLUMN_TYPECODES[name]).itemsize * capacity))
+            for name in COLUMNS}
+        """Sample columns, indexed by `sequence % capacity`."""
+        self.windows: Dict[float, _Window] = {float(seconds): _Window(float(seconds)) for seconds in windows}
+
+    def append(self, timestamp: float, temp: float, level: int, latency: float):
+        """Add a sample, updating the statistics of all windows.
+
+        Args:
+            timestamp (float): monotonic time, in seconds
+            temp (float): temperature, in Celsius
+            level (int): fan level, in percent
+            latency (float): i2c time spent, in seconds
+        """
+        seq = self.count
+        capacity = self.capacity
+        index = seq % capacity
+        columns = self.columns
+        # Overwritten sample must leave every window first
+        oldest = seq - capacity + 1
+        for window in self.windows.values():
+            if window.first_seq < oldest:
+                self._evict(window, oldest)
+        time_column = columns['time']
+        time_column[index] = timestamp
+        columns['temp'][index] = temp
+        columns['level'][index] = level
+        columns['latency'][index] = latency
+        self.count = seq + 1
+        for window in self.windows.values():
+            for name, stats in window.stats.items():
+                # Stored value, rounded like the ones evicted later
+                stats.add(seq, columns[name][index])
+            cutoff = timestamp - window.seconds
+            first = window.first_seq
+            while first < seq and time_column[first % capacity] <= cutoff:
+                first += 1
+            if first != window.first_seq:
+                self._evict(window, first)
+
+    def _evict(self, window: _Window, first_seq: int):
+        if window.stats:
+            columns = self.columns
+            for name, stats in window.stats.items():
+                column = columns[name]
+                for seq in range(window.first_seq, min(first_seq, self.count)):
+                    stats.remove(column[seq % self.capacity])
+                stats.evict(first_seq)
+        window.first_seq = first_seq
+
+    def _stats(self, column: str, seconds: float) -> Tuple[_Window, _ColumnStats]:
+        """Get a window and the statistics of a column over it, built from its samples on first use."""
+        window = self.windows[float(seconds)]
+        stats = window.stats.get(column)
+        if stats is None:
+            if column not in STAT_COLUMNS:
+                raise KeyError(column)
+            values = self.columns[column]
+            stats = _ColumnStats(column, self.capacity, values)
+            for seq in range(window.first_seq, self.count):
+                stats.add(seq, values[seq % self.capacity])
+            window.stats[column] = stats
+        return window, stats
+
+    def window_count(self, seconds: float) -> int:
+        """Get number of samples in a window.
+
+        Args:
+            seconds (float): configured window, in seconds
+
+        Returns:
+            int: number of samples
+        """
+        return self.count - self.windows[float(seconds)].first_seq
+
+    def stats(self, column: str, seconds: float) -> WindowStats:
+        """Get statistics of a column over a window.
+
+        Args:
+            column (str): 'temp', 'level' or 'latency'
+            seconds (float): configured window, in seconds
+
+        Returns:
+            WindowStats: count, min, max and mean, None values if window is empty
+        """
+        window, stats = self._stats(column, seconds)
+        count = self.count - window.first_seq
+        if count <= 0:
+            return WindowStats(0, None, None, None)
+        return WindowStats(count, stats.min.front(), stats.max.front(), stats.sum / count)
+
+    def percentile(self, column: str, seconds: float, q: float) -> Optional[float]:
+        """Get a percentile of a column over a window, at histogram resolution.
+
+        Args:
+            column (str): 'temp' or 'latency'
+            seconds (float): configured window, in seconds
+            q (float): percentile, from 0 to 100
+
+        Returns:
+            Optional[float]: upper edge of the bin holding the percentile, capped to
+            the window maximum, None if window is empty
+        """
+        low, high, step = HISTOGRAMS[column]
+        window, stats = self._stats(column, seconds)
+        count = self.count - window.first_seq
+        if count <= 0:
+            return None
+        rank = max(1, int(math.ceil(q / 100.0 * count)))
+        seen = 0
+        for i, n in enumerate(stats.histogram):
+            seen += n
+            if seen >= rank:
+                return min(high, low + (i + 1) * step, stats.max.front())
+        return high
+
+    def latest(self) -> Optional[Tuple[float, float, int, float]]:
+        """Get the last sample.
+
+        Returns:
+            Optional[Tuple[float, float, int, float]]: time, temperature, level and latency, None if empty
+        """
+        if not self.count:
+            return None
+        index = (self.count - 1) % self.capacity
+        return tuple(self.columns[name][index] for name in COLUMNS)
+
+    def history(self, since: float, limit: int = 0) -> List[Tuple[float, float, int, float]]:
+        """Get the samples taken from a time on, oldest first.
+
+        Args:
+            since (float): monotonic time of the oldest sample, in seconds
+            limit (int): maximum number of newest samples returned, 0 for all
+
+        Returns:
+            List[Tuple[float, float, int, float]]: time, temperature, level and latency
+        """
+        time_column = self.columns['time']
+        first = max(0, self.count - self.capacity)
+        if limit > 0:
+            first = max(first, self.count - limit)
+        seq = self.count
+        while seq > first and time_column[(seq - 1) % self.capacity] >= since:
+            seq -= 1
+        columns = [self.columns[name] for name in COLUMNS]
+        return [tuple(column[i % self.capacity] for column in columns) for i in range(seq, self.count)]
+
+    def view(self, column: str) -> memoryview:
+        """Get a read-only view of a raw column, without copying it.
+
+        Args:
+            column (str): one of `COLUMNS`
+
+        Returns:
+            memoryview: column values, indexed by `sequence % capacity`
+        """
+        return memoryview(self.columns[column]).toreadonly()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# Binary telemetry of the fan daemon, in a fixed-size memory-mapped ring file that outlives restarts.
+
+import mmap
+import os
+import struct
+import time
+from enum import IntFlag
+from typing import Iterator, List, Optional, Tuple
+
+MAGIC = b"YFANTLM\0"
+"""First bytes of a telemetry file."""
+VERSION = 1
+"""Layout version of the file, changed on any incompatible change."""
+HEADER = struct.Struct('<8sHHIQd')
+"""File header: magic, version, record size, capacity, records written and creation time."""
+HEADER_SIZE = 64
+"""Bytes reserved for the header, records start right after."""
+COUNT_OFFSET = struct.calcsize('<8sHHI')
+"""Offset of the records written counter in the header."""
+COUNT = struct.Struct('<Q')
+"""Records written counter, the only header field changing after creation."""
+RECORD = struct.Struct('<dhBB')
+"""Sample record: wall time (s), temperature (centi-Celsius), fan level (%) and flags."""
+RECORD_FIELDS = ('time', 'temp', 'level', 'flags')
+"""Names of the record fields."""
+TEMP_SCALE = 100.0
+"""Stored temperature units per degree Celsius."""
+NUMPY_DTYPE = [('time', '<f8'), ('temp', '<i2'), ('level', 'u1'), ('flags', 'u1')]
+"""NumPy structured dtype description of a record, same layout as `RECORD`."""
+
+
+class SampleFlags(IntFlag):
+    """Conditions of the daemon at a sample, stored as a bit mask."""
+    START = 0x01
+    """First sample after the daemon started."""
+    OVERRIDE = 0x02
+    """Fan level forced through the control socket."""
+    SENSOR_FAILURE = 0x04
+    """Some temperature sensors failed to read."""
+    FEED_FORWARD = 0x08
+    """CPU load feed-forward offset applied."""
+    I2C_ERROR = 0x10
+    """i2c transfer errors since previous sample."""
+
+
+def file_size(capacity: int) -> int:
+    """Get the size of a telemetry file.
+
+    Args:
+        capacity (int): number of records
+
+    Returns:
+        int: size in bytes
+    """
+    return HEADER_SIZE + capacity * RECORD.size
+
+
+class TelemetryFile:
+    """Append-only ring of samples in a preallocated, memory-mapped file.
+
+    Appending packs one record into the shared mapping, then bumps the
+    records written counter of the header: no system call and no
+    allocation, the kernel writes dirty pages back on its own schedule
+    (every 30 s on Raspberry Pi OS, and at most the header page and one or
+    two record pages each time), so the card sees a bounded number of
+    writes whatever the polling rate. Readers map the same file and see
+    new records at once.
+
+    The file is allocated in full on creation, so a full disk fails at
+    start instead of with a bus error on a later append. An existing file
+    with the same layout and capacity is reused and keeps its samples;
+    any other file is overwritten.
+    """
+
+    def __init__(self, path: str, capacity: int):
+        """Open or create a telemetry file.
+
+        Args:
+            path (str): file path
+            capacity (int): number of records kept, older ones are overwritten
+
+        Raises:
+            OSError: if the file cannot be created, allocated or mapped
+            ValueError: if capacity is not positive
+        """
+        if capacity < 1:
+            raise ValueError(f"Invalid telemetry file capacity {capacity}.")
+        self.path = path
+        """File path."""
+        self.capacity = capacity
+        """Number of records kept."""
+        self.reused = False
+        """Whether the samples of an existing file were kept."""
+        size = file_size(capacity)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self.reused = _read_header(fd, size) == capacity
+            if not self.reused:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                if hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(fd, 0, size)
+            self._map = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        if not self.reused:
+            self._map[:HEADER_SIZE] = HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0, time.time()).ljust(
+                HEADER_SIZE, b'\0')
+        self.count: int = COUNT.unpack_from(self._map, COUNT_OFFSET)[0]
+        """Number of records written since the file was created."""
+
+    def append(self, timestamp: float, temp: float, level: int, flags: int = 0):
+        """Append a sample, overwriting the oldest one when full.
+
+        Args:
+            timestamp (float): wall time, in seconds since the epoch
+            temp (float): temperature, in Celsius
+            level (int): fan level, in percent
+            flags (int): `SampleFlags` of the sample
+        """
+        count = self.count
+        centi = round(temp * TEMP_SCALE)
+        RECORD.pack_into(self._map, HEADER_SIZE + (count % self.capacity) * RECORD.size,
+                         timestamp, max(-32768, min(32767, centi)), level, flags)
+        # Record first: a reader trusting the counter never sees a half-written new record
+        self.count = count + 1
+        COUNT.pack_into(self._map, COUNT_OFFSET, count + 1)
+
+    def flush(self):
+        """Write dirty pages to the card now, e.g. before a shutdown."""
+        self._map.flush()
+
+    def close(self):
+        """Flush and unmap the file."""
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+
+
+def _read_header(fd: int, size: int) -> Optional[int]:
+    """Get the capacity of an existing telemetry file.
+
+    Returns:
+        Optional[int]: capacity, None if not a valid telemetry file of `size` bytes
+    """
+    if os.fstat(fd).st_size != size:
+        return None
+    data = os.pread(fd, HEADER.size, 0)
+    if len(data) < HEADER.size:
+        return None
+    magic, version, record_size, capacity, _, _ = HEADER.unpack(data)
+    if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+        return None
+    return capacity
+
+
+class TelemetryFileReader:
+    """Read-only view of a telemetry file, possibly written by the running daemon.
+
+    Records are read in place from a shared mapping. As the daemon may
+    overwrite the oldest records while they are read, `samples()` and
+    `array()` drop the ones overwritten during the read.
+    """
+
+    def __init__(self, path: str):
+        """Map a telemetry file.
+
+        Args:
+            path (str): file path
+
+        Raises:
+            OSError: if the file cannot be opened
+            ValueError: if the file is not a telemetry file
+        """
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError(f"'{path}' is not a telemetry file.")
+            self._map = mmap.mmap(f.fileno(), size, mmap.MAP_SHARED, mmap.PROT_READ)
+        magic, version, record_size, capacity, _, created = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or record_size != RECORD.size or size != file_size(capacity):
+            self._map.close()
+            raise ValueError(f"'{path}' is not a telemetry file.")
+        if version != VERSION:
+            self._map.close()
+            raise ValueError(f"Unsupported telemetry file version {version} of '{path}'.")
+        self.capacity: int = capacity
+        """Number of records kept."""
+        self.created: float = created
+        """Wall time the file was created, in seconds since the epoch."""
+
+    @property
+    def count(self) -> int:
+        """Number of records written since the file was created."""
+        return COUNT.unpack_from(self._map, COUNT_OFFSET)[0]
+
+    def records(self) -> memoryview:
+        """Get the raw records, without copying.
+
+        The view pins the mapping: release it before `close()`.
+
+        Returns:
+            memoryview: all `capacity` records, in ring order: record `n` is at `n % capacity`
+        """
+        return memoryview(self._map)[HEADER_SIZE:]
+
+    def _span(self, count: int) -> Tuple[int, int]:
+        """Get the ring slots of the records kept, oldest first, as a start slot and a length."""
+        length = min(count, self.capacity)
+        return (count - length) % self.capacity, length
+
+    def samples(self, since: float = 0.0) -> List[Tuple[float, float, int, int]]:
+        """Get the samples kept, oldest first.
+
+        Args:
+            since (float): only samples from this wall time on, in seconds since the epoch
+
+        Returns:
+            List[Tuple[float, float, int, int]]: wall time, temperature in Celsius, fan level and flags
+        """
+        count = self.count
+        start, length = self._span(count)
+        records = self.records()
+        size = RECORD.size
+        end = start + length - self.capacity
+        chunks = (records[start * size:], records[:end * size]) if end > 0 else (
+            records[start * size:(start + length) * size],)
+        samples = [(timestamp, temp / TEMP_SCALE, level, flags)
+                   for chunk in chunks for timestamp, temp, level, flags in RECORD.iter_unpack(chunk)]
+        del samples[:self._overwritten(count)]
+        if since:
+            samples = [sample for sample in samples if sample[0] >= since]
+        return samples
+
+    def _overwritten(self, count: int) -> int:
+        """Get how many of the oldest records read from `count` were overwritten by later appends."""
+        written = self.count - count
+        if count < self.capacity:
+            return max(0, written - (self.capacity - count))
+        return min(written, self.capacity)
+
+    def array(self) -> "numpy.ndarray":
+        """Get the samples kept as a NumPy structured array, oldest first.
+
+        Fields are named as `RECORD_FIELDS`, with temperatures in
+        centi-Celsius. Use `ring()` for a view without copying.
+
+        Returns:
+            numpy.ndarray: samples, a copy
+
+        Raises:
+            ImportError: if NumPy is not installed
+        """
+        import numpy
+        count = self.count
+        start, length = self._span(count)
+        ring = self.ring()
+        samples = numpy.concatenate((ring[start:start + length], ring[:max(0, start + length - self.capacity)]))
+        return samples[self._overwritten(count):]
+
+    def ring(self) -> "numpy.ndarray":
+        """Get all records as a read-only NumPy structured array, without copying.
+
+        Record `n` is at index `n % capacity`, and the daemon keeps
+        writing into it; `count` tells where the newest record is. The
+        array pins the mapping: delete it, and any view of it, before
+        `close()`.
+
+        Returns:
+            numpy.ndarray: `capacity` records, in ring order
+
+        Raises:
+            ImportError: if NumPy is not installed
+        """
+        import numpy
+        return numpy.frombuffer(self._map, dtype=numpy.dtype(NUMPY_DTYPE), count=self.capacity, offset=HEADER_SIZE)
+
+    def iter_new(self, count: int) -> Iterator[Tuple[int, Tuple[float, float, int, int]]]:
+        """Iterate over records written from a given count on, to follow the file.
+
+        Args:
+            count (int): records written at the previous call, 0 at first
+
+        Returns:
+            Iterator[Tuple[int, Tuple[float, float, int, int]]]: record number and sample, oldest first
+        """
+        end = self.count
+        for number in range(max(count, end - self.capacity), end):
+            timestamp, temp, level, flags = RECORD.unpack_from(
+                self._map, HEADER_SIZE + (number % self.capacity) * RECORD.size)
+            yield number, (timestamp, temp / TEMP_SCALE, level, flags)
+
+    def close(self):
+        """Unmap the file.
+
+        Raises:
+            BufferError: if views from `records()` or arrays from `ring()` are still alive, the file stays mapped
+        """
+        self._map.close()
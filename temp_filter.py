@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# Noise filters of temperature samples, between the sensor read and the fan decision.
+
+import math
+from enum import Enum
+from typing import List, Optional
+
+
+class FilterTypes(Enum):
+    """Possible temperature sample filters."""
+    NONE = "none"
+    """Samples used as read."""
+    EMA = "ema"
+    """Exponential moving average, with a time constant."""
+    MEDIAN = "median"
+    """Median of the last samples, dropping isolated spikes."""
+    KALMAN = "kalman"
+    """Scalar Kalman filter of a slowly drifting temperature."""
+
+
+class SampleFilter:
+    """Filter of temperature samples, without filtering: samples pass as read.
+
+    Every filter keeps a constant-size state, whatever the run length, and
+    takes the sample time, as the adaptive polling makes intervals uneven.
+    The first sample after creation or `reset()` always passes as read, so
+    a new filter never delays the first fan decision.
+    """
+
+    def update(self, temperature: float, now: float) -> float:
+        """Filter a new sample.
+
+        Args:
+            temperature (float): sample temperature, in Celsius
+            now (float): monotonic time of sample, in seconds
+
+        Returns:
+            float: filtered temperature, in Celsius
+        """
+        return temperature
+
+    def reset(self):
+        """Forget past samples."""
+
+
+class EmaFilter(SampleFilter):
+    """Exponential moving average, weighted by the time between samples.
+
+    Each sample moves the output by `1 - exp(-dt / time_constant)` of its
+    distance, so a step is followed with the same delay at any polling
+    interval: 63% of it after `time_constant` seconds.
+    """
+
+    def __init__(self, time_constant: float):
+        """Create a filter, without samples.
+
+        Args:
+            time_constant (float): time to follow 63% of a step, in seconds
+        """
+        self.time_constant = time_constant
+        """Time to follow 63% of a step, in seconds."""
+        self.value: Optional[float] = None
+        """Filtered temperature in Celsius, None before the first sample."""
+        self._last_time: float = 0.0
+
+    def update(self, temperature: float, now: float) -> float:
+        if self.value is None or self.time_constant <= 0:
+            self.value = temperature
+        else:
+            alpha = 1.0 - math.exp(-max(0.0, now - self._last_time) / self.time_constant)
+            self.value += alpha * (temperature - self.value)
+        self._last_time = now
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class MedianFilter(SampleFilter):
+    """Median of the last `window` samples, kept in a fixed-size ring.
+
+    A spike lasting less than half the window is dropped entirely, at the
+    cost of a delay of half the window in samples on a real step.
+    """
+
+    def __init__(self, window: int):
+        """Create a filter, without samples.
+
+        Args:
+            window (int): number of samples, at least 1
+        """
+        self.window = window
+        """Number of samples of the median."""
+        self._ring: List[float] = [0.0] * window
+        self._count = 0
+        self._index = 0
+
+    def update(self, temperature: float, now: float) -> float:
+        self._ring[self._index] = temperature
+        self._index = (self._index + 1) % self.window
+        if self._count < self.window:
+            self._count += 1
+        ordered = sorted(self._ring[:self._count])
+        middle = self._count // 2
+        if self._count % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle]) / 2
+
+    def reset(self):
+        self._count = 0
+        self._index = 0
+
+
+class KalmanFilter(SampleFilter):
+    """Scalar Kalman filter, modelling the temperature as a random walk.
+
+    The estimate variance grows by `process_noise` per second between
+    samples, and each sample is weighted against `measurement_noise`, so
+    the filter follows fast after a long gap or a large drift, and smooths
+    hard while samples come close together.
+    """
+
+    def __init__(self, process_noise: float, measurement_noise: float):
+        """Create a filter, without samples.
+
+        Args:
+            process_noise (float): temperature drift variance, in Celsius squared per second
+            measurement_noise (float): sample noise variance, in Celsius squared
+        """
+        self.process_noise = process_noise
+        """Temperature drift variance, in Celsius squared per second."""
+        self.measurement_noise = measurement_noise
+        """Sample noise variance, in Celsius squared."""
+        self.value: Optional[float] = None
+        """Filtered temperature in Celsius, None before the first sample."""
+        self.variance: float = 0.0
+        """Variance of the filtered temperature, in Celsius squared."""
+        self._last_time: float = 0.0
+
+    def update(self, temperature: float, now: float) -> float:
+        if self.value is None:
+            self.value = temperature
+            self.variance = self.measurement_noise
+        else:
+            variance = self.variance + self.process_noise * max(0.0, now - self._last_time)
+            total = variance + self.measurement_noise
+            gain = variance / total if total > 0 else 1.0
+            self.value += gain * (temperature - self.value)
+            self.variance = (1.0 - gain) * variance
+        self._last_time = now
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+def create_filter(kind: FilterTypes, time_constant: float, window: int,
+                  process_noise: float, measurement_noise: float) -> SampleFilter:
+    """Create a temperature sample filter.
+
+    Args:
+        kind (FilterTypes): filter type
+        time_constant (float): time constant of the EMA filter, in seconds
+        window (int): number of samples of the median filter
+        process_noise (float): drift variance of the Kalman filter, in Celsius squared per second
+        measurement_noise (float): sample variance of the Kalman filter, in Celsius squared
+
+    Returns:
+        SampleFilter: filter, without samples
+    """
+    if kind == FilterTypes.EMA:
+        return EmaFilter(time_constant)
+    if kind == FilterTypes.MEDIAN:
+        return MedianFilter(window)
+    if kind == FilterTypes.KALMAN:
+        return KalmanFilter(process_noise, measurement_noise)
+    return SampleFilter()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# Temperature sampling from sysfs thermal zones and hwmon sensors, keeping file descriptors open.
+
+import fnmatch
+import glob
+import os
+import re
+from enum import Enum
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+CPU_TEMP_FILE = "/sys/class/thermal/thermal_zone0/temp"
+"""Kernel device file with CPU temperature, in millidegrees Celsius."""
+THERMAL_DIR = "/sys/class/thermal"
+"""Kernel directory of thermal zones."""
+HWMON_DIR = "/sys/class/hwmon"
+"""Kernel directory of hardware monitoring chips."""
+CPU_SENSOR = "cpu"
+"""Sensor name of `CPU_TEMP_FILE`, when no sensor is configured."""
+AUTO_SENSORS = "auto"
+"""Sensor selection meaning every discovered sensor."""
+
+_DIGIT_0 = ord('0')
+_MINUS = ord('-')
+
+
+def parse_millidegrees(buffer, length: int) -> int:
+    """Parse a sysfs temperature, without creating intermediate strings.
+
+    Args:
+        buffer (bytes-like): raw file contents, like b"48312\\n"
+        length (int): number of valid bytes in buffer
+
+    Returns:
+        int: temperature in millidegrees Celsius
+
+    Raises:
+        ValueError: if buffer does not start with an integer
+    """
+    value = 0
+    sign = 1
+    digits = 0
+    i = 0
+    if length > 0 and buffer[0] == _MINUS:
+        sign = -1
+        i = 1
+    while i < length:
+        digit = buffer[i] - _DIGIT_0
+        if digit < 0 or digit > 9:
+            break
+        value = value * 10 + digit
+        digits += 1
+        i += 1
+    if digits == 0:
+        raise ValueError(f"Invalid temperature value: {bytes(buffer[:length])!r}")
+    return sign * value
+
+
+class ThermalSampler:
+    """Reads a sysfs temperature file through a persistent file descriptor.
+
+    Every sample is a single `pread` at offset 0 into a reused buffer, instead
+    of open/read/close. If the sensor disappears (e.g. a driver reload), the
+    descriptor is dropped and reopened on the next sample, so a sensor that
+    reappears is picked up again without restarting the caller.
+    """
+
+    def __init__(self, path: str = CPU_TEMP_FILE, buffer_size: int = 16):
+        """Create a sampler, without opening the file yet.
+
+        Args:
+            path (str): path to sysfs temperature file
+            buffer_size (int): size of read buffer, in bytes
+        """
+        self.path = path
+        """Path to sysfs temperature file."""
+        self.reopens: int = 0
+        """Number of times the file was reopened after an error."""
+        self._fd = -1
+        self._buffer = bytearray(buffer_size)
+        self._views = [self._buffer]
+        self._had_error = False
+
+    def open(self):
+        """Open the temperature file, if not already open.
+
+        Raises:
+            OSError: if the file cannot be opened
+        """
+        if self._fd < 0:
+            self._fd = os.open(self.path, os.O_RDONLY)
+            if self._had_error:
+                self.reopens += 1
+                self._had_error = False
+
+    def close(self):
+        """Close the temperature file. A later sample opens it again."""
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            finally:
+                self._fd = -1
+
+    def _pread(self) -> int:
+        self.open()
+        if hasattr(os, 'preadv'):
+            return os.preadv(self._fd, self._views, 0)
+        data = os.pread(self._fd, len(self._buffer), 0)
+        self._buffer[:len(data)] = data
+        return len(data)
+
+    def read_millidegrees(self) -> int:
+        """Sample the temperature.
+
+        Returns:
+            int: temperature in millidegrees Celsius
+
+        Raises:
+            OSError: if the file cannot be read, even after reopening it
+            ValueError: if the file contents are not a temperature
+        """
+        try:
+            length = self._pread()
+        except OSError:
+            # Stale descriptor after the sensor went away: retry once on a new one
+            self._had_error = True
+            self.close()
+            try:
+                length = self._pread()
+            except OSError:
+                self.close()
+                raise
+        return parse_millidegrees(self._buffer, length)
+
+    def read(self) -> float:
+        """Sample the temperature.
+
+        Returns:
+            float: temperature in Celsius
+
+        Raises:
+            OSError: if the file cannot be read, even after reopening it
+            ValueError: if the file contents are not a temperature
+        """
+        return self.read_millidegrees() / 1000.0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _natural_key(path: str) -> List:
+    # hwmon10 after hwmon9
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+def _read_text(path: str) -> str:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def discover_sensors(thermal_dir: str = THERMAL_DIR, hwmon_dir: str = HWMON_DIR) -> Dict[str, str]:
+    """Find the temperature sensors of the system.
+
+    Thermal zones are named after their type, like `cpu-thermal`, and hwmon
+    inputs after their chip and label, like `nvme/Composite`. A hwmon chip
+    that only mirrors a thermal zone is skipped. Repeated names get a `#2`,
+    `#3`... suffix.
+
+    Args:
+        thermal_dir (str): directory of thermal zones
+        hwmon_dir (str): directory of hwmon chips
+
+    Returns:
+        Dict[str, str]: temperature file by sensor name, thermal zones first
+    """
+    found = []
+    zone_types = set()
+    for zone in sorted(glob.glob(os.path.join(thermal_dir, 'thermal_zone*')), key=_natural_key):
+        path = os.path.join(zone, 'temp')
+        if os.path.exists(path):
+            zone_type = _read_text(os.path.join(zone, 'type')) or os.path.basename(zone)
+            zone_types.add(zone_type.replace('-', '_'))
+            found.append((zone_type, path))
+    for chip in sorted(glob.glob(os.path.join(hwmon_dir, 'hwmon*')), key=_natural_key):
+        chip_name = _read_text(os.path.join(chip, 'name')) or os.path.basename(chip)
+        if chip_name in zone_types and not os.path.exists(os.path.join(chip, 'device')):
+            # Registered by the thermal zone itself, same sensor
+            continue
+        for path in sorted(glob.glob(os.path.join(chip, 'temp*_input')), key=_natural_key):
+            prefix = path[:-len('_input')]
+            label = _read_text(prefix + '_label') or os.path.basename(prefix)
+            found.append((f"{chip_name}/{label}", path))
+    sensors = {}
+    for name, path in found:
+        unique = name
+        count = 1
+        while unique in sensors:
+            count += 1
+            unique = f"{name}#{count}"
+        sensors[unique] = path
+    return sensors
+
+
+def select_sensors(spec: str, thermal_dir: str = THERMAL_DIR, hwmon_dir: str = HWMON_DIR) -> Dict[str, str]:
+    """Get the sensors chosen in configuration.
+
+    Args:
+        spec (str): empty for `CPU_TEMP_FILE` only, `AUTO_SENSORS` for all discovered
+            sensors, or comma separated sensor name patterns, like "cpu-thermal, nvme/*",
+            and absolute temperature file paths
+        thermal_dir (str): directory of thermal zones
+        hwmon_dir (str): directory of hwmon chips
+
+    Returns:
+        Dict[str, str]: temperature file by sensor name
+
+    Raises:
+        ValueError: if a pattern matches no sensor
+    """
+    spec = spec.strip()
+    if not spec:
+        return {CPU_SENSOR: CPU_TEMP_FILE}
+    discovered = discover_sensors(thermal_dir, hwmon_dir)
+    if spec == AUTO_SENSORS:
+        if not discovered:
+            raise ValueError("No temperature sensor found.")
+        return discovered
+    sensors = {}
+    for pattern in (item.strip() for item in spec.split(',')):
+        if not pattern:
+            continue
+        if os.path.isabs(pattern):
+            sensors[pattern] = pattern
+            continue
+        matches = fnmatch.filter(discovered, pattern)
+        if not matches:
+            raise ValueError(f"No temperature sensor matches '{pattern}'.")
+        for name in matches:
+            sensors[name] = discovered[name]
+    return sensors
+
+
+class SensorSet:
+    """Samples several temperature files in one pass, each through its own `ThermalSampler`.
+
+    A sensor that fails, like an unplugged NVMe drive, reads None and is
+    retried on every pass, so the other sensors go on driving the fan.
+    """
+
+    def __init__(self, sensors: Dict[str, str]):
+        """Create a set, without opening the files yet.
+
+        Args:
+            sensors (Dict[str, str]): temperature file by sensor name
+        """
+        self.names: List[str] = list(sensors)
+        """Sensor names."""
+        self.paths: List[str] = list(sensors.values())
+        """Temperature file of each sensor."""
+        self.temps: List[Optional[float]] = [None] * len(self.names)
+        """Last temperature of each sensor in Celsius, None if it failed."""
+        self.failed: Set[str] = set()
+        """Names of sensors that failed on the last pass."""
+        self._samplers = [ThermalSampler(path) for path in self.paths]
+
+    def read(self) -> List[Optional[float]]:
+        """Sample all sensors.
+
+        Returns:
+            List[Optional[float]]: temperature of each sensor in Celsius, None if it failed
+
+        Raises:
+            OSError: if every sensor failed, the error of the first one
+            ValueError: if every sensor failed, and the first one holds no temperature
+        """
+        temps = self.temps
+        first_error = None
+        for i, sampler in enumerate(self._samplers):
+            try:
+                temps[i] = sampler.read_millidegrees() / 1000.0
+            except (OSError, ValueError) as e:
+                temps[i] = None
+                if first_error is None:
+                    first_error = e
+        if first_error is not None:
+            self.failed = {name for name, temp in zip(self.names, temps) if temp is None}
+            if len(self.failed) == len(temps):
+                raise first_error
+        elif self.failed:
+            self.failed = set()
+        return temps
+
+    def close(self):
+        """Close all temperature files. A later pass opens them again."""
+        for sampler in self._samplers:
+            sampler.close()
+
+
+class FusionPolicies(Enum):
+    """Ways to combine several sensors into one temperature."""
+    MAX = "max"
+    """Hottest sensor."""
+    WEIGHTED = "weighted"
+    """Weighted mean of sensors."""
+    THRESHOLD = "threshold"
+    """Sensor nearest to its own trigger temperature, shifted onto the control trigger temperature."""
+
+
+def parse_sensor_values(text: str) -> List[Tuple[str, float]]:
+    """Parse per sensor values from configuration.
+
+    Args:
+        text (str): comma separated `pattern:value` pairs, like "nvme/*:70, cpu-thermal:55"
+
+    Returns:
+        List[Tuple[str, float]]: sensor name pattern and value, in given order
+
+    Raises:
+        ValueError: if text is not valid
+    """
+    values = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        pattern, sep, value = item.rpartition(':')
+        if not sep or not pattern.strip():
+            raise ValueError(f"Invalid sensor value '{item}', expected 'pattern:value'.")
+        values.append((pattern.strip(), float(value)))
+    return values
+
+
+class SensorFusion:
+    """Combines the readings of a `SensorSet` into the temperature that drives the fan.
+
+    Per sensor weights and trigger temperatures are resolved once, by the
+    first matching pattern, so each fusion is one pass over the readings.
+    Failed sensors are left out.
+
+    With the threshold policy, a sensor with its own trigger temperature
+    counts as `trigger_temp + (temperature - own trigger)`: an NVMe drive
+    at 68°C with a 70°C trigger reads as 2°C below the control trigger.
+    Thresholds of every control mode then apply to all sensors at once.
+    """
+
+    def __init__(self, names: Sequence[str], policy: FusionPolicies,
+                 weights: Sequence[Tuple[str, float]] = (), triggers: Sequence[Tuple[str, float]] = ()):
+        """Resolve the per sensor values.
+
+        Args:
+            names (Sequence[str]): sensor names, in reading order
+            policy (FusionPolicies): fusion policy
+            weights (Sequence[Tuple[str, float]]): weight by name pattern, default 1, used by the weighted policy
+            triggers (Sequence[Tuple[str, float]]): trigger temperature by name pattern, in Celsius,
+                default the control trigger temperature, used by the threshold policy
+
+        Raises:
+            ValueError: if a weight is negative
+        """
+        self.policy = policy
+        """Fusion policy."""
+        self.weights: List[float] = [self._lookup(name, weights, 1.0) for name in names]
+        """Weight of each sensor."""
+        self.triggers: List[Optional[float]] = [self._lookup(name, triggers, None) for name in names]
+        """Own trigger temperature of each sensor in Celsius, None for the control trigger temperature."""
+        if any(weight < 0 for weight in self.weights):
+            raise ValueError("Sensor weights must not be negative.")
+
+    @staticmethod
+    def _lookup(name: str, values: Sequence[Tuple[str, float]], default):
+        for pattern, value in values:
+            if fnmatch.fnmatchcase(name, pattern):
+                return value
+        return default
+
+    def fuse(self, temps: Sequence[Optional[float]], trigger_temp: float) -> float:
+        """Combine sensor readings.
+
+        Args:
+            temps (Sequence[Optional[float]]): temperature of each sensor in Celsius, None if failed
+            trigger_temp (float): control trigger temperature, in Celsius
+
+        Returns:
+            float: temperature driving the fan, in Celsius
+        """
+        if self.policy == FusionPolicies.WEIGHTED:
+            total = 0.0
+            weight_sum = 0.0
+            for temp, weight in zip(temps, self.weights):
+                if temp is not None:
+                    total += temp * weight
+                    weight_sum += weight
+            if weight_sum > 0:
+                return total / weight_sum
+            # Only 0 weight sensors left
+            return max(temp for temp in temps if temp is not None)
+        if self.policy == FusionPolicies.THRESHOLD:
+            return trigger_temp + max(temp - (trigger_temp if trigger is None else trigger)
+                                      for temp, trigger in zip(temps, self.triggers) if temp is not None)
+        return max(temp for temp in temps if temp is not None)
@@ -7,9 +7,12 @@ After=multi-user.target
 [Service]
 Environment=LANGUAGE="C.UTF-8"
 ExecStart=/usr/bin/python3 __INSTALL_DIR__/fan_temp_hysteresis.py
+ExecReload=/bin/kill -HUP $MAINPID
 WorkingDirectory=__INSTALL_DIR__
 Type=simple
 User=__USER__
+# Directory of the control socket, /run/yahboom-fan-ctrl
+RuntimeDirectory=yahboom-fan-ctrl
 RestartPreventExitStatus=1 127
 Restart=on-failure
 RestartSec=5s